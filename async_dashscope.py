@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于 asyncio 的 DashScope 文本生成客户端：直接调用HTTP接口（含SSE流式输出），
+所有请求共用一个 aiohttp 连接池，支持单次请求超时和取消（取消任务即关闭连接）。
+
+一个事件循环可以同时挂起成百上千个请求，不再需要每个请求一个线程。
+同步代码（如Tk界面的工作线程）可以通过 complete()/stream() 使用同一个连接池，
+请求在后台的事件循环线程中执行。没有安装 aiohttp 时仍可使用 llm_backend.DashScopeBackend（线程方式）。
+
+连接池中的连接长时间保持（keepalive_timeout），warm_up() 可以在第一次请求之前就建立好连接，
+省去每轮的DNS、TCP和TLS握手；每次请求建立连接的耗时会写入调用方传入的 trace 字典。
+"""
+
+import asyncio
+import gzip
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:  # dashscope 依赖 aiohttp，通常已经安装
+    aiohttp = None
+
+from llm_backend import LoopThreadBackend, LLMError, LLMResult, LLMTimeoutError
+
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com"
+GENERATION_PATH = "/services/aigc/text-generation/generation"
+DNS_CACHE_TTL = 300  # 秒；aiohttp 默认只缓存10秒
+GZIP_LEVEL = 5
+DEFAULT_COMPRESS_THRESHOLD = 8 * 1024  # 开启请求压缩时，超过8KB的请求体才压缩
+
+
+def generation_url(base_url):
+    """由界面中填写的Host得到文本生成接口地址，Host可带或不带 /api/v1。"""
+    base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+    if not base_url.endswith('/api/v1'):
+        base_url += '/api/v1'
+    return base_url + GENERATION_PATH
+
+
+def text_from_json(data):
+    """从响应JSON中取出文本，兼容 output.text 与 output.choices[0].message.content 两种格式。"""
+    output = data.get('output') or {}
+    text = output.get('text')
+    if text:
+        return text
+    choices = output.get('choices') or []
+    if choices:
+        message = choices[0].get('message') or {}
+        return message.get('content')
+    return None
+
+
+def usage_from_json(data, system_prompt, user_prompt, text):
+    """取出 (输入token, 输出token)；没有用量信息时按中文1字符≈1 token估算。"""
+    usage = data.get('usage') or {}
+    try:
+        return int(usage['input_tokens']), int(usage['output_tokens'])
+    except Exception:
+        return len(system_prompt) + len(user_prompt), len(text or "")
+
+
+def error_from_json(status, body, retry_after=None):
+    """把错误响应转换为 LLMError；retry_after 为响应头 Retry-After 的值（秒数）。"""
+    try:
+        data = json.loads(body)
+        message = f"{data.get('code', '')} {data.get('message', '')}".strip()
+    except Exception:
+        message = body[:200]
+    try:
+        retry_after = float(retry_after) if retry_after is not None else None
+    except ValueError:  # HTTP日期格式，不使用
+        retry_after = None
+    return LLMError(f"API请求失败\n状态码: {status}\n信息: {message}", status, retry_after)
+
+
+class AsyncDashScopeBackend(LoopThreadBackend):
+    """
+    asyncio 版本的 DashScope 后端。
+
+    max_connections      连接池大小（同一时刻最多的TCP连接数，超出的请求排队等待连接）
+    timeout              单次请求的总超时（秒），每次调用可通过 timeout 参数覆盖
+    connect_timeout      建立连接的超时（秒）
+    keepalive_timeout    空闲连接在池中保留的时间（秒）；要长于玩家阅读一轮的时间，否则每轮都要重新握手
+    compress_threshold   请求体超过这个字节数时用 gzip 压缩后发送；None 表示不压缩
+    """
+
+    def __init__(self, api_key=None, base_url=None, max_connections=100, timeout=120.0, connect_timeout=10.0,
+                 keepalive_timeout=120.0, compress_threshold=None):
+        super().__init__()
+        self.api_key = api_key
+        self.url = generation_url(base_url)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.compress_threshold = compress_threshold
+        # 新建连接数、复用连接数、建立连接的总耗时（秒）、压缩的请求数和节省的字节数
+        self.connection_stats = {'new': 0, 'reused': 0, 'setup_time': 0.0, 'compressed': 0, 'bytes_saved': 0}
+        self._stats_lock = threading.Lock()
+        self._sessions = {}  # 每个事件循环一个连接池
+
+    @staticmethod
+    def available():
+        return aiohttp is not None
+
+    def configure(self, api_key, host=None):
+        """设置API Key和自定义Host。"""
+        if aiohttp is None:
+            raise LLMError("未安装 aiohttp，请先运行 pip install aiohttp")
+        self.api_key = api_key
+        self.url = generation_url(host)
+
+    # ------------------------------------------------------------------
+    # 异步接口
+    # ------------------------------------------------------------------
+    def _session(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_connections,
+                                             keepalive_timeout=self.keepalive_timeout, ttl_dns_cache=DNS_CACHE_TTL)
+            session = aiohttp.ClientSession(connector=connector, trace_configs=[self._trace_config()])
+            self._sessions[loop] = session
+        return session
+
+    def _trace_config(self):
+        """记录每个请求建立连接（DNS + TCP + TLS）的耗时；复用连接池中的连接时为0。"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_create_start(session, context, params):
+            context.connect_start = time.perf_counter()
+
+        async def on_create_end(session, context, params):
+            self._record_connection(context.trace_request_ctx, False, time.perf_counter() - context.connect_start)
+
+        async def on_reuse(session, context, params):
+            self._record_connection(context.trace_request_ctx, True, 0.0)
+
+        trace_config.on_connection_create_start.append(on_create_start)
+        trace_config.on_connection_create_end.append(on_create_end)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        return trace_config
+
+    def _record_connection(self, trace, reused, setup_time):
+        with self._stats_lock:
+            self.connection_stats['reused' if reused else 'new'] += 1
+            self.connection_stats['setup_time'] += setup_time
+        if trace is not None:
+            trace['reused'] = reused
+            trace['connect_time'] = setup_time
+
+    def connection_summary(self):
+        stats = dict(self.connection_stats)
+        total = stats['new'] + stats['reused']
+        mean_ms = stats['setup_time'] / stats['new'] * 1000 if stats['new'] else 0.0
+        return (f"连接池: 复用{stats['reused']}/{total}次，新建{stats['new']}次（平均建立{mean_ms:.1f}ms），"
+                f"压缩请求{stats['compressed']}次，节省{stats['bytes_saved'] // 1024}KB")
+
+    def _body(self, headers, payload):
+        """序列化请求体；超过 compress_threshold 时用 gzip 压缩。"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        if self.compress_threshold is not None and len(body) > self.compress_threshold:
+            compressed = gzip.compress(body, GZIP_LEVEL)
+            with self._stats_lock:
+                self.connection_stats['compressed'] += 1
+                self.connection_stats['bytes_saved'] += len(body) - len(compressed)
+            headers['Content-Encoding'] = 'gzip'
+            body = compressed
+        return body
+
+    def _post(self, headers, payload, timeout, trace):
+        return self._session().post(self.url, data=self._body(headers, payload), headers=headers,
+                                    timeout=self._client_timeout(timeout), trace_request_ctx=trace)
+
+    def _request(self, model, system_prompt, user_prompt, max_tokens, top_p, stream, json_output=False):
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+        }
+        parameters = {
+            'result_format': 'message',
+            'max_tokens': max_tokens,
+            'top_p': top_p,
+        }
+        if stream:
+            headers['Accept'] = 'text/event-stream'
+            headers['X-DashScope-SSE'] = 'enable'
+            parameters['incremental_output'] = True
+        if json_output:
+            parameters['response_format'] = {'type': 'json_object'}
+        payload = {
+            'model': model,
+            'input': {'messages': [
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': user_prompt},
+            ]},
+            'parameters': parameters,
+        }
+        return headers, payload
+
+    def _client_timeout(self, timeout):
+        return aiohttp.ClientTimeout(total=timeout or self.timeout, sock_connect=self.connect_timeout)
+
+    async def acomplete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, timeout=None, json_output=False,
+                        trace=None):
+        """发送一次非流式请求，返回 LLMResult。取消调用它的任务会中止请求。"""
+        headers, payload = self._request(model, system_prompt, user_prompt, max_tokens, top_p, stream=False, json_output=json_output)
+        try:
+            async with self._post(headers, payload, timeout, trace) as response:
+                body = await response.text()
+                if response.status != 200:
+                    raise error_from_json(response.status, body, response.headers.get('Retry-After'))
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"API请求超时（{timeout or self.timeout}秒）")
+        except aiohttp.ClientError as e:
+            raise LLMError(f"网络错误: {e}")
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise LLMError(f"API返回的不是有效的JSON: {body[:200]}", 200)
+        text = text_from_json(data)
+        if not text:
+            raise LLMError(f"API请求成功但未能解析到文本内容。\n原始数据: {data.get('output')}", 200)
+        input_tokens, output_tokens = usage_from_json(data, system_prompt, user_prompt, text)
+        return LLMResult(text, input_tokens, output_tokens)
+
+    async def astream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, timeout=None, json_output=False,
+                      trace=None):
+        """以SSE流式输出发送请求，逐段产出增量文本。"""
+        headers, payload = self._request(model, system_prompt, user_prompt, max_tokens, top_p, stream=True, json_output=json_output)
+        try:
+            async with self._post(headers, payload, timeout, trace) as response:
+                if response.status != 200:
+                    raise error_from_json(response.status, await response.text(), response.headers.get('Retry-After'))
+                event = None
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8').rstrip('\r\n')
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith('data:'):
+                        data_text = line[5:].strip()
+                        if event == 'error':
+                            raise error_from_json(response.status, data_text)
+                        try:
+                            data = json.loads(data_text)
+                        except ValueError:
+                            raise LLMError(f"流式响应中的数据不是有效的JSON: {data_text[:200]}", 200)
+                        delta = text_from_json(data)
+                        if delta:
+                            yield delta
+        except asyncio.TimeoutError:
+            raise LLMTimeoutError(f"API请求超时（{timeout or self.timeout}秒）")
+        except aiohttp.ClientError as e:
+            raise LLMError(f"网络错误: {e}")
+
+    async def awarm_up(self, connections=1):
+        """
+        预先建立 connections 个到Host的连接并放入连接池（并发发送 HEAD 请求，响应内容无关紧要），
+        返回新建立的连接数。连接失败不抛出异常，真正的请求会再报告错误。
+        """
+        parts = urlsplit(self.url)
+        origin = f"{parts.scheme}://{parts.netloc}/"
+
+        async def ping():
+            trace = {}
+            try:
+                async with self._session().head(origin, timeout=self._client_timeout(self.connect_timeout),
+                                                trace_request_ctx=trace) as response:
+                    await response.read()
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                return False
+            return trace.get('reused') is False
+
+        results = await asyncio.gather(*(ping() for _ in range(max(1, connections))))
+        return sum(results)
+
+    async def aclose(self):
+        """关闭当前事件循环的连接池。"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    # ------------------------------------------------------------------
+    # 同步接口：complete()/stream() 由 LoopThreadBackend 在后台事件循环线程中执行，与异步调用共用连接池
+    # ------------------------------------------------------------------
+    def warm_up(self, connections=1):
+        """在后台事件循环中预热同步接口使用的连接池，不等待完成；返回 concurrent.futures.Future。"""
+        return asyncio.run_coroutine_threadsafe(self.awarm_up(connections), self._background_loop())
+
+    def close(self):
+        """关闭后台事件循环中的连接池。"""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：在单核上同时发出数百个请求，对比
+  threads  每个请求一个线程调用 dashscope SDK（原来的做法，现在的后备方案）
+  async    asyncio + AsyncDashScopeBackend，共用一个连接池
+  stream   asyncio 流式输出（SSE）
+
+请求发往本机的替身服务器（fake_dashscope_server.py，单独的进程），无需API Key。
+统计总耗时、吞吐、p50/p99 延迟和客户端进程消耗的CPU时间。
+"""
+
+import asyncio
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+
+from async_dashscope import AsyncDashScopeBackend
+from fake_dashscope_server import FakeDashScopeServer
+from llm_backend import DashScopeBackend
+
+HOST = "127.0.0.1"
+PORT = 18089
+FIRST_TOKEN_LATENCY = 0.1
+PER_TOKEN_LATENCY = 0.0002
+SERVER_LATENCY = 0.2  # 替身服务器每个请求的大致延迟（秒）
+CONCURRENCY_LEVELS = (50, 200, 500)
+
+
+# ----------------------------------------------------------------------
+# 替身服务器：首字前等待 FIRST_TOKEN_LATENCY，之后每个字 PER_TOKEN_LATENCY，约500字共约200ms
+# ----------------------------------------------------------------------
+def serve():
+    FakeDashScopeServer(HOST, PORT, first_token_latency=FIRST_TOKEN_LATENCY, per_token_latency=PER_TOKEN_LATENCY,
+                        story_chars=400, chunk_tokens=50).serve_forever()
+
+
+# ----------------------------------------------------------------------
+# 客户端
+# ----------------------------------------------------------------------
+def run_threads(concurrency):
+    import dashscope
+    dashscope.base_http_api_url = f"http://{HOST}:{PORT}/api/v1"
+    backend = DashScopeBackend()
+    backend.configure("bench-key")
+    latencies = []
+    errors = []
+
+    def worker():
+        start = time.perf_counter()
+        try:
+            backend.complete("qwen-turbo", "系统", "用户", 512)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+async def run_async(concurrency, stream):
+    backend = AsyncDashScopeBackend("bench-key", f"http://{HOST}:{PORT}", max_connections=concurrency)
+    latencies = []
+    errors = []
+
+    async def one():
+        start = time.perf_counter()
+        try:
+            if stream:
+                async for _ in backend.astream("qwen-turbo", "系统", "用户", 512):
+                    pass
+            else:
+                await backend.acomplete("qwen-turbo", "系统", "用户", 512)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(e)
+
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+    await backend.aclose()
+    return latencies, errors
+
+
+def measure(label, concurrency, func):
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    latencies, errors = func()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    latencies.sort()
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)] if latencies else float('nan')
+    median = statistics.median(latencies) if latencies else float('nan')
+    print(f"{label:<8} 并发{concurrency:>4}  总耗时{elapsed:6.2f}s  {len(latencies) / elapsed:7.1f} 请求/秒  "
+          f"p50 {median * 1000:7.1f}ms  p99 {p99 * 1000:7.1f}ms  CPU {cpu:5.2f}s  失败{len(errors)}")
+
+
+def wait_for_server():
+    import socket
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, PORT), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("替身服务器没有启动")
+
+
+if __name__ == "__main__":
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {sorted(os.sched_getaffinity(0))[0]})  # 客户端只用一个核心
+    server = multiprocessing.Process(target=serve, daemon=True)
+    server.start()
+    wait_for_server()
+    print("=" * 96)
+    print(f"asyncio 客户端基准：替身服务器延迟{SERVER_LATENCY * 1000:.0f}ms，客户端单核")
+    print("=" * 96)
+    try:
+        for concurrency in CONCURRENCY_LEVELS:
+            measure("threads", concurrency, lambda: run_threads(concurrency))
+            measure("async", concurrency, lambda: asyncio.run(run_async(concurrency, stream=False)))
+            measure("stream", concurrency, lambda: asyncio.run(run_async(concurrency, stream=True)))
+    finally:
+        server.terminate()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：不启动图形界面，直接驱动 GameEngine 跑完整的"构造提示词 -> 调用AI -> 解析 -> 更新状态"流程，
+测量每秒完成的轮数和单轮耗时的 p50/p99。后端用 CallableBackend 返回固定格式的响应，无需API Key。
+"""
+
+import random
+import statistics
+import time
+
+from bench_memory import make_segment
+from game_engine import GameEngine
+from llm_backend import CallableBackend
+
+SESSIONS = 20
+TURNS_PER_SESSION = 50
+BACKGROUND = "你是一位经验丰富的星际探险家，被迫降落在陌生星球X-17上。"
+
+
+def make_backend(latency=0.0):
+    """返回带标记格式选项的固定响应，故事长度随机。"""
+    rng = random.Random(3)
+    counter = [0]
+
+    def fn(model, system_prompt, user_prompt):
+        counter[0] += 1
+        story = make_segment(counter[0], rng, length=400)
+        options = "\n\n".join(f"**行动{i}**-第{counter[0]}轮的第{i}个选择，描述这一行动可能带来的后果。" for i in range(1, 5))
+        return f"{story}\n\n### 行动选项\n\n{options}\n"
+
+    return CallableBackend(fn, latency=latency)
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run(sessions=SESSIONS, turns=TURNS_PER_SESSION, latency=0.0):
+    backend = make_backend(latency)
+    turn_times = []
+    start = time.perf_counter()
+    for session in range(sessions):
+        engine = GameEngine(backend)
+        t0 = time.perf_counter()
+        result = engine.start(BACKGROUND, "qwen-turbo", "300-500")
+        turn_times.append(time.perf_counter() - t0)
+        assert result.ok, result.error
+        for turn in range(turns - 1):
+            t0 = time.perf_counter()
+            result = engine.choose(turn % 4 + 1)
+            turn_times.append(time.perf_counter() - t0)
+            assert result.ok, result.error
+        engine.memory.wait_idle(5)
+    elapsed = time.perf_counter() - start
+
+    turn_times.sort()
+    print(f"后端延迟{latency * 1000:5.1f}ms  {len(turn_times)}轮  共{elapsed:6.2f}s  "
+          f"{len(turn_times) / elapsed:8.1f} 轮/秒   "
+          f"p50 {statistics.median(turn_times) * 1000:6.2f}ms  p99 {percentile(turn_times, 99) * 1000:6.2f}ms")
+
+
+if __name__ == "__main__":
+    print("=" * 78)
+    print(f"GameEngine 无界面吞吐基准：{SESSIONS}局 x {TURNS_PER_SESSION}轮")
+    print("=" * 78)
+    run(latency=0.0)    # 只测引擎本身的开销
+    run(latency=0.005)  # 模拟很快的后端
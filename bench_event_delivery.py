@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：对比后台线程向Tk主线程投递结果的两种方式。
+
+  poll   旧做法：主线程每100ms轮询一次队列，空闲时也一直唤醒
+  event  新做法：后台线程放入结果后发送 <<LLMResult>> 虚拟事件唤醒主线程，
+         只有请求进行中才以100ms兜底轮询
+
+统计空闲期间的唤醒次数和结果从放入队列到被处理的延迟。需要图形界面环境（Tk）。
+"""
+
+import queue
+import random
+import statistics
+import threading
+import time
+import tkinter as tk
+
+IDLE_SECONDS = 3.0
+RESULTS = 40
+
+
+class Receiver:
+    def __init__(self, root, mode):
+        self.root = root
+        self.mode = mode
+        self.queue = queue.Queue()
+        self.wakeups = 0
+        self.latencies = []
+        self.pending = 0
+        self.poll_id = None
+        self.notify_lock = threading.Lock()
+        self.notify_pending = False
+        if mode == "poll":
+            self.root.after(100, self.poll_forever)
+        else:
+            self.root.bind("<<LLMResult>>", lambda event: self.drain())
+
+    # --- 旧做法 ---
+    def poll_forever(self):
+        self.drain()
+        self.root.after(100, self.poll_forever)
+
+    # --- 新做法 ---
+    def begin_request(self):
+        self.pending += 1
+        if self.mode == "event" and self.poll_id is None:
+            self.poll_id = self.root.after(100, self.fallback_poll)
+
+    def fallback_poll(self):
+        self.poll_id = None
+        self.drain()
+        if self.pending > 0:
+            self.poll_id = self.root.after(100, self.fallback_poll)
+
+    def post(self, item):
+        """在后台线程中调用。"""
+        self.queue.put((time.perf_counter(), item))
+        if self.mode != "event":
+            return
+        with self.notify_lock:
+            if self.notify_pending:
+                return
+            self.notify_pending = True
+        self.root.event_generate("<<LLMResult>>", when="tail")
+
+    def drain(self):
+        self.wakeups += 1
+        with self.notify_lock:
+            self.notify_pending = False
+        try:
+            while True:
+                posted_at, _ = self.queue.get_nowait()
+                self.latencies.append(time.perf_counter() - posted_at)
+                self.pending = max(0, self.pending - 1)
+        except queue.Empty:
+            pass
+
+
+def run(mode):
+    root = tk.Tk()
+    root.withdraw()
+    receiver = Receiver(root, mode)
+    rng = random.Random(1)
+
+    # 1. 空闲阶段：没有任何请求
+    start_wakeups = receiver.wakeups
+    deadline = time.perf_counter() + IDLE_SECONDS
+    while time.perf_counter() < deadline:
+        root.update()
+        time.sleep(0.005)
+    idle_wakeups = receiver.wakeups - start_wakeups
+
+    # 2. 投递阶段：后台线程陆续返回结果
+    def worker():
+        time.sleep(rng.uniform(0.01, 0.2))
+        receiver.post("result")
+
+    for _ in range(RESULTS):
+        receiver.begin_request()
+        threading.Thread(target=worker, daemon=True).start()
+    while len(receiver.latencies) < RESULTS:
+        root.update()
+        time.sleep(0.001)
+    root.destroy()
+
+    latencies = sorted(receiver.latencies)
+    print(f"{mode:<6} 空闲{IDLE_SECONDS:.0f}秒唤醒{idle_wakeups:>3}次   "
+          f"投递延迟 平均{statistics.mean(latencies) * 1000:6.1f}ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:6.1f}ms  "
+          f"最大{latencies[-1] * 1000:6.1f}ms")
+
+
+if __name__ == "__main__":
+    print("=" * 78)
+    print("Tk主线程结果投递基准")
+    print("=" * 78)
+    run("poll")
+    run("event")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：一个游戏服务进程同时服务数百个会话。每个会话开始游戏后连续做若干次选择，
+大模型由本机替身服务器代替（bench_async_client.py 中的 serve），无需API Key。
+结束时打印服务端 /metrics 中各接口的延迟统计。
+"""
+
+import asyncio
+import multiprocessing
+import time
+
+import aiohttp
+from aiohttp import web
+
+import bench_async_client
+from async_dashscope import AsyncDashScopeBackend
+from game_server import GameServer
+
+GAME_PORT = 18090
+SESSIONS = 300
+CHOICES_PER_SESSION = 5
+
+
+def serve_game():
+    backend = AsyncDashScopeBackend("bench-key", f"http://{bench_async_client.HOST}:{bench_async_client.PORT}",
+                                    max_connections=SESSIONS)
+    server = GameServer(backend, max_sessions=SESSIONS * 2)
+    web.run_app(server.make_app(), host="127.0.0.1", port=GAME_PORT, print=None, backlog=2048)
+
+
+async def play(http, base_url, index, failures):
+    async with http.post(f"{base_url}/sessions", json={'story_bg': f"第{index}位玩家的星际冒险"}) as response:
+        state = await response.json()
+        if response.status != 200 or not state.get('ok'):
+            failures.append(state)
+            return
+    session_id = state['session_id']
+    for turn in range(CHOICES_PER_SESSION):
+        async with http.post(f"{base_url}/sessions/{session_id}/choose", json={'choice': turn % 4 + 1}) as response:
+            state = await response.json()
+            if response.status != 200 or not state.get('ok'):
+                failures.append(state)
+                return
+    async with http.get(f"{base_url}/sessions/{session_id}") as response:
+        await response.json()
+
+
+async def run():
+    base_url = f"http://127.0.0.1:{GAME_PORT}"
+    failures = []
+    connector = aiohttp.TCPConnector(limit=SESSIONS)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(play(http, base_url, i, failures) for i in range(SESSIONS)))
+        elapsed = time.perf_counter() - start
+        async with http.get(f"{base_url}/metrics") as response:
+            metrics = await response.json()
+
+    turns = SESSIONS * (CHOICES_PER_SESSION + 1)
+    print(f"{SESSIONS}个会话，共{turns}轮，总耗时{elapsed:.2f}s，{turns / elapsed:.1f} 轮/秒，失败{len(failures)}")
+    print(f"服务端会话数: {metrics['sessions']}")
+    for endpoint, stats in metrics['endpoints'].items():
+        print(f"  {endpoint:<8} {stats['count']:>5}次  错误{stats['errors']:>3}  平均{stats['mean_ms']:8.1f}ms  "
+              f"p50 {stats['p50_ms']:8.1f}ms  p99 {stats['p99_ms']:8.1f}ms")
+
+
+def wait_for(port):
+    import socket
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"端口{port}上的服务没有启动")
+
+
+if __name__ == "__main__":
+    model_server = multiprocessing.Process(target=bench_async_client.serve, daemon=True)
+    game_server = multiprocessing.Process(target=serve_game, daemon=True)
+    model_server.start()
+    game_server.start()
+    wait_for(bench_async_client.PORT)
+    wait_for(GAME_PORT)
+    print("=" * 78)
+    print(f"多会话游戏服务基准：替身大模型延迟{bench_async_client.SERVER_LATENCY * 1000:.0f}ms")
+    print("=" * 78)
+    try:
+        asyncio.run(run())
+    finally:
+        game_server.terminate()
+        game_server.join(5)  # 先停游戏服务，避免后台摘要请求在替身服务器关闭时报错
+        model_server.terminate()
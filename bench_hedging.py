@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：对冲请求对长尾延迟的改善和额外消耗的token。
+
+替身服务器（fake_dashscope_server.py，后台线程）中有 SLOW_RATE 比例的请求首token延迟放大 SLOW_FACTOR 倍，
+模拟偶发的极慢响应。CONCURRENCY 个玩家各自连续进行 TURNS 轮流式请求，分别在不对冲和
+按不同百分位对冲的情况下统计每轮总耗时的 p50/p95/p99、对冲率，以及每轮平均额外消耗的token。
+
+  python bench_hedging.py            # 完整测试
+  python bench_hedging.py --quick    # 每个玩家10轮
+"""
+
+import argparse
+import asyncio
+import contextlib
+import time
+
+from async_dashscope import AsyncDashScopeBackend
+from fake_dashscope_server import FakeDashScopeServer
+from hedging import HedgedBackend
+
+FIRST_TOKEN_LATENCY = 0.1
+PER_TOKEN_LATENCY = 0.0002
+SLOW_RATE = 0.05
+SLOW_FACTOR = 20  # 慢请求的首token延迟约2秒
+CONCURRENCY = 8
+TURNS = 40
+PERCENTILES = (None, 99, 95, 90)  # None 表示不对冲
+SYSTEM_PROMPT = "你是一个文字冒险游戏的叙述者。" * 100  # 与游戏中的提示词长度相近，被取消的请求按输入token计入额外消耗
+USER_PROMPT = "故事背景和最近的剧情。" * 60
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+async def play(backend, turns, latencies):
+    for _ in range(turns):
+        start = time.perf_counter()
+        async for _ in backend.astream("qwen-turbo", SYSTEM_PROMPT, USER_PROMPT, 512):
+            pass
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_once(base_url, hedge_percentile, turns):
+    backend = AsyncDashScopeBackend("bench-key", base_url)
+    if hedge_percentile is not None:
+        backend = HedgedBackend(backend, percentile=hedge_percentile)
+    latencies = []
+    try:
+        await asyncio.gather(*(play(backend, turns, latencies) for _ in range(CONCURRENCY)))
+    finally:
+        await backend.aclose()
+    latencies.sort()
+    row = {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95), 'p99': percentile(latencies, 99),
+           'hedge_rate': 0.0, 'extra_tokens': 0.0}
+    if hedge_percentile is not None:
+        stats = backend.hedge_snapshot()
+        row['hedge_rate'] = stats['hedge_rate']
+        row['extra_tokens'] = stats['extra_tokens'] / stats['requests']
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对冲请求基准")
+    parser.add_argument('--quick', action='store_true', help="每个玩家10轮")
+    args = parser.parse_args()
+    turns = 10 if args.quick else TURNS
+
+    print("=" * 80)
+    print(f"对冲请求基准：{CONCURRENCY}个玩家 × {turns}轮流式请求，{SLOW_RATE * 100:.0f}%的请求首token延迟放大{SLOW_FACTOR}倍")
+    print("=" * 80)
+    print(f"{'对冲':<12}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'对冲率':>10}{'额外token/轮':>16}")
+    for hedge_percentile in PERCENTILES:
+        # 每种配置使用相同的随机种子，慢请求的分布一致
+        server = FakeDashScopeServer(first_token_latency=FIRST_TOKEN_LATENCY, per_token_latency=PER_TOKEN_LATENCY,
+                                     slow_rate=SLOW_RATE, slow_factor=SLOW_FACTOR, jitter=0.2, story_chars=400,
+                                     chunk_tokens=50, seed=0)
+        base_url = server.start()
+        try:
+            with contextlib.redirect_stdout(None):  # 不输出每次对冲的调试信息
+                row = asyncio.run(run_once(base_url, hedge_percentile, turns))
+        finally:
+            server.stop()
+        label = "不对冲" if hedge_percentile is None else f"p{hedge_percentile}"
+        print(f"{label:<12}{row['p50'] * 1e3:>10.0f}{row['p95'] * 1e3:>10.0f}{row['p99'] * 1e3:>10.0f}"
+              f"{row['hedge_rate'] * 100:>9.1f}%{row['extra_tokens']:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：JSON/Python字典恢复在病态输入上的耗时随输入长度的增长情况。
+
+对每种病态输入按长度 1K、4K、16K、64K、256K 字符测量 recover_json_object 的耗时，
+计算每字符耗时（ns/字符）。最长输入的每字符耗时超过 4K 输入的 LINEAR_TOLERANCE 倍时视为非线性，以非零状态退出。
+同时列出旧做法（嵌套正则 + 单引号全部替换为双引号）的耗时和结果是否正确，作为对照。
+
+  python bench_json_recovery.py            # 完整测试
+  python bench_json_recovery.py --quick    # 最长到64K
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+
+from response_parser import recover_json_object
+
+SIZES = [1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024]
+BASELINE_SIZE = 4 * 1024  # 1K 的输入受函数调用等固定开销影响较大，以4K为基准
+LINEAR_TOLERANCE = 3.0
+REPEATS = 5
+OPTIONS = ["点燃火把", "原路返回", "检查墙壁", "大声呼喊"]
+
+_OLD_PATTERN = re.compile(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}')
+
+
+def old_parse_python_dict(text):
+    """原来 llm_adventure_game_simple.py 中 _parse_python_dict 的做法。"""
+    matches = _OLD_PATTERN.findall(text)
+    if matches:
+        return json.loads(matches[0].replace("'", '"'))
+    raise ValueError("未找到有效的字典格式")
+
+
+def fill(unit, n):
+    return unit * max(1, n // len(unit))
+
+
+def apostrophe_story(n):
+    """合法的Python字典，故事里有大量撇号和引号（旧做法会把它们破坏）。"""
+    story = fill("船长O'Brien说：\"别怕\"。", n)
+    return repr({'story': story, 'options': OPTIONS}), story
+
+
+def stray_brace_then_object(n):
+    """正文中有一个没有闭合的 {，后面才是真正的对象。"""
+    story = fill("墙上刻着{奇怪的符号", n // 2)
+    return "好的，" + story + "\n" + json.dumps({'story': "结局", 'options': OPTIONS}, ensure_ascii=False), "结局"
+
+
+# 名称 -> 生成函数(长度) -> (文本, 期望的故事；None 表示应当找不到对象)
+CASES = {
+    "未闭合的 {": lambda n: ("{" * n, None),
+    "大量空对象 {}": lambda n: (fill("{}", n), None),
+    "深层嵌套 [": lambda n: ("{" + "[" * n + "]" * n + "}", None),
+    "未闭合的字符串": lambda n: ("{'story': '" + fill("它'说", n), None),
+    "大量转义": lambda n: ('{"story": "' + fill('\\"', n), None),
+    "括号交错 {[}]": lambda n: (fill("{[}]", n), None),
+    "撇号和引号": apostrophe_story,
+    "前面有孤立的 {": stray_brace_then_object,
+}
+
+
+def time_call(func, text):
+    """返回 (最短耗时秒数, 结果)；结果为解析出的故事，抛异常时为 None。"""
+    best = None
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        try:
+            data = func(text)
+            result = data.get('story') if isinstance(data, dict) else None
+        except Exception:
+            result = None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(sizes=SIZES):
+    """返回 [(用例, 长度, 新做法耗时, 新做法正确, 旧做法耗时, 旧做法正确)]。"""
+    rows = []
+    for name, make in CASES.items():
+        for size in sizes:
+            text, expected = make(size)
+            new_time, new_story = time_call(recover_json_object, text)
+            old_time, old_story = time_call(old_parse_python_dict, text)
+            rows.append((name, len(text), new_time, new_story == expected, old_time, old_story == expected))
+    return rows
+
+
+def check_linear(rows):
+    """返回每字符耗时增长超过 LINEAR_TOLERANCE 倍的用例。"""
+    failures = []
+    by_case = {}
+    for name, length, new_time, *_ in rows:
+        by_case.setdefault(name, []).append((length, new_time / length))
+    for name, points in by_case.items():
+        baseline = [per_char for length, per_char in points if length >= BASELINE_SIZE]
+        if len(baseline) >= 2 and baseline[-1] > baseline[0] * LINEAR_TOLERANCE:
+            failures.append((name, baseline[-1] / baseline[0]))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON/字典恢复的病态输入基准")
+    parser.add_argument('--quick', action='store_true', help="最长到64K")
+    args = parser.parse_args()
+    sizes = [size for size in SIZES if size <= 64 * 1024] if args.quick else SIZES
+
+    print("=" * 96)
+    print(f"{'用例':<16}{'长度':>9}{'新(ms)':>10}{'ns/字符':>10}{'结果':>6}{'旧(ms)':>12}{'ns/字符':>10}{'结果':>6}")
+    print("=" * 96)
+    rows = run(sizes)
+    for name, length, new_time, new_ok, old_time, old_ok in rows:
+        print(f"{name:<16}{length:>9}{new_time * 1e3:>10.2f}{new_time / length * 1e9:>10.0f}{'正确' if new_ok else '错误':>6}"
+              f"{old_time * 1e3:>12.2f}{old_time / length * 1e9:>10.0f}{'正确' if old_ok else '错误':>6}")
+
+    failures = check_linear(rows)
+    wrong = sorted({name for name, _, _, new_ok, _, _ in rows if not new_ok})
+    for name, ratio in failures:
+        print(f"非线性：{name} 最长输入的每字符耗时是 {BASELINE_SIZE // 1024}K 输入的 {ratio:.1f} 倍")
+    for name in wrong:
+        print(f"结果错误：{name}")
+    if failures or wrong:
+        sys.exit(1)
+    print(f"所有用例的每字符耗时增长都在 {LINEAR_TOLERANCE:.0f} 倍以内")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：模拟200轮游戏，对比"完整故事历史"与"滚动摘要记忆"每轮的输入长度。
+无需API Key，摘要使用本地摘要函数。
+"""
+
+import random
+import sys
+import time
+
+from story_memory import RollingSummaryMemory
+
+SENTENCES = [
+    "你穿过布满荧光苔藓的峡谷，脚下的碎石发出清脆的响声。",
+    "远处的塔楼亮起了幽蓝色的灯光，仿佛在回应你的到来。",
+    "一位披着斗篷的旅人拦住了你，他手中握着一枚刻有古老符文的徽章。",
+    "飞船的通讯器突然发出断断续续的杂音，像是有人在尝试联络你。",
+    "空气中弥漫着金属与潮湿泥土混合的气味，让你不由得提高了警惕。",
+]
+
+
+def make_segment(turn, rng, length=900):
+    """生成一段约 length 字的模拟情节。"""
+    parts = [f"第{turn}幕。"]
+    while sum(len(p) for p in parts) < length:
+        parts.append(rng.choice(SENTENCES))
+    return "".join(parts)
+
+
+def run(turns=200, keep_recent=6, max_prompt_chars=6000):
+    rng = random.Random(42)
+    background = "## 故事背景\n\n你是一位经验丰富的星际探险家，被迫降落在陌生星球X-17上。\n\n"
+
+    memory = RollingSummaryMemory(keep_recent=keep_recent, max_prompt_chars=max_prompt_chars)
+    memory.reset(background=background)
+    full_history = background
+
+    rows = []
+    render_times = []
+    for turn in range(1, turns + 1):
+        choice = f"\n\n**我的选择是：** *选项{turn % 4 + 1}*\n\n---\n\n"
+        full_history += choice
+        memory.add_segment(choice)
+
+        start = time.perf_counter()
+        context = memory.render()
+        render_times.append(time.perf_counter() - start)
+        rows.append((turn, len(full_history), len(context)))
+
+        story = make_segment(turn, rng)
+        full_history += story
+        memory.add_segment(story)
+        # 玩家阅读期间后台完成摘要
+        memory.wait_idle(timeout=5)
+
+    print("=" * 60)
+    print(f"滚动摘要记忆基准：{turns}轮，原文保留{keep_recent}段，提示词上限{max_prompt_chars}字")
+    print("（中文1字符≈1 token）")
+    print("=" * 60)
+    print(f"{'轮次':>6} {'完整历史(字)':>14} {'滚动记忆(字)':>14}")
+    for turn, full_len, memory_len in rows:
+        if turn in (1, 2, 5, 10, 25, 50, 100, 150, 200) or turn == turns:
+            print(f"{turn:>6} {full_len:>14} {memory_len:>14}")
+
+    tail = [memory_len for _, _, memory_len in rows[len(rows) // 2:]]
+    print("-" * 60)
+    print(f"后半程滚动记忆长度：最小{min(tail)}，最大{max(tail)}（上限{max_prompt_chars}）")
+    print(f"完整历史总输入：{sum(r[1] for r in rows)}字，滚动记忆总输入：{sum(r[2] for r in rows)}字")
+    print(f"render() 平均耗时：{sum(render_times) / len(render_times) * 1e6:.1f}µs")
+    return max(tail) <= max_prompt_chars
+
+
+if __name__ == "__main__":
+    ok = run()
+    if not ok:
+        sys.exit(1)
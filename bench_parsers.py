@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：各解析器路径在模拟响应语料（parser_corpus.py）上的吞吐、延迟和内存。
+
+每个解析器在每种格式上统计：成功率、每秒次数、p50/p99 延迟（微秒）和单次调用的内存峰值。
+结果追加到 bench_results/parsers.jsonl，并与上一次的结果对比，吞吐下降超过 REGRESSION_THRESHOLD 时标记为回退。
+
+  python bench_parsers.py                  # 默认每种格式250条
+  python bench_parsers.py --label v1.2     # 给本次结果加标签
+  python bench_parsers.py --quick          # 每种格式40条，快速检查
+  python bench_parsers.py --no-save        # 不保存结果
+
+简化版的 parse_ai_response 取自 test_json_parser.py（与 llm_adventure_game_simple.py 中的方法相同，
+后者依赖 tkinter 无法直接导入）。
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import test_json_parser
+from parser_corpus import FORMATS, make_corpus
+from response_parser import (parse_text_response, extract_options_from_text, parse_text_response_streaming, parse_response,
+                             StreamingOptionParser)
+
+RESULTS_FILE = os.path.join("bench_results", "parsers.jsonl")
+STREAM_CHUNK_CHARS = 16  # 模拟流式输出时每段的字数
+REGRESSION_THRESHOLD = 0.10  # 吞吐下降超过10%视为回退
+MEMORY_SAMPLES = 20  # 每种格式测内存峰值的条数（tracemalloc 会拖慢计时，单独测量）
+
+
+def simple_parse_ai_response(text):
+    # 简化版解析器每一步都会 print，计时时不输出
+    with contextlib.redirect_stdout(None):
+        return test_json_parser.parse_ai_response(text)
+
+
+PARSERS = {
+    "final.parse_text_response": parse_text_response,
+    "final.extract_options": extract_options_from_text,
+    "final.streaming": parse_text_response_streaming,
+    "final.streaming_16": lambda text: parse_text_response_streaming(text, chunk_size=STREAM_CHUNK_CHARS),  # 模拟流式分段
+    "final.json_output": lambda text: parse_response(text, json_output=True),  # 结构化输出：先 json.loads，再退回其他策略
+    "simple.parse_ai_response": simple_parse_ai_response,
+}
+
+
+def is_success(result, options):
+    """判断解析结果是否正确（选项与语料中的一致）。"""
+    if isinstance(result, list):
+        return result == options
+    if isinstance(result, dict):
+        return result.get('options') == options
+    return list(result[1]) == options
+
+
+def bench_parser(func, samples):
+    """samples: [(文本, 选项)]，返回统计字典。"""
+    durations = []
+    ok = 0
+    for text, options in samples:
+        start = time.perf_counter_ns()
+        try:
+            result = func(text)
+        except Exception:
+            result = None
+        durations.append(time.perf_counter_ns() - start)
+        if result is not None and is_success(result, options):
+            ok += 1
+
+    peak = 0
+    for text, _ in samples[:MEMORY_SAMPLES]:
+        tracemalloc.start()
+        try:
+            func(text)
+        except Exception:
+            pass
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    durations.sort()
+    total = sum(durations)
+    return {
+        'count': len(samples),
+        'success_rate': round(ok / len(samples), 4),
+        'ops_per_sec': round(len(samples) / (total / 1e9), 1) if total else 0.0,
+        'p50_us': round(durations[len(durations) // 2] / 1000, 1),
+        'p99_us': round(durations[max(0, int(len(durations) * 0.99) - 1)] / 1000, 1),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def bench_streaming_finish(samples):
+    """
+    流式输出时解析分摊在每段到达时完成，玩家等待的只是最后一段到达后的 finish()。
+    统计 finish() 的延迟，以及每段 feed() 的 p99 耗时（feed_p99_us）。
+    """
+    durations = []
+    feed_durations = []
+    ok = 0
+    for text, options in samples:
+        parser = StreamingOptionParser()
+        for i in range(0, len(text), STREAM_CHUNK_CHARS):
+            start = time.perf_counter_ns()
+            parser.feed(text[i:i + STREAM_CHUNK_CHARS])
+            feed_durations.append(time.perf_counter_ns() - start)
+        start = time.perf_counter_ns()
+        try:
+            result = parser.finish()
+        except Exception:
+            result = None
+        durations.append(time.perf_counter_ns() - start)
+        if result is not None and is_success(result, options):
+            ok += 1
+
+    durations.sort()
+    feed_durations.sort()
+    total = sum(durations)
+    return {
+        'count': len(samples),
+        'success_rate': round(ok / len(samples), 4),
+        'ops_per_sec': round(len(samples) / (total / 1e9), 1) if total else 0.0,
+        'p50_us': round(durations[len(durations) // 2] / 1000, 1),
+        'p99_us': round(durations[max(0, int(len(durations) * 0.99) - 1)] / 1000, 1),
+        'peak_kb': 0.0,
+        'feed_p99_us': round(feed_durations[max(0, int(len(feed_durations) * 0.99) - 1)] / 1000, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def load_previous(path):
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                previous = json.loads(line)
+    return previous
+
+
+def save(path, record):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def run(per_format=250, seed=0, parsers=PARSERS):
+    corpus = make_corpus(per_format, seed)
+    by_format = {}
+    for fmt, text, _story, options in corpus:
+        by_format.setdefault(fmt, []).append((text, options))
+
+    results = {}
+    for name, func in parsers.items():
+        results[name] = {fmt: bench_parser(func, by_format[fmt]) for fmt in FORMATS}
+    results["final.streaming_finish"] = {fmt: bench_streaming_finish(by_format[fmt]) for fmt in FORMATS}
+    return results
+
+
+def report(results, previous=None):
+    previous_results = (previous or {}).get('results', {})
+    regressions = []
+    print(f"{'解析器':<28}{'格式':<13}{'成功率':>7}{'次/秒':>12}{'p50(us)':>10}{'p99(us)':>11}{'峰值(KB)':>10}  对比上次")
+    for name, by_format in results.items():
+        for fmt, stats in by_format.items():
+            delta = ""
+            old = previous_results.get(name, {}).get(fmt)
+            if old and old['ops_per_sec']:
+                change = stats['ops_per_sec'] / old['ops_per_sec'] - 1
+                delta = f"{change * 100:+6.1f}%"
+                if change < -REGRESSION_THRESHOLD:
+                    delta += "  回退"
+                    regressions.append((name, fmt, change))
+            if 'feed_p99_us' in stats:
+                delta = f"每段feed p99 {stats['feed_p99_us']:.1f}us  {delta}"
+            print(f"{name:<28}{fmt:<13}{stats['success_rate'] * 100:6.1f}%{stats['ops_per_sec']:>12.1f}"
+                  f"{stats['p50_us']:>10.1f}{stats['p99_us']:>11.1f}{stats['peak_kb']:>10.1f}  {delta}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解析器基准")
+    parser.add_argument('--per-format', type=int, default=250, help="每种格式的响应条数（large 类为十分之一）")
+    parser.add_argument('--quick', action='store_true', help="每种格式40条")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', default=None, help="本次结果的标签，默认为当前git提交")
+    parser.add_argument('--results', default=RESULTS_FILE)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    per_format = 40 if args.quick else args.per_format
+    previous = load_previous(args.results)
+    print("=" * 104)
+    print(f"解析器基准：每种格式{per_format}条，seed={args.seed}" +
+          (f"，对比 {previous.get('label')}（{previous.get('time')}）" if previous else ""))
+    print("=" * 104)
+    results = run(per_format, args.seed)
+    regressions = report(results, previous)
+
+    if not args.no_save:
+        save(args.results, {
+            'label': args.label or git_revision(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'per_format': per_format,
+            'seed': args.seed,
+            'python': sys.version.split()[0],
+            'results': results,
+        })
+        print(f"结果已追加到 {args.results}")
+    if regressions:
+        print(f"发现{len(regressions)}项吞吐回退")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：检索增强记忆的向量索引在几万个片段上的建立和检索耗时。
+
+按 10000、30000、50000 个片段（每个约200字，汉字按 Zipf 分布随机生成）分别测量：
+逐段添加的总耗时、一次检索（按排序区间 + bincount 累加）的耗时，
+并与逐个片段用Python计算点积的做法对照（只在最小规模上运行）。
+最大规模下单次检索超过 SEARCH_LIMIT 秒时以非零状态退出。
+
+  python bench_retrieval.py            # 完整测试
+  python bench_retrieval.py --quick    # 最多10000个片段
+"""
+
+import argparse
+import itertools
+import random
+import sys
+import time
+
+import numpy as np
+
+from story_retrieval import CHUNK_CHARS, StoryRetriever, hash_ngrams
+
+CHUNK_COUNTS = [10000, 30000, 50000]
+SEARCH_LIMIT = 0.02
+QUERIES = 20
+VOCABULARY = [chr(0x4e00 + i) for i in range(3000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def make_text(rng, chars):
+    return "".join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=chars))
+
+
+def naive_search(retriever, query, k):
+    """对照：逐个片段重新向量化后计算点积（不使用稀疏矩阵）。"""
+    features, counts = hash_ngrams(query)
+    weights = dict(zip(features.tolist(), (1.0 + np.log(counts)).tolist()))
+    scores = []
+    for doc, chunk in enumerate(retriever.chunks):
+        chunk_features, chunk_counts = hash_ngrams(chunk)
+        chunk_weights = 1.0 + np.log(chunk_counts)
+        chunk_weights /= np.linalg.norm(chunk_weights)
+        scores.append((sum(weights.get(f, 0.0) * w for f, w in zip(chunk_features.tolist(), chunk_weights.tolist())), doc))
+    return sorted(scores, reverse=True)[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索增强记忆的向量索引基准")
+    parser.add_argument('--quick', action='store_true', help="最多10000个片段")
+    args = parser.parse_args()
+    counts = CHUNK_COUNTS[:1] if args.quick else CHUNK_COUNTS
+    rng = random.Random(0)
+
+    print("=" * 72)
+    print(f"{'片段数':>8}{'建立(s)':>10}{'非零项':>12}{'检索(ms)':>10}{'最慢(ms)':>10}{'逐个计算(ms)':>14}")
+    print("=" * 72)
+    slowest = 0.0
+    for count in counts:
+        texts = [make_text(rng, CHUNK_CHARS) for _ in range(count)]
+        retriever = StoryRetriever()
+        start = time.perf_counter()
+        for text in texts:
+            retriever.add_segment(text)
+        build_time = time.perf_counter() - start
+
+        timings = []
+        for query in rng.sample(texts, QUERIES):
+            start = time.perf_counter()
+            retriever.search(query[:40], min_score=0.0)
+            timings.append(time.perf_counter() - start)
+        slowest = max(timings)
+
+        naive_text = f"{'-':>14}"
+        if count == counts[0]:
+            start = time.perf_counter()
+            naive_search(retriever, texts[0][:40], 3)
+            naive_text = f"{(time.perf_counter() - start) * 1000:>14.0f}"
+        nonzero = retriever.nonzero()
+        print(f"{count:>8}{build_time:>10.1f}{nonzero:>12}{np.median(timings) * 1000:>10.2f}{slowest * 1000:>10.2f}{naive_text}")
+
+    if slowest > SEARCH_LIMIT:
+        print(f"最大规模下单次检索 {slowest * 1000:.1f}ms，超过 {SEARCH_LIMIT * 1000:.0f}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
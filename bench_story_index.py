@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：回合日志全文索引的建立、增量更新和查询耗时。
+
+生成 SESSIONS 局、每局 TURNS 轮的回合日志（汉字按 Zipf 分布随机生成，每轮约600字），
+测量：一次性建立索引的耗时、追加一轮后增量更新的耗时，以及几类查询（常见词、罕见短语、按局过滤、
+无结果）的耗时，并与逐行读取整个日志、解析JSON后查找子串的做法对照。
+任何一类查询超过 SEARCH_LIMIT 秒时以非零状态退出。
+
+  python bench_story_index.py            # 完整测试
+  python bench_story_index.py --quick    # 规模缩小为1/5
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from story_index import StoryIndex, normalize, record_text
+from turn_journal import TurnJournal
+
+SESSIONS = 10
+TURNS = 300
+TURN_CHARS = 600
+SEARCH_LIMIT = 0.05
+REPEATS = 5
+RARE_PHRASE = "青铜罗盘"
+VOCABULARY = [chr(0x4e00 + i) for i in range(3000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def make_text(rng, chars):
+    # 汉字按 Zipf 分布抽取：常用字出现得多、罕见字出现得少，接近真实文本中n-gram的分布
+    return "".join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=chars))
+
+
+def write_journal(path, sessions, turns, rng):
+    """返回各局的编号（start 记录的偏移）。"""
+    journal = TurnJournal(path)
+    session_ids = []
+    for session in range(sessions):
+        journal.append({'type': 'start', 'time': time.time(), 'background': f"## 故事背景\n第{session}局" + make_text(rng, 200)})
+        journal.flush()
+        session_ids.append(journal.start_offset)
+        for turn in range(1, turns + 1):
+            story = make_text(rng, TURN_CHARS)
+            if turn % 97 == 0:
+                story += RARE_PHRASE
+            journal.append({'type': 'turn', 'seq': turn, 'turn': turn, 'kind': 'continuation', 'choice': make_text(rng, 20),
+                            'raw': story, 'ok': True, 'story': story})
+    journal.close()
+    return session_ids
+
+
+def scan_search(path, query):
+    """对照：读取整个日志，逐条解析后查找子串。"""
+    term = normalize(query)
+    hits = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if term in normalize(record_text(json.loads(line))):
+                hits += 1
+    return hits
+
+
+def best_time(func):
+    best = None
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回合日志全文索引的基准")
+    parser.add_argument('--quick', action='store_true', help="规模缩小为1/5")
+    args = parser.parse_args()
+    sessions, turns = (SESSIONS // 5, TURNS) if args.quick else (SESSIONS, TURNS)
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "journal.jsonl")
+        session_ids = write_journal(path, sessions, turns, rng)
+        index = StoryIndex(path, os.path.join(directory, "index.sqlite3"))
+
+        start = time.perf_counter()
+        records = index.update()
+        build_time = time.perf_counter() - start
+        stats = index.stats()
+        index_size = sum(os.path.getsize(index.path + suffix) for suffix in ("", "-wal") if os.path.exists(index.path + suffix))
+        print("=" * 72)
+        print(f"日志 {os.path.getsize(path) / 1024 / 1024:.1f}MB，{sessions}局 × {turns}轮，共{records}条记录")
+        print(f"建立索引 {build_time:.1f}s，{stats['postings']}个倒排项，索引文件 {index_size / 1024 / 1024:.1f}MB")
+
+        journal = TurnJournal(path)
+        journal.start_offset = session_ids[-1]
+        journal.append({'type': 'turn', 'seq': turns + 1, 'turn': turns + 1, 'kind': 'continuation', 'ok': True,
+                        'story': make_text(rng, TURN_CHARS)})
+        journal.close()
+        start = time.perf_counter()
+        index.update()
+        print(f"追加一轮后增量更新 {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        common = chr(0x4e00) + chr(0x4e01)
+        queries = [
+            ("常见两字", common, None),
+            ("罕见短语", RARE_PHRASE, None),
+            ("罕见短语+按局", RARE_PHRASE, session_ids[0]),
+            ("无结果", "不存在的短语", None),
+        ]
+        print("=" * 72)
+        print(f"{'查询':<14}{'索引(ms)':>10}{'核对条数':>10}{'结果':>6}{'整体扫描(ms)':>14}")
+        print("=" * 72)
+        failures = []
+        for name, query, session in queries:
+            elapsed, hits = best_time(lambda: index.search(query, session=session))
+            candidates = index.last_candidates
+            scan_time, _ = best_time(lambda: scan_search(path, query)) if session is None else (None, None)
+            scan_text = f"{scan_time * 1000:>14.1f}" if scan_time is not None else f"{'-':>14}"
+            print(f"{name:<14}{elapsed * 1000:>10.2f}{candidates:>10}{len(hits):>6}{scan_text}")
+            if elapsed > SEARCH_LIMIT:
+                failures.append(name)
+
+    if failures:
+        print(f"查询超过 {SEARCH_LIMIT * 1000:.0f}ms: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
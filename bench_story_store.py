@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：模拟约100万字的长会话，对比"单个不断增长的 story_history 字符串"与分段存储 StoryStore
+的耗时和内存占用。无需API Key和图形界面。
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+
+from bench_memory import make_segment
+from story_store import StoryStore, StorySegment, to_display_text
+
+TARGET_CHARS = 1000000
+BACKGROUND = "## 故事背景\n\n你是一位经验丰富的星际探险家，被迫降落在陌生星球X-17上。\n\n"
+
+
+def session_segments():
+    """生成一局约 TARGET_CHARS 字的会话：(选择, 情节) 序列。"""
+    rng = random.Random(7)
+    total = len(BACKGROUND)
+    turn = 0
+    while total < TARGET_CHARS:
+        turn += 1
+        choice = f"\n\n**我的选择是：** *选项{turn % 4 + 1}*\n\n---\n\n"
+        story = make_segment(turn, rng)
+        total += len(choice) + len(story)
+        yield choice, story
+
+
+def run_string_history(segments):
+    """旧做法：每轮 += 追加，显示时整段 replace 后重新插入，提示词里再复制一份。"""
+    history = BACKGROUND
+    display = None
+    prompt = None
+    for choice, story in segments:
+        history += choice
+        prompt = f"以下是目前为止的完整故事情节：\n---\n{history}\n---\n"
+        history += story
+        display = history.replace('**', '').replace('*', '').replace('#', '').replace('---', '\n---\n')
+    return history, display, prompt
+
+
+def run_story_store(segments):
+    """新做法：按段追加，显示时只处理新增的段。"""
+    store = StoryStore()
+    store.reset(BACKGROUND)
+    rendered = 0
+    displayed_chars = 0
+    for choice, story in segments:
+        store.append(StorySegment.CHOICE, choice)
+        store.append(StorySegment.STORY, story)
+        for text in store.iter_display_text(rendered):
+            displayed_chars += len(text)
+        rendered = len(store)
+    return store, displayed_chars
+
+
+def measure(label, func, segments):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(segments)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<20} 耗时 {elapsed:8.3f}s   结束时占用 {current / 1e6:8.2f}MB   峰值 {peak / 1e6:8.2f}MB")
+    return result
+
+
+if __name__ == "__main__":
+    segments = list(session_segments())
+    total_chars = len(BACKGROUND) + sum(len(c) + len(s) for c, s in segments)
+    print("=" * 78)
+    print(f"故事存储基准：{len(segments)}轮，共{total_chars}字")
+    segment_bytes = sum(sys.getsizeof(c) + sys.getsizeof(s) for c, s in segments)
+    print(f"各段原始文本共占 {segment_bytes / 1e6:.2f}MB（两种方式共用，下面的统计不含这部分）")
+    print("=" * 78)
+    history, _, _ = measure("story_history 字符串", run_string_history, segments)
+    store, _ = measure("StoryStore 分段存储", run_story_store, segments)
+    assert store.prompt_text() == history
+    assert "".join(store.iter_display_text()) == to_display_text(history)
+    print("两种方式的提示词文本与显示文本一致")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试：回合日志的写入开销和恢复耗时。
+
+写入：对比调用线程逐条"写入 + fsync"与 TurnJournal.append()（后台线程批量 fsync）在调用线程上的耗时，
+后者就是Tk主线程每轮要付出的代价。
+恢复：日志中分别有 100、1000、10000 轮时 read_tail() 读取最近一局最后20轮的耗时和读取的记录数，
+恢复耗时随日志长度增长超过 RESUME_TOLERANCE 倍时以非零状态退出。
+
+  python bench_turn_journal.py            # 完整测试
+  python bench_turn_journal.py --quick    # 最多1000轮
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from game_engine import RESUME_TURNS
+from turn_journal import TurnJournal, read_tail
+
+HISTORY_SIZES = [100, 1000, 10000]
+WRITES = 200
+RESUME_TOLERANCE = 5.0
+REPEATS = 5
+STORY = "你推开沉重的石门，潮湿的空气里混着铁锈的味道。" * 20
+
+
+def make_turn(turn):
+    return {'type': 'turn', 'time': time.time(), 'seq': turn, 'turn': turn, 'kind': 'continuation',
+            'model': 'qwen-turbo', 'prompt_chars': 4000, 'max_tokens': 1024, 'choice': "点燃火把-照亮前方的走廊。",
+            'raw': STORY, 'ok': True, 'error': None, 'story': STORY,
+            'options': ["点燃火把", "原路返回", "检查墙壁", "大声呼喊"],
+            'memory': {'summary': STORY[:1500], 'pending': [], 'recent': [STORY] * 6}}
+
+
+def bench_writes(directory):
+    """返回 (逐条fsync时每条的调用线程耗时, append()每条的调用线程耗时, 批量写入的fsync次数)。"""
+    path = os.path.join(directory, "sync.jsonl")
+    start = time.perf_counter()
+    with open(path, 'ab') as f:
+        for turn in range(1, WRITES + 1):
+            f.write((json.dumps(make_turn(turn), ensure_ascii=False) + "\n").encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+    sync_time = (time.perf_counter() - start) / WRITES
+
+    journal = TurnJournal(os.path.join(directory, "journal.jsonl"))
+    records = [make_turn(turn) for turn in range(1, WRITES + 1)]
+    start = time.perf_counter()
+    for record in records:
+        journal.append(record)
+    append_time = (time.perf_counter() - start) / WRITES
+    journal.close()
+    return sync_time, append_time, journal.stats['batches']
+
+
+def bench_resume(directory, turns):
+    """返回 (日志大小MB, 最短恢复耗时秒数, 读取的记录数)。"""
+    path = os.path.join(directory, f"history_{turns}.jsonl")
+    journal = TurnJournal(path)
+    journal.append({'type': 'start', 'time': time.time(), 'model': 'qwen-turbo', 'background': "## 故事背景\n地下城探险\n\n"})
+    for turn in range(1, turns + 1):
+        journal.append(make_turn(turn))
+    journal.close()
+
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        _, records, read = read_tail(path, RESUME_TURNS)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert len(records) == RESUME_TURNS
+    return os.path.getsize(path) / 1024 / 1024, best, read
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回合日志的写入开销和恢复耗时")
+    parser.add_argument('--quick', action='store_true', help="最多1000轮")
+    args = parser.parse_args()
+    sizes = [size for size in HISTORY_SIZES if size <= 1000] if args.quick else HISTORY_SIZES
+
+    with tempfile.TemporaryDirectory() as directory:
+        sync_time, append_time, batches = bench_writes(directory)
+        print("=" * 60)
+        print(f"每轮写入（{WRITES}轮）")
+        print(f"  逐条写入+fsync:        {sync_time * 1e3:8.3f} ms/轮（调用线程）")
+        print(f"  TurnJournal.append():  {append_time * 1e3:8.3f} ms/轮（调用线程），后台共{batches}次fsync")
+
+        print("=" * 60)
+        print(f"{'日志轮数':>8}{'大小(MB)':>10}{'恢复(ms)':>10}{'读取记录':>10}")
+        rows = [(turns,) + bench_resume(directory, turns) for turns in sizes]
+        for turns, size, elapsed, read in rows:
+            print(f"{turns:>8}{size:>10.1f}{elapsed * 1e3:>10.2f}{read:>10}")
+
+    growth = rows[-1][2] / rows[0][2]
+    if growth > RESUME_TOLERANCE:
+        print(f"恢复耗时随日志长度增长了 {growth:.1f} 倍，超过 {RESUME_TOLERANCE} 倍")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可取消的生成：每次生成（开篇、继续、重试、预生成分支）都带一个 CancelToken。
+
+重置游戏、重试或玩家选择了其他分支时，GameEngine 取消被取代的生成：正在进行的网络请求
+（包括流式请求）立即中止，连接和token不再继续消耗，等待结果的线程收到 GenerationCancelled。
+界面按生成编号丢弃已经放入队列、但属于旧生成的结果。
+"""
+
+import asyncio
+import contextlib
+import threading
+
+
+class GenerationCancelled(Exception):
+    """生成被新的操作（重置、重试、选择其他分支）取代。"""
+
+    def __init__(self, generation=None):
+        super().__init__(f"第 {generation} 次生成已被取消" if generation is not None else "生成已被取消")
+        self.generation = generation
+
+
+class CancelToken:
+    """
+    一次生成的取消句柄。
+
+    生成过程中把正在执行请求的 future（concurrent.futures.Future 或 asyncio 的 Task/Future）
+    用 attach() 登记到这里，cancel() 会取消它们；不能从外部中断的同步请求用 check() 在每段输出到达时检查。
+    """
+
+    def __init__(self, generation=None):
+        self.generation = generation
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._futures = set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """取消这次生成，可以在任意线程中调用，重复调用无效。"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            futures = list(self._futures)
+        for future in futures:
+            _cancel_future(future)
+
+    def wait(self, timeout):
+        """等待至多 timeout 秒，期间被取消时立即返回 True（供排队等待的同步代码使用）。"""
+        return self._event.wait(timeout)
+
+    def check(self):
+        """已取消时抛出 GenerationCancelled。"""
+        if self._event.is_set():
+            raise GenerationCancelled(self.generation)
+
+    @contextlib.contextmanager
+    def attach(self, future):
+        """在 with 块内登记 future，期间取消会一并取消它；已经取消时立即取消。"""
+        with self._lock:
+            self._futures.add(future)
+            cancelled = self._event.is_set()
+        if cancelled:
+            _cancel_future(future)
+        try:
+            yield future
+        finally:
+            with self._lock:
+                self._futures.discard(future)
+
+
+def _cancel_future(future):
+    if isinstance(future, asyncio.Future):
+        # asyncio 的任务只能在它的事件循环线程中取消
+        future.get_loop().call_soon_threadsafe(future.cancel)
+    else:
+        # run_coroutine_threadsafe 返回的 future 被取消时会转交事件循环取消对应的任务
+        future.cancel()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本机的 DashScope 文本生成替身服务，无需API Key和网络即可运行游戏、测试和基准。
+
+请求与响应格式与真实接口一致：
+  - result_format='message' 时返回 output.choices[0].message.content，否则返回 output.text
+  - 请求头 X-DashScope-SSE: enable 时以SSE流式返回；incremental_output 为假时每段返回累计文本
+  - 错误响应为 {"code", "message", "request_id"}
+  - 请求参数 response_format={"type": "json_object"} 时返回 {"story": ..., "options": [...]} 形式的JSON（结构化输出）
+
+可注入的延迟与故障（均可在命令行或构造参数中设置，seed 固定时结果可复现）：
+  first_token_latency   首个token前的延迟（秒）
+  per_token_latency     每个token（这里按1个字符计）的延迟（秒）
+  jitter                延迟的随机浮动比例，0.2 表示 ±20%
+  slow_rate / slow_factor  一部分请求（slow_rate）的首token延迟放大 slow_factor 倍，模拟偶发的极慢响应
+  rate_429 / rate_5xx   返回限流（429）和服务端错误（500/503）的比例
+  truncate_rate         输出在中途被截断（finish_reason=length）的比例
+  malformed_rate        输出的选项格式错误（缺少选项、选项不足等）的比例
+  stream_error_rate     流式输出中途发送 error 事件的比例
+  option_format         选项格式：marker / numbered / label / json / mixed（轮流使用前四种）
+
+运行：python fake_dashscope_server.py --port 18089 --per-token-latency 0.002 --rate-429 0.05
+然后在游戏中把Host填为 http://127.0.0.1:18089
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import uuid
+
+from aiohttp import web
+
+GENERATION_PATH = '/api/v1/services/aigc/text-generation/generation'
+
+STORY_SENTENCES = [
+    "你推开沉重的石门，潮湿的空气里混着铁锈的味道。",
+    "远处传来低沉的钟声，仿佛在提醒你时间所剩无几。",
+    "火把的光在墙上投下摇晃的影子，脚下的石板微微发烫。",
+    "一只通体银白的狐狸从阴影中探出头来，好奇地打量着你。",
+    "风从裂缝中灌进来，带着海盐和硫磺的气息。",
+    "你想起导师临别时的叮嘱：不要相信会说话的镜子。",
+    "墙上的壁画描绘着一场古老的战争，画中人的眼睛似乎在跟随你移动。",
+    "背包里的罗盘指针疯狂旋转，最后停在了一个不可能的方向。",
+]
+OPTION_TITLES = ["点燃火把", "原路返回", "检查墙壁", "大声呼喊", "跟随狐狸", "打开背包", "躲进阴影", "研究罗盘"]
+OPTION_FORMATS = ["marker", "numbered", "label", "json"]
+
+
+def make_story(rng, chars):
+    parts = []
+    total = 0
+    while total < chars:
+        sentence = rng.choice(STORY_SENTENCES)
+        parts.append(sentence)
+        total += len(sentence)
+    return "".join(parts)
+
+
+def make_descriptions(titles):
+    return [f"{title}，看看会发生什么。这样做也许会带来新的线索，也可能招来危险。" for title in titles]
+
+
+def make_options(rng, option_format, count=4):
+    titles = rng.sample(OPTION_TITLES, count)
+    descriptions = make_descriptions(titles)
+    if option_format == "numbered":
+        return "\n\n### 行动选项\n\n" + "\n".join(f"{i}. {t}-{d}" for i, (t, d) in enumerate(zip(titles, descriptions), 1))
+    if option_format == "label":
+        return "\n\n" + "\n".join(f"选项{i}：{t}-{d}" for i, (t, d) in enumerate(zip(titles, descriptions), 1))
+    if option_format == "json":
+        return "\n\n```json\n" + json.dumps({"options": [f"{t}-{d}" for t, d in zip(titles, descriptions)]}, ensure_ascii=False) + "\n```"
+    return "\n\n### 行动选项\n\n" + "\n\n".join(f"**{t}**-{d}" for t, d in zip(titles, descriptions))
+
+
+def make_json_object(rng, story, count=4):
+    """结构化输出：整段响应就是一个JSON对象。"""
+    titles = rng.sample(OPTION_TITLES, count)
+    options = [f"{t}-{d}" for t, d in zip(titles, make_descriptions(titles))]
+    return json.dumps({"story": story, "options": options}, ensure_ascii=False)
+
+
+def make_malformed(rng, story):
+    """几种常见的格式错误：没有选项、选项不足、选项没有任何标记。"""
+    kind = rng.choice(["no_options", "too_few", "unmarked"])
+    if kind == "no_options":
+        return story
+    if kind == "too_few":
+        return story + "\n\n### 行动选项\n\n**点燃火把**-照亮前方。"
+    return story + "\n\n你可以点燃火把，也可以原路返回，或者检查墙壁，又或者大声呼喊。"
+
+
+class FakeDashScopeServer:
+    """DashScope 文本生成接口的替身。start() 在后台线程中运行，serve_forever() 在当前线程中运行。"""
+
+    def __init__(self, host="127.0.0.1", port=0, first_token_latency=0.0, per_token_latency=0.0, jitter=0.0,
+                 slow_rate=0.0, slow_factor=10.0, rate_429=0.0, rate_5xx=0.0, truncate_rate=0.0, malformed_rate=0.0, stream_error_rate=0.0,
+                 story_chars=400, chunk_tokens=8, option_format="marker", seed=0):
+        self.host = host
+        self.port = port
+        self.first_token_latency = first_token_latency
+        self.per_token_latency = per_token_latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.truncate_rate = truncate_rate
+        self.malformed_rate = malformed_rate
+        self.stream_error_rate = stream_error_rate
+        self.story_chars = story_chars
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.option_format = option_format
+        self.rng = random.Random(seed)
+        self.stats = {'requests': 0, 'stream_requests': 0, 'rate_limited': 0, 'server_errors': 0,
+                      'truncated': 0, 'malformed': 0, 'stream_errors': 0, 'slow': 0}
+
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    # ------------------------------------------------------------------
+    # 响应内容
+    # ------------------------------------------------------------------
+    def _plan(self, stream, json_output=False):
+        """为一个请求抽取本次的故障与输出，返回 (状态码或None, 文本, finish_reason, 流式出错位置或None)。"""
+        rng = self.rng
+        self.stats['requests'] += 1
+        if stream:
+            self.stats['stream_requests'] += 1
+        roll = rng.random()
+        if roll < self.rate_429:
+            self.stats['rate_limited'] += 1
+            return 429, None, None, None
+        if roll < self.rate_429 + self.rate_5xx:
+            self.stats['server_errors'] += 1
+            return rng.choice([500, 503]), None, None, None
+
+        story = make_story(rng, self.story_chars)
+        if rng.random() < self.malformed_rate:
+            self.stats['malformed'] += 1
+            text = make_malformed(rng, story)
+        elif json_output:
+            text = make_json_object(rng, story)
+        else:
+            option_format = self.option_format
+            if option_format == "mixed":
+                option_format = OPTION_FORMATS[self.stats['requests'] % len(OPTION_FORMATS)]
+            text = story + make_options(rng, option_format)
+
+        finish_reason = "stop"
+        if rng.random() < self.truncate_rate:
+            self.stats['truncated'] += 1
+            text = text[:rng.randint(1, max(1, len(text) - 1))]
+            finish_reason = "length"
+
+        error_at = None
+        if stream and rng.random() < self.stream_error_rate:
+            self.stats['stream_errors'] += 1
+            error_at = rng.randint(0, max(0, len(text) - 1))
+        return None, text, finish_reason, error_at
+
+    def _delay(self, seconds):
+        if not seconds:
+            return 0.0
+        if self.jitter:
+            seconds *= 1 + self.rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, seconds)
+
+    @staticmethod
+    def _payload(text, finish_reason, result_format, input_tokens, output_tokens, request_id):
+        if result_format == 'message':
+            output = {'choices': [{'finish_reason': finish_reason, 'message': {'role': 'assistant', 'content': text}}]}
+        else:
+            output = {'text': text, 'finish_reason': finish_reason}
+        return {
+            'output': output,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                      'total_tokens': input_tokens + output_tokens},
+            'request_id': request_id,
+        }
+
+    @staticmethod
+    def _error_body(status, request_id):
+        if status == 429:
+            return {'code': 'Throttling.RateQuota', 'message': 'Requests rate limit exceeded, please try again later.',
+                    'request_id': request_id}
+        return {'code': 'InternalError', 'message': 'An internal error has occured, please try again later.',
+                'request_id': request_id}
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(GENERATION_PATH, self.handle_generation)
+        return app
+
+    async def handle_generation(self, request):
+        request_id = uuid.uuid4().hex
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({'code': 'InvalidParameter', 'message': 'Request body is not valid JSON.',
+                                      'request_id': request_id}, status=400)
+        parameters = body.get('parameters') or {}
+        result_format = parameters.get('result_format', 'text')
+        messages = (body.get('input') or {}).get('messages') or []
+        input_tokens = sum(len(str(m.get('content', ''))) for m in messages)
+        stream = request.headers.get('X-DashScope-SSE') == 'enable' or parameters.get('stream')
+        json_output = (parameters.get('response_format') or {}).get('type') == 'json_object'
+        status, text, finish_reason, error_at = self._plan(stream, json_output)
+
+        first_token_latency = self.first_token_latency
+        if self.slow_rate and self.rng.random() < self.slow_rate:
+            self.stats['slow'] += 1
+            first_token_latency *= self.slow_factor
+        await asyncio.sleep(self._delay(first_token_latency))
+        if status is not None:
+            headers = {'Retry-After': '1'} if status == 429 else None
+            return web.json_response(self._error_body(status, request_id), status=status, headers=headers)
+
+        if not stream:
+            await asyncio.sleep(self._delay(self.per_token_latency * len(text)))
+            return web.json_response(self._payload(text, finish_reason, result_format, input_tokens, len(text), request_id))
+
+        try:
+            return await self._stream(request, text, finish_reason, error_at, parameters, result_format, input_tokens,
+                                      request_id)
+        except ConnectionResetError:
+            # 客户端取消了请求（例如对冲请求中落后的一方），不再写入
+            return web.Response(status=499)
+
+    async def _stream(self, request, text, finish_reason, error_at, parameters, result_format, input_tokens, request_id):
+        incremental = parameters.get('incremental_output', False)
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream;charset=UTF-8'})
+        await response.prepare(request)
+        step = self.chunk_tokens
+        event_id = 0
+        for start in range(0, len(text), step):
+            if error_at is not None and start >= error_at:
+                event_id += 1
+                data = json.dumps(self._error_body(500, request_id), ensure_ascii=False)
+                await response.write(f"id:{event_id}\nevent:error\n:HTTP_STATUS/500\ndata:{data}\n\n".encode('utf-8'))
+                await response.write_eof()
+                return response
+            await asyncio.sleep(self._delay(self.per_token_latency * step))
+            end = min(len(text), start + step)
+            event_id += 1
+            chunk = text[start:end] if incremental else text[:end]
+            reason = finish_reason if end == len(text) else "null"
+            data = json.dumps(self._payload(chunk, reason, result_format, input_tokens, end, request_id), ensure_ascii=False)
+            await response.write(f"id:{event_id}\nevent:result\n:HTTP_STATUS/200\ndata:{data}\n\n".encode('utf-8'))
+        await response.write_eof()
+        return response
+
+    # ------------------------------------------------------------------
+    # 运行
+    # ------------------------------------------------------------------
+    async def _start_site(self):
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port, backlog=2048)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # port=0 时取系统分配的端口
+
+    def start(self):
+        """在后台线程中启动，返回 base_url。"""
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_site())
+            self._ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def serve_forever(self):
+        """在当前线程中运行（供命令行和 multiprocessing 使用）。"""
+        web.run_app(self.make_app(), host=self.host, port=self.port, print=None, backlog=2048)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DashScope 文本生成接口的本机替身")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18089)
+    parser.add_argument('--first-token-latency', type=float, default=0.0)
+    parser.add_argument('--per-token-latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-factor', type=float, default=10.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-5xx', type=float, default=0.0)
+    parser.add_argument('--truncate-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--stream-error-rate', type=float, default=0.0)
+    parser.add_argument('--story-chars', type=int, default=400)
+    parser.add_argument('--option-format', default='marker', choices=OPTION_FORMATS + ['mixed'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    server = FakeDashScopeServer(**vars(args))
+    print(f"DashScope 替身服务已启动: {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,929 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+无界面的游戏核心：提示词构造、调用大模型、解析响应和游戏状态都在这里，
+Tk界面（llm_adventure_game_final.py）只是它的一个客户端。
+
+两种用法：
+  同步：engine.start(...) / engine.choose(1) / engine.retry()，直接返回 TurnResult
+  分步：request = engine.new_game(...) / engine.begin_choice(option) / engine.begin_retry()
+        text = engine.generate(request)   # 可放在后台线程或其他并发模型中执行
+        result = engine.complete_turn(text)
+
+每次开篇、选择或重试都是一次新的生成（generation 加一），开始新的生成会取消仍在进行的上一次生成，
+正在进行的网络请求立即中止，等待它的调用收到 cancellation.GenerationCancelled。
+
+开启回合日志（enable_journal）后，每局的设置和每一轮的结果都追加写入日志，
+程序崩溃或关闭后用 engine.resume() 从日志末尾恢复最近一局。
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import time
+
+from cancellation import CancelToken, GenerationCancelled
+from llm_backend import DashScopeBackend, LLMError, LLMTimeoutError
+from model_router import ModelRouter, Route, SUMMARY, OK, TIMEOUT, ERROR, PARSE_FAILED
+from prompt_budget import PromptBudget, output_tokens_for
+from response_cache import LLMResponseCache
+from response_parser import ParseStats, StreamingOptionParser, parse_response
+from speculative_branches import SpeculativeBranchPool
+from story_memory import RollingSummaryMemory
+from story_store import StoryStore, StorySegment
+from turn_journal import START, TURN, read_tail
+
+DEFAULT_MODEL = "qwen-turbo"
+TOP_P = 0.9
+ROUTE_LOG_SIZE = 100  # 保留最近多少轮的路由记录
+RETRIEVAL_TOP_K = 3  # 每轮最多放进提示词的早前情节片段数
+RESUME_TURNS = 20  # 恢复游戏时从日志中读取并显示的最近轮数
+RETRIEVAL_QUERY_CHARS = 200  # 检索时除玩家的选择外，再带上最近一段情节末尾的这么多字
+
+# 提示词中的示例，纯文本格式和JSON格式共用同一段内容
+EXAMPLE_STORY = "随着晨星号缓缓降落在X-17星球表面，你透过驾驶舱的窗户向外望去，只见一片奇异而迷人的景象。这颗星球的地表覆盖着五彩斑斓的植物，远处连绵起伏的山脉反射出不寻常的光芒，仿佛整个世界都被某种神秘力量所笼罩。飞船降落带来的震动逐渐平息后，你意识到必须采取行动了———————不仅要确保自己和船员的安全，还要尽快找到修复飞船的方法。"
+EXAMPLE_OPTIONS = [
+    ("探索周围环境", "你决定先检查一下飞船降落点附近的区域，看看是否能找到任何有用的资源或线索。虽然未知总是伴随着危险，但直觉告诉你，了解这片土地的秘密可能是解决问题的关键所在。"),
+    ("启动紧急信号发射器", "考虑到情况危急，你认为最明智的选择是立即激活晨星号上的紧急求救信号发射装置，希望有人能够接收到你的求助信息，并前来救援。不过这样做也可能吸引到一些不必要的注意。"),
+    ("尝试自行修理飞船", "凭借着多年积累下来的机械知识，你觉得或许自己就能够解决当前遇到的问题。于是，你准备打开飞船的引擎舱盖，亲自检查能量核心损坏的具体原因，并寻找可能存在的修复方案。"),
+    ("与本地生物交流", "在降落过程中，你注意到不远处有一群外形奇特的生物正在好奇地观察着你们。尽管不知道它们是否友好，但也许这些原住民能提供关于这个星球以及如何获得帮助的信息。因此，你打算尝试接近并尝试与之沟通。"),
+]
+TEXT_FORMAT = """
+请按照以下格式返回：
+1. 首先写一段故事情节
+2. 然后写"### 行动选项"
+3. 接着列出四个选项，每个选项用"**选项标题**-选项描述"的格式
+"""
+JSON_FORMAT = """
+请只返回一个JSON对象，不要添加任何其他文字或代码块标记：
+{"story": "故事情节", "options": ["选项标题-选项描述", "选项标题-选项描述", "选项标题-选项描述", "选项标题-选项描述"]}
+其中 options 必须恰好包含四个字符串。
+"""
+TEXT_FEW_SHOT = "\n示例格式：\n" + EXAMPLE_STORY + "\n\n### 行动选项\n\n" + "\n\n".join(f"**{title}**-{desc}" for title, desc in EXAMPLE_OPTIONS) + "\n"
+JSON_FEW_SHOT = "\n示例格式：\n" + json.dumps({"story": EXAMPLE_STORY, "options": [f"{title}-{desc}" for title, desc in EXAMPLE_OPTIONS]}, ensure_ascii=False) + "\n"
+
+
+class TurnRequest:
+    """一次待发送给AI的请求。"""
+
+    OPENING = "opening"            # 开篇
+    CONTINUATION = "continuation"  # 根据玩家选择继续
+    REPAIR = "repair"              # 失败后重试
+
+    def __init__(self, kind, model, system_prompt, user_prompt, max_tokens, player_choice=None, json_output=False):
+        self.kind = kind
+        self.model = model
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.max_tokens = max_tokens
+        self.player_choice = player_choice
+        self.json_output = json_output  # 是否要求模型以JSON对象输出（结构化输出）
+        self.generation = None  # 生成编号，由 GameEngine 分配
+        self.cancel_token = None  # 取消句柄（cancellation.CancelToken），由 GameEngine 分配
+
+
+class TurnResult:
+    """一轮的结果。ok 为 False 时 error 为解析失败的原因。"""
+
+    def __init__(self, ok, story="", options=None, raw_text="", error=None):
+        self.ok = ok
+        self.story = story
+        self.options = options or []
+        self.raw_text = raw_text
+        self.error = error
+
+
+def parse_length_range(length_range_text, default=(300, 500)):
+    """解析长度范围（形如 "300-500"），返回 (最少字数, 最多字数)。"""
+    paragraph_min_chars, paragraph_max_chars = default
+    try:
+        if '-' in length_range_text:
+            _min, _max = length_range_text.split('-', 1)
+            paragraph_min_chars = max(50, int(_min))
+            paragraph_max_chars = max(paragraph_min_chars + 50, int(_max))
+    except Exception:
+        # 保留默认值
+        pass
+    return paragraph_min_chars, paragraph_max_chars
+
+
+def format_choice(option):
+    """玩家选择写入故事历史时使用的文本。"""
+    return f"\n\n**我的选择是：** *{option}*\n\n---\n\n"
+
+
+def format_parse_warning(text_response):
+    """AI响应无法解析时写入故事历史的警告和原始输出。"""
+    return f"\n\n---\n\n**[系统警告：AI响应无法解析，以下为原始输出]**\n\n{text_response}\n\n"
+
+
+class GameEngine:
+    """
+    文字冒险游戏的核心逻辑。
+
+    backend          大模型后端（默认 DashScopeBackend），需实现 complete()/stream()
+    response_cache   可选的 LLMResponseCache
+    """
+
+    def __init__(self, backend=None, response_cache=None, parse_stats=None):
+        self.backend = backend or DashScopeBackend()
+        self.response_cache = response_cache
+        self.parse_stats = parse_stats or ParseStats()  # 各解析策略的成功次数和耗时，可在多个引擎间共用
+
+        # --- 游戏状态 ---
+        self.story_store = StoryStore()  # 按段存储的完整故事（背景、情节、选择、警告），用于显示
+        self.memory = RollingSummaryMemory(summarize_fn=self._summarize_story)  # 发送给AI的滚动摘要记忆
+        self.current_options = []  # 当前可用的选项
+        self.last_player_choice = ""  # 玩家上一次的选择
+        self.last_request = None  # 上一次发出的请求，用于重试
+        self.generation = 0  # 当前生成的编号，每次开篇、选择或重试加一
+        self._cancel_tokens = []  # 当前生成的取消句柄（正式请求和被采用的预生成分支）
+        self.last_ai_response = ""  # AI的原始响应，用于调试
+        self._streamed_parse = None  # (文本, StreamingOptionParser)：最近一次流式请求边收边解析的结果
+        self._parsed_response = None  # (文本, 解析结果或异常, 耗时)：generate() 中已经解析过的响应
+        self.turn = 0  # 已完成的轮数
+
+        # --- 设置 ---
+        self.current_model = DEFAULT_MODEL
+        self.paragraph_min_chars = 300
+        self.paragraph_max_chars = 500
+        self.story_type = ""
+        self.option_style = ""
+        self.prompt_budget = None  # 按模型上下文窗口计算的token预算
+        self.max_new_tokens = 1024
+        self.speculative_pool = None  # 分支预生成任务池（可选）
+        self.json_output = False  # 结构化输出：要求模型返回JSON对象
+        self.router = None  # 按任务选择模型的路由表（model_router.ModelRouter，可选）
+        self.journal = None  # 回合日志（turn_journal.TurnJournal，可选）
+        self.retriever = None  # 早前情节的向量索引（story_retrieval.StoryRetriever，可选）
+        self.retrieval_top_k = RETRIEVAL_TOP_K
+        self.journal_seq = 0  # 本局已写入日志的回合记录数
+
+        # --- 统计 ---
+        self.last_ttft = None  # 最近一次请求的首字延迟（秒）
+        self.last_generation_time = None  # 最近一次请求的总生成时间（秒）
+        self.last_connect_time = None  # 最近一次请求建立连接（DNS+TCP+TLS）的耗时（秒），复用连接时为0，后端不支持时为 None
+        self.last_connection_reused = None  # 最近一次请求是否复用了连接池中的连接
+        self.last_hedged = None  # 最近一次请求是否发出了对冲请求（hedging.HedgedBackend），后端不支持时为 None
+        self.last_rate_limit_wait = None  # 最近一次请求在限流器中排队的秒数（rate_limiter.RateLimitedBackend），未限流时为 None
+        self.last_route = None  # 最近一轮的路由：任务、最终使用的模型、总耗时和每次尝试（模型、结果、耗时）
+        self.last_retrieved = []  # 最近一次构造提示词时取回的早前情节 [(相似度, 片段原文, 段序号)]
+        self.route_log = collections.deque(maxlen=ROUTE_LOG_SIZE)  # 最近各轮的路由记录
+
+    # ------------------------------------------------------------------
+    # 设置
+    # ------------------------------------------------------------------
+    def enable_cache(self, response_cache=None):
+        """开启响应缓存；传入 None 时使用默认的缓存文件。"""
+        self.response_cache = response_cache or self.response_cache or LLMResponseCache()
+
+    def disable_cache(self):
+        self.response_cache = None
+
+    def enable_speculation(self, max_concurrency=2):
+        """开启分支预生成。"""
+        self.disable_speculation()
+        self.speculative_pool = SpeculativeBranchPool(self._complete_branch, max_concurrency=max_concurrency)
+
+    def disable_speculation(self):
+        if self.speculative_pool:
+            self.speculative_pool.discard_all()
+        self.speculative_pool = None
+
+    def enable_json_output(self):
+        """要求模型以JSON对象输出；从下一次请求开始生效，解析时先走一次 json.loads 的快速路径。"""
+        self.json_output = True
+
+    def disable_json_output(self):
+        self.json_output = False
+
+    def enable_routing(self, router):
+        """按任务选择模型，失败时沿降级链换模型；router 为 ModelRouter 或一行路由描述。从下一次请求开始生效。"""
+        self.router = router if isinstance(router, ModelRouter) else ModelRouter(router)
+
+    def disable_routing(self):
+        self.router = None
+
+    def enable_journal(self, journal):
+        """把每局的设置和每一轮的结果追加写入回合日志（turn_journal.TurnJournal），从下一局或恢复后开始生效。"""
+        self.journal = journal
+
+    def disable_journal(self):
+        self.journal = None
+
+    def enable_retrieval(self, top_k=RETRIEVAL_TOP_K):
+        """每轮按玩家的选择取回最相关的 top_k 段早前情节原文放进提示词；当前的故事立即建立索引。
+
+        向量索引依赖 numpy，只在开启时导入；未安装时抛出 ImportError，检索保持关闭。
+        """
+        from story_retrieval import StoryRetriever  # 不开启检索时不需要安装 numpy
+        self.retrieval_top_k = top_k
+        if self.retriever is None:
+            self.retriever = StoryRetriever()
+            self._rebuild_retrieval()
+
+    def disable_retrieval(self):
+        self.retriever = None
+        self.last_retrieved = []
+
+    # ------------------------------------------------------------------
+    # 分步接口
+    # ------------------------------------------------------------------
+    def new_game(self, story_bg, model=DEFAULT_MODEL, length_range="", story_type="", option_style=""):
+        """开始新游戏，返回开篇请求。"""
+        self._apply_game_settings(model, length_range, story_type, option_style)
+        if self.speculative_pool:
+            self.speculative_pool.discard_all()
+
+        parts = ["## 故事背景\n", story_bg]
+        if self.story_type:
+            parts.append(f"\n\n## 故事类型\n{self.story_type}")
+        if self.option_style:
+            parts.append(f"\n\n## 选项风格\n{self.option_style}")
+        parts.append("\n\n")
+        background = "".join(parts)
+        self.story_store.reset(background)
+        # 旧的摘要任务结果会因 reset 被丢弃
+        self.memory.reset(background=background)
+        if self.retriever is not None:
+            self.retriever.reset()
+
+        self.current_options = []
+        self.last_player_choice = ""
+        self.last_ai_response = ""
+        self.turn = 0
+        self.journal_seq = 0
+        if self.journal is not None:
+            self.journal.append({'type': START, 'time': time.time(), 'model': model, 'length_range': length_range or "",
+                                 'story_type': self.story_type, 'option_style': self.option_style,
+                                 'json_output': self.json_output, 'background': background})
+
+        return self._start_generation(self._opening_request(background))
+
+    def resume(self, max_turns=RESUME_TURNS):
+        """
+        从回合日志恢复最近一局：设置、最近 max_turns 轮的故事、当前选项和记忆（取自最后一轮记录的快照），
+        只读取日志末尾，与日志长度无关。没有可恢复的游戏时返回 False。
+
+        最后一轮解析失败或开篇尚未完成时，last_request 为可直接交给 begin_retry() 的请求，current_options 为空。
+        """
+        if self.journal is None:
+            raise ValueError("没有开启回合日志")
+        self.journal.flush()
+        start, turns, _ = read_tail(self.journal.path, max_turns)
+        if start is None:
+            return False
+
+        self.cancel_generation()
+        self.generation += 1
+        if self.speculative_pool:
+            self.speculative_pool.discard_all()
+        self._apply_game_settings(start['model'], start.get('length_range', ""), start.get('story_type', ""),
+                                  start.get('option_style', ""))
+        background = start['background']
+        self.journal.start_offset = start['start_offset']
+
+        self.story_store.reset(background)
+        if turns and turns[0]['seq'] > 1:
+            self.story_store.append(StorySegment.WARNING, f"\n\n……（前{turns[0]['seq'] - 1}轮的记录已省略）……\n\n")
+        for record in turns:
+            if record.get('choice') and record['kind'] != TurnRequest.REPAIR:
+                self.story_store.append(StorySegment.CHOICE, format_choice(record['choice']))
+            if record['ok']:
+                self.story_store.append(StorySegment.STORY, record['story'])
+            else:
+                self.story_store.append(StorySegment.WARNING, format_parse_warning(record['raw']))
+
+        last = turns[-1] if turns else None
+        self.turn = last['turn'] if last else 0
+        self.journal_seq = last['seq'] if last else 0
+        self.last_player_choice = (last.get('choice') or "") if last else ""
+        self.last_ai_response = last['raw'] if last else ""
+        self.current_options = list(last['options']) if last and last['ok'] else []
+        if last is None:
+            self.memory.reset(background)
+        else:
+            self.memory.restore(background, last['memory'])
+        self._rebuild_retrieval()
+
+        self.last_request = None
+        if last is None or not last['ok']:
+            # 开篇未完成或最后一轮解析失败：准备好重新生成这一轮的请求
+            if self.last_player_choice:
+                system_prompt, prompt = self.build_prompts(player_choice=self.last_player_choice)
+                self.last_request = TurnRequest(TurnRequest.CONTINUATION, self._model_for(TurnRequest.CONTINUATION),
+                                                system_prompt, prompt, self.max_new_tokens, self.last_player_choice,
+                                                json_output=self.json_output)
+            else:
+                self.last_request = self._opening_request(background)
+        elif self.speculative_pool:
+            self.start_speculation()
+        return True
+
+    def option_for(self, choice_num):
+        """把玩家输入的编号（1-4）转换为选项文本，无效时抛出 ValueError。"""
+        if choice_num < 1 or choice_num > 4:
+            raise ValueError("请输入1-4之间的数字！")
+        if choice_num > len(self.current_options):
+            raise ValueError(f"当前只有{len(self.current_options)}个选项！")
+        return self.current_options[choice_num - 1]
+
+    def begin_choice(self, chosen_option):
+        """记录玩家的选择，返回继续故事的请求。"""
+        self.last_player_choice = chosen_option # 记录选择，以备重试
+        self.story_store.append(StorySegment.CHOICE, format_choice(chosen_option))
+        self.memory.add_segment(format_choice(chosen_option))
+        if self.retriever is not None:
+            self.retriever.skip_segment()
+
+        system_prompt, prompt = self.build_prompts(player_choice=chosen_option)
+        return self._start_generation(TurnRequest(TurnRequest.CONTINUATION, self._model_for(TurnRequest.CONTINUATION),
+                                                  system_prompt, prompt, self.max_new_tokens, chosen_option,
+                                                  json_output=self.json_output))
+
+    def begin_retry(self):
+        """
+        返回重试上一次请求的修复请求（提示词不变，按"修复"任务选择模型）；还没有发出过请求时返回 None。
+        上一次请求仍在进行时会被取消。
+        """
+        request = self.last_request
+        if request is None:
+            return None
+        model = request.model if request.kind == TurnRequest.REPAIR else self._model_for(TurnRequest.REPAIR)
+        return self._start_generation(TurnRequest(TurnRequest.REPAIR, model, request.system_prompt, request.user_prompt,
+                                                  request.max_tokens, request.player_choice, request.json_output))
+
+    def claim_branch(self, chosen_option):
+        """
+        开启预生成时，取出玩家所选选项的预生成分支（可能仍在生成中），没有则返回 None。
+        其余分支的请求被中止；取出的分支归入当前生成，重置或重试时一并取消。
+        """
+        if not self.speculative_pool:
+            return None
+        branch = self.speculative_pool.claim(chosen_option)
+        if branch is not None:
+            self._cancel_tokens.append(branch.cancel_token)
+        return branch
+
+    def cancel_generation(self):
+        """取消当前的生成：中止进行中的请求，等待它的调用收到 GenerationCancelled。"""
+        tokens, self._cancel_tokens = self._cancel_tokens, []
+        for token in tokens:
+            token.cancel()
+
+    def generate(self, request, on_delta=None, on_fallback=None):
+        """
+        执行请求并返回AI的文本。传入 on_delta 时使用流式输出，每收到一段增量文本就调用一次。
+        开启模型路由时按降级链依次尝试：超时、出错或响应无法解析时改用下一个模型，换模型前调用
+        on_fallback(失败的模型, 下一个模型, 原因)，流式输出时调用方应清除已显示的部分。
+        失败时抛出 LLMError，被新的生成取代时抛出 GenerationCancelled。可在后台线程中调用。
+        """
+        if request.cancel_token is not None:
+            request.cancel_token.check()
+        cache_key, cached = self._lookup_cache(request)
+        if cached is not None:
+            return self._cached_result(request, cached)
+
+        attempts = []
+        text = error = None
+        for route in self._routes_for(request):
+            start_time = self._begin_attempt(route, attempts, on_fallback)
+            try:
+                text, error = self._generate_with(route, request, on_delta, start_time), None
+            except LLMError as e:
+                text, error = None, e
+            if self._end_attempt(request, route, start_time, attempts, text, error):
+                break
+        return self._finish_generation(request, cache_key, attempts, text, error)
+
+    async def generate_async(self, request, on_delta=None, on_fallback=None):
+        """generate() 的 asyncio 版本，使用后端的 acomplete()/astream()；取消任务或取消这次生成都会中止请求。"""
+        token = request.cancel_token
+        if token is None:
+            return await self._agenerate(request, on_delta, on_fallback)
+        token.check()
+        task = asyncio.current_task()
+        with token.attach(task):
+            try:
+                return await self._agenerate(request, on_delta, on_fallback)
+            except asyncio.CancelledError:
+                # 只有取消这次生成引起的取消才转换为 GenerationCancelled，外部取消任务照常传递
+                if not token.cancelled:
+                    raise
+                raise GenerationCancelled(token.generation) from None
+
+    async def _agenerate(self, request, on_delta, on_fallback):
+        # 缓存是同步的 SQLite 调用（可能等锁），放到线程池中执行，不阻塞所有会话共用的事件循环
+        loop = asyncio.get_running_loop()
+        cache_key, cached = await loop.run_in_executor(None, self._lookup_cache, request) if self.response_cache else (None, None)
+        if cached is not None:
+            return self._cached_result(request, cached)
+
+        attempts = []
+        text = error = None
+        for route in self._routes_for(request):
+            start_time = self._begin_attempt(route, attempts, on_fallback)
+            try:
+                text, error = await self._agenerate_with(route, request, on_delta, start_time), None
+            except LLMError as e:
+                text, error = None, e
+            if self._end_attempt(request, route, start_time, attempts, text, error):
+                break
+        text = self._finish_generation(request, None, attempts, text, error)
+        if cache_key:
+            await loop.run_in_executor(None, self._store_in_cache, cache_key, attempts[-1]['model'], text)
+        return text
+
+    def complete_turn(self, text_response):
+        """解析AI返回的文本并更新游戏状态。"""
+        # 保存AI的原始响应用于调试
+        self.last_ai_response = text_response
+        request = self.last_request
+        model = request.model if request else self.current_model
+        json_output = request.json_output if request else self.json_output
+        start_time = time.perf_counter()
+        try:
+            parsed, self._parsed_response = self._parsed_response, None
+            # 流式请求在接收过程中已经边收边解析，这里只需收尾
+            streamed, self._streamed_parse = self._streamed_parse, None
+            if parsed is not None and parsed[0] is text_response:
+                # 检查路由结果或写入缓存时已经解析过，统计当时的耗时
+                start_time -= parsed[2]
+                if isinstance(parsed[1], Exception):
+                    raise parsed[1]
+                story_part, options, strategy = parsed[1]
+            elif streamed is not None and streamed[0] is text_response:
+                story_part, options = streamed[1].finish()
+                strategy = 'text'
+            else:
+                story_part, options, strategy = parse_response(text_response, json_output)
+        except Exception as e:
+            self.parse_stats.record_failure(model, (time.perf_counter() - start_time) * 1e6)
+            # 将原始响应添加到故事历史中
+            self.story_store.append(StorySegment.WARNING, format_parse_warning(text_response))
+            self.current_options = []
+            self._journal_turn(request, text_response, error=str(e))
+            return TurnResult(False, raw_text=text_response, error=str(e))
+
+        self.parse_stats.record(model, strategy, (time.perf_counter() - start_time) * 1e6)
+
+        self.story_store.append(StorySegment.STORY, story_part)
+        self.memory.add_segment(story_part)
+        if self.retriever is not None:
+            self.retriever.add_segment(story_part)
+        self.current_options = options
+        self.turn += 1
+        self._journal_turn(request, text_response, story=story_part)
+
+        if self.speculative_pool:
+            self.start_speculation()
+        return TurnResult(True, story_part, options, text_response)
+
+    # ------------------------------------------------------------------
+    # 同步接口
+    # ------------------------------------------------------------------
+    def start(self, story_bg, model=DEFAULT_MODEL, length_range="", story_type="", option_style=""):
+        """开始新游戏并生成开篇。"""
+        request = self.new_game(story_bg, model, length_range, story_type, option_style)
+        return self.complete_turn(self.generate(request))
+
+    def choose(self, choice_num):
+        """选择第 choice_num（1-4）个选项并生成后续情节。"""
+        chosen_option = self.option_for(choice_num)
+        request = self.begin_choice(chosen_option)
+        branch = self.claim_branch(chosen_option)
+        if branch is not None:
+            branch.finished.wait()
+            if branch.is_done():
+                return self.complete_turn(branch.text)
+        return self.complete_turn(self.generate(request))
+
+    def retry(self):
+        """重试上一次请求。"""
+        request = self.begin_retry()
+        if request is None:
+            raise ValueError("还没有可以重试的请求")
+        return self.complete_turn(self.generate(request))
+
+    def close(self):
+        """结束游戏：中止进行中的请求，停止后台摘要线程和预生成任务，写完回合日志。"""
+        self.cancel_generation()
+        self.disable_speculation()
+        self.memory.close()
+        if self.journal is not None:
+            self.journal.close()
+
+    def snapshot(self):
+        """当前游戏状态的快照（可直接转换为JSON）。"""
+        return {
+            'model': self.current_model,
+            'turn': self.turn,
+            'generation': self.generation,
+            'options': list(self.current_options),
+            'last_player_choice': self.last_player_choice,
+            'segments': len(self.story_store),
+            'story_chars': self.story_store.char_count,
+            'summary': self.memory.summary,
+            'last_ttft': self.last_ttft,
+            'last_generation_time': self.last_generation_time,
+            'last_connect_time': self.last_connect_time,
+            'last_connection_reused': self.last_connection_reused,
+            'last_hedged': self.last_hedged,
+            'last_rate_limit_wait': self.last_rate_limit_wait,
+            'last_route': self.last_route,
+            'json_output': self.json_output,
+            'retrieved': len(self.last_retrieved),
+        }
+
+    # ------------------------------------------------------------------
+    # 提示词
+    # ------------------------------------------------------------------
+    def build_prompts(self, initial_prompt=None, player_choice=None, memory_context=None):
+        """
+        构造 (system_prompt, user_prompt)。memory_context 默认取自滚动摘要记忆，预生成时传入假设选择后的记忆。
+        开启结构化输出时，返回格式和示例都换成JSON。
+        """
+        if memory_context is None:
+            memory_context = self.memory.render()
+        if initial_prompt:
+            history = initial_prompt
+            render_user = lambda history: f"这是文字冒险游戏的开篇，请根据以下背景，生成第一段引人入胜的故事情节和四个截然不同的行动选项。故事背景：\n\n{history}"
+        else:
+            # 这就是核心：将故事记忆（前情提要 + 最近情节原文）作为"精简的全篇故事走向"发给AI
+            history = memory_context
+            # 前情提要会丢掉细节，再按玩家的选择取回几段相关的早前原文；它们不随故事记忆从前面裁剪
+            recalled = self._recall_passages(player_choice)
+            render_user = lambda history: f"""
+以下是目前为止的故事情节（这是我们的记忆，较早的部分已整理为前情提要）：
+---
+{history}
+---
+{recalled}玩家刚刚做出的选择是："{player_choice}"
+
+请基于以上所有内容，继续推进故事，并提供四个新的、截然不同的行动选项。
+"""
+
+        system_prompt = f"""
+你是一位才华横溢、充满想象力的文字冒险游戏AI。你的任务是：
+1. 根据玩家的选择和已有的故事，生成一段生动、具体的后续情节（大约{self.paragraph_min_chars}-{self.paragraph_max_chars}字，尽量写满范围上限，细节丰富、包含感官描写与动作）。若未达到最少字数{self.paragraph_min_chars}，请继续扩写，不要提前开始列出选项。
+2. 在情节的结尾，为玩家提供四个风格迥异、导向完全不同剧情分支的行动选项。
+3. 故事类型偏好：{self.story_type or '不限'}。
+4. 选项风格要求：{self.option_style or '清晰互斥、差异明显'}。
+""" + (JSON_FORMAT if self.json_output else TEXT_FORMAT)
+        # 示例在超出token预算时最先被去掉
+        few_shot = JSON_FEW_SHOT if self.json_output else TEXT_FEW_SHOT
+        budgeted = self.prompt_budget.fit(system_prompt, few_shot, history, render_user, self.max_new_tokens)
+        if budgeted.trimmed:
+            print(f"提示词超出预算: {budgeted.describe()}")  # 调试信息
+        return budgeted.system_prompt, budgeted.user_prompt
+
+    def start_speculation(self):
+        """玩家阅读时，为当前四个选项在后台预生成后续情节。"""
+        branch_prompts = []
+        for option in self.current_options:
+            history = self.memory.render() + format_choice(option)
+            system_prompt, prompt = self.build_prompts(player_choice=option, memory_context=history)
+            branch_prompts.append((option, system_prompt, prompt))
+        self.speculative_pool.start_round(branch_prompts)
+
+    # ------------------------------------------------------------------
+    # 内部
+    # ------------------------------------------------------------------
+    def _apply_game_settings(self, model, length_range, story_type, option_style):
+        self.current_model = model
+        self.paragraph_min_chars, self.paragraph_max_chars = parse_length_range(length_range)
+        # 先为故事正文与四个选项预留输出token，输入部分在每轮构造提示词时按剩余预算裁剪
+        self.prompt_budget = PromptBudget(model)
+        self.max_new_tokens = max(256, min(output_tokens_for(self.paragraph_max_chars), self.prompt_budget.max_output))
+        self.story_type = story_type or ""
+        self.option_style = option_style or ""
+
+    def _opening_request(self, background):
+        system_prompt, prompt = self.build_prompts(initial_prompt=background)
+        return TurnRequest(TurnRequest.OPENING, self._model_for(TurnRequest.OPENING), system_prompt, prompt,
+                           self.max_new_tokens, json_output=self.json_output)
+
+    def _recall_passages(self, player_choice):
+        """取回与玩家选择相关、且不在最近原文中的早前情节，返回放进提示词的文字（没有时为空）。"""
+        if self.retriever is None or not player_choice:
+            return ""
+        # 最近几段（以及尚未折叠进摘要的几段）仍以原文在提示词中，不再重复
+        verbatim = len(self.memory.recent) + len(self.memory.pending)
+        tail = next((segment.text[-RETRIEVAL_QUERY_CHARS:] for segment in reversed(self.story_store.segments)
+                     if segment.kind == StorySegment.STORY), "")
+        passages = self.retriever.search(f"{player_choice}\n{tail}", k=self.retrieval_top_k,
+                                         before_segment=self.retriever.segments - verbatim)
+        self.last_retrieved = passages
+        if not passages:
+            return ""
+        lines = "\n".join(f"……{text}……" for _, text, _ in passages)
+        return f"与这个选择相关的早前情节（原文摘录，注意人物、物品和伏笔前后一致）：\n{lines}\n\n"
+
+    def _rebuild_retrieval(self):
+        """按故事存储中的情节和选择重建检索索引（开启检索或恢复游戏时）。"""
+        if self.retriever is None:
+            return
+        self.retriever.reset()
+        for segment in self.story_store.segments:
+            if segment.kind == StorySegment.STORY:
+                self.retriever.add_segment(segment.text)
+            elif segment.kind == StorySegment.CHOICE:
+                self.retriever.skip_segment()
+
+    def _journal_turn(self, request, text_response, story=None, error=None):
+        """把这一轮写入回合日志；只放入写入队列，不等待磁盘。"""
+        if self.journal is None:
+            return
+        self.journal_seq += 1
+        self.journal.append({
+            'type': TURN, 'time': time.time(), 'seq': self.journal_seq, 'turn': self.turn,
+            'kind': request.kind if request else TurnRequest.CONTINUATION,
+            'model': request.model if request else self.current_model,
+            'prompt_chars': len(request.system_prompt) + len(request.user_prompt) if request else None,
+            'max_tokens': request.max_tokens if request else self.max_new_tokens,
+            'generation_time': self.last_generation_time,
+            'choice': request.player_choice if request else None,
+            'raw': text_response, 'ok': error is None, 'error': error,
+            'story': story, 'options': list(self.current_options),
+            'memory': self.memory.checkpoint(),
+        })
+
+    def _lookup_cache(self, request):
+        """返回 (缓存键, 缓存的文本)；未开启缓存时都是 None。"""
+        if not self.response_cache:
+            return None, None
+        cache_key = self._cache_key(request)
+        return cache_key, self.response_cache.get(cache_key)
+
+    def _start_generation(self, request):
+        """取消仍在进行的上一次生成，为 request 分配新的生成编号和取消句柄。"""
+        self.cancel_generation()
+        self.generation += 1
+        request.generation = self.generation
+        request.cancel_token = CancelToken(self.generation)
+        self._cancel_tokens = [request.cancel_token]
+        self.last_request = request
+        return request
+
+    @staticmethod
+    def _wait_future(future, cancel_token):
+        """等待在后端事件循环中执行的请求；取消这次生成时立即返回并中止请求。"""
+        if cancel_token is None:
+            return future.result()
+        with cancel_token.attach(future):
+            try:
+                return future.result()
+            except concurrent.futures.CancelledError:
+                raise GenerationCancelled(cancel_token.generation)
+
+    def _record_connection(self, trace):
+        """记录后端写入 trace 的连接信息。"""
+        self.last_connect_time = trace.get('connect_time')
+        self.last_connection_reused = trace.get('reused')
+        self.last_hedged = trace.get('hedged')
+        self.last_rate_limit_wait = trace.get('rate_limit_wait')
+
+    def _routes_for(self, request):
+        """请求的降级链：未开启路由时只有请求中的模型。"""
+        if self.router is None:
+            return [Route(request.model)]
+        return self.router.routes(request.kind, self.current_model)
+
+    def _model_for(self, task):
+        return self.router.first_model(task, self.current_model) if self.router else self.current_model
+
+    def _route_outcome(self, text, json_output):
+        """后台任务（预生成、摘要）用：开启路由时检查响应能否解析，无法解析则换下一个模型；未开启时不额外解析。"""
+        if self.router is None:
+            return OK
+        try:
+            parse_response(text, json_output)
+        except Exception:
+            return PARSE_FAILED
+        return OK
+
+    @staticmethod
+    def _begin_attempt(route, attempts, on_fallback):
+        """降级链中的一次尝试开始：换模型时先调用 on_fallback，返回开始时刻。"""
+        if attempts and on_fallback is not None:
+            on_fallback(attempts[-1]['model'], route.model, attempts[-1]['outcome'])
+        return time.perf_counter()
+
+    def _end_attempt(self, request, route, start_time, attempts, text, error):
+        """记录一次尝试的结果，成功时返回 True；开启路由或缓存时在这里解析一次响应，结果留给 complete_turn。"""
+        if error is not None:
+            outcome = TIMEOUT if isinstance(error, LLMTimeoutError) else ERROR
+        elif self.router is None and not self.response_cache:
+            outcome = OK
+        else:
+            outcome = OK if self._parse_once(text, request.json_output) or self.router is None else PARSE_FAILED
+        self._record_attempt(request.kind, route.model, outcome, start_time, attempts)
+        return outcome == OK
+
+    def _finish_generation(self, request, cache_key, attempts, text, error):
+        """降级链结束：记录路由，全部失败时抛出最后一个错误，否则缓存（cache_key 不为 None 时）并返回文本。"""
+        self._finish_route(request, attempts)
+        if text is None:
+            raise error
+        if cache_key:
+            # 按实际给出响应的模型记录（降级后不一定是请求中的模型）
+            self._store_in_cache(cache_key, attempts[-1]['model'], text)
+        return text
+
+    def _cached_result(self, request, text):
+        self._finish_route(request, [{'model': request.model, 'outcome': 'cached', 'latency': 0.0}])
+        return text
+
+    def _parse_once(self, text, json_output):
+        """解析响应并记下结果（或异常）和耗时，同一个响应在 complete_turn 中不再重复解析；返回是否解析成功。"""
+        start_time = time.perf_counter()
+        streamed, self._streamed_parse = self._streamed_parse, None
+        try:
+            if streamed is not None and streamed[0] is text:
+                parsed = streamed[1].finish() + ('text',)
+            else:
+                parsed = parse_response(text, json_output)
+        except Exception as e:
+            parsed = e
+        self._parsed_response = (text, parsed, time.perf_counter() - start_time)
+        return not isinstance(parsed, Exception)
+
+    def _record_attempt(self, task, model, outcome, start_time, attempts):
+        seconds = time.perf_counter() - start_time
+        attempts.append({'model': model, 'outcome': outcome, 'latency': round(seconds, 3)})
+        if self.router is not None:
+            self.router.record(task, model, outcome, seconds)
+        if outcome != OK:
+            print(f"模型 {model} 请求未成功（{outcome}），耗时{seconds:.2f}s")  # 调试信息
+
+    def _finish_route(self, request, attempts):
+        """记录本轮的路由：任务、最终使用的模型、总耗时和每次尝试。"""
+        self.last_route = {
+            'task': request.kind,
+            'model': attempts[-1]['model'],
+            'outcome': attempts[-1]['outcome'],
+            'latency': round(sum(attempt['latency'] for attempt in attempts), 3),
+            'attempts': attempts,
+        }
+        self.route_log.append(dict(self.last_route, turn=self.turn + 1))
+
+    @staticmethod
+    def _timeout_error(route):
+        return LLMTimeoutError(f"模型 {route.model} 超过{route.timeout:g}秒没有完成")
+
+    def _generate_with(self, route, request, on_delta, start_time):
+        """用降级链中的一个模型执行请求。"""
+        token = request.cancel_token
+        loop = self.backend.event_loop() if route.timeout or token is not None else None
+        if loop is not None:
+            # 在后端的事件循环中执行，超时或取消这次生成时中止请求
+            future = asyncio.run_coroutine_threadsafe(self._agenerate_with(route, request, on_delta, start_time), loop)
+            return self._wait_future(future, token)
+
+        trace = {'cancel_token': token}  # 限流排队时被取消则立即放弃（rate_limiter.RateLimitedBackend）
+        if on_delta is None:
+            text = self.backend.complete(route.model, request.system_prompt, request.user_prompt, request.max_tokens, TOP_P,
+                                         json_output=request.json_output, trace=trace).text
+            self.last_ttft = self.last_generation_time = time.perf_counter() - start_time
+        else:
+            ttft = None
+            chunks = []
+            # 纯文本输出时边收边解析；JSON输出收完后一次 json.loads 即可
+            parser = None if request.json_output else StreamingOptionParser()
+            stream = self.backend.stream(route.model, request.system_prompt, request.user_prompt, request.max_tokens, TOP_P,
+                                         json_output=request.json_output, trace=trace)
+            for delta in stream:
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                chunks.append(delta)
+                if parser is not None:
+                    parser.feed(delta)
+                on_delta(delta)
+                # 其他后端无法从外部中断，只能在每段到达时检查是否超时或已取消
+                if token is not None and token.cancelled:
+                    stream.close()
+                    token.check()
+                if route.timeout and time.perf_counter() - start_time > route.timeout:
+                    stream.close()
+                    raise self._timeout_error(route)
+            text = self._finish_stream(chunks, ttft, start_time)
+            if parser is not None:
+                self._streamed_parse = (text, parser)
+        self._record_connection(trace)
+        return text
+
+    async def _agenerate_with(self, route, request, on_delta, start_time):
+        """_generate_with() 的 asyncio 版本，超时后取消请求。"""
+        if not route.timeout:
+            return await self._agenerate_once(route.model, request, on_delta, start_time)
+        try:
+            return await asyncio.wait_for(self._agenerate_once(route.model, request, on_delta, start_time), route.timeout)
+        except asyncio.TimeoutError:
+            raise self._timeout_error(route)
+
+    async def _agenerate_once(self, model, request, on_delta, start_time):
+        trace = {}
+        if on_delta is None:
+            result = await self.backend.acomplete(model, request.system_prompt, request.user_prompt, request.max_tokens, TOP_P,
+                                                  json_output=request.json_output, trace=trace)
+            text = result.text
+            self.last_ttft = self.last_generation_time = time.perf_counter() - start_time
+        else:
+            ttft = None
+            chunks = []
+            # 纯文本输出时边收边解析；JSON输出收完后一次 json.loads 即可
+            parser = None if request.json_output else StreamingOptionParser()
+            async for delta in self.backend.astream(model, request.system_prompt, request.user_prompt, request.max_tokens, TOP_P,
+                                                    json_output=request.json_output, trace=trace):
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                chunks.append(delta)
+                if parser is not None:
+                    parser.feed(delta)
+                on_delta(delta)
+            text = self._finish_stream(chunks, ttft, start_time)
+            if parser is not None:
+                self._streamed_parse = (text, parser)
+        self._record_connection(trace)
+        return text
+
+    def _finish_stream(self, chunks, ttft, start_time):
+        """记录流式请求的首字延迟和总耗时，返回完整文本。"""
+        text = "".join(chunks)
+        self.last_ttft = ttft
+        self.last_generation_time = time.perf_counter() - start_time
+        if not text:
+            raise LLMError("流式请求结束，但未收到任何文本内容。")
+        return text
+
+    def _cache_key(self, request):
+        """响应缓存的键：模型、提示词和采样参数。"""
+        params = {
+            'result_format': 'message',
+            'max_tokens': request.max_tokens,
+            'top_p': TOP_P,
+        }
+        if request.json_output:
+            params['response_format'] = 'json_object'  # 只在开启时加入，已有的缓存键保持不变
+        return LLMResponseCache.make_key(request.model, request.system_prompt, request.user_prompt, params)
+
+    def _store_in_cache(self, cache_key, model, text):
+        """只缓存能够正常解析的响应（_parse_once 的结果），避免重试时反复拿到同一个错误结果。"""
+        cache = self.response_cache
+        parsed = self._parsed_response
+        if not text or cache is None or parsed is None or parsed[0] is not text or isinstance(parsed[1], Exception):
+            return
+        try:
+            cache.put(cache_key, model, text)
+        except Exception as e:
+            print(f"写入响应缓存失败: {e}")  # 调试信息
+
+    def _complete_once(self, system_prompt, user_prompt, json_output=False, task=TurnRequest.CONTINUATION, cancel_token=None):
+        """
+        以非流式方式同步调用一次API，返回 (文本, 消耗token数)；供预生成、摘要等后台任务使用。
+        开启模型路由时按 task 的降级链依次尝试（摘要不检查格式），不影响 last_route 等本轮统计。
+        传入 cancel_token 时，取消后中止请求并抛出 GenerationCancelled。
+        """
+        routes = self.router.routes(task, self.current_model) if self.router else [Route(self.current_model)]
+        result = error = None
+        for route in routes:
+            start_time = time.perf_counter()
+            try:
+                result = self._complete_with(route, system_prompt, user_prompt, json_output, cancel_token)
+                outcome = OK if task == SUMMARY else self._route_outcome(result.text, json_output)
+            except LLMError as e:
+                result, error = None, e
+                outcome = TIMEOUT if isinstance(e, LLMTimeoutError) else ERROR
+            self._record_attempt(task, route.model, outcome, start_time, [])
+            if outcome == OK:
+                break
+        if result is None:
+            raise error
+        return result.text, result.total_tokens
+
+    def _complete_with(self, route, system_prompt, user_prompt, json_output, cancel_token=None):
+        if cancel_token is not None:
+            cancel_token.check()
+        loop = self.backend.event_loop() if route.timeout or cancel_token is not None else None
+        if loop is not None:
+            coroutine = asyncio.wait_for(self.backend.acomplete(route.model, system_prompt, user_prompt, self.max_new_tokens, TOP_P,
+                                                                json_output=json_output), route.timeout)
+            future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+            try:
+                return self._wait_future(future, cancel_token)
+            except asyncio.TimeoutError:
+                raise self._timeout_error(route)
+        return self.backend.complete(route.model, system_prompt, user_prompt, self.max_new_tokens, TOP_P, json_output=json_output,
+                                     trace={'cancel_token': cancel_token})
+
+    def _complete_branch(self, system_prompt, user_prompt, cancel_token=None):
+        """预生成分支：与正式请求使用相同的输出格式；玩家选择了其他分支时中止请求。"""
+        return self._complete_once(system_prompt, user_prompt, self.json_output, cancel_token=cancel_token)
+
+    def _summarize_story(self, previous_summary, new_text, max_chars):
+        """由后台记忆线程调用：让AI把旧摘要和新折叠的情节合并为新的前情提要。"""
+        system_prompt = f"你是文字冒险游戏的记录员。请把前情提要和新增情节合并为一份不超过{max_chars}字的摘要，保留人物、物品、地点、目标和未解决的悬念，只输出摘要正文。"
+        user_prompt = f"## 前情提要\n\n{previous_summary or '（暂无）'}\n\n## 新增情节\n\n{new_text}"
+        summary, _ = self._complete_once(system_prompt, user_prompt, task=SUMMARY)
+        return summary.strip()
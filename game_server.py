@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多人在线的HTTP服务模式：每个玩家一个会话，每个会话一个 GameEngine，
+全部会话共用一个 asyncio 事件循环和一个大模型连接池。
+
+接口（请求和响应都是JSON）：
+  POST /sessions                       开始新游戏  {"story_bg", "model", "length_range", "story_type", "option_style", "json_output"}
+  POST /sessions/{session_id}/choose   选择选项    {"choice": 1-4}
+  POST /sessions/{session_id}/retry    重试上一次请求
+  GET  /sessions/{session_id}          当前状态（?story=1 时附带完整故事文本）
+  GET  /metrics                        各接口的请求数、错误数和 p50/p99 延迟，按模型统计的解析策略，对冲请求、模型路由、自动重试和限流排队的统计
+
+运行：python game_server.py --port 8080 --api-key sk-xxx
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+
+from aiohttp import web
+
+from async_dashscope import AsyncDashScopeBackend, DEFAULT_COMPRESS_THRESHOLD
+from cancellation import GenerationCancelled
+from game_engine import GameEngine, DEFAULT_MODEL
+from hedging import HedgedBackend
+from model_router import ModelRouter
+from rate_limiter import RateLimitedBackend, shared_limiter
+from retrying import COOLDOWN, FAILURE_THRESHOLD, MAX_RETRIES, RetryingBackend
+from llm_backend import LLMError
+from response_parser import ParseStats
+
+METRIC_SAMPLES = 10000  # 每个接口保留的最近延迟样本数
+
+
+class EndpointMetrics:
+    """按接口统计请求数、错误数和延迟分位数。"""
+
+    def __init__(self, max_samples=METRIC_SAMPLES):
+        self.max_samples = max_samples
+        self.samples = {}  # 接口 -> 最近的延迟（秒）
+        self.counts = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, ok=True):
+        if endpoint not in self.samples:
+            self.samples[endpoint] = deque(maxlen=self.max_samples)
+            self.counts[endpoint] = 0
+            self.errors[endpoint] = 0
+        self.samples[endpoint].append(seconds)
+        self.counts[endpoint] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def summary(self):
+        result = {}
+        for endpoint, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[endpoint] = {
+                'count': self.counts[endpoint],
+                'errors': self.errors[endpoint],
+                'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+                'p50_ms': round(ordered[len(ordered) // 2] * 1000, 2),
+                'p99_ms': round(ordered[max(0, int(len(ordered) * 0.99) - 1)] * 1000, 2),
+                'max_ms': round(ordered[-1] * 1000, 2),
+            }
+        return result
+
+
+class GameSession:
+    """一个玩家的游戏会话。lock 保证同一会话同时只有一个请求在推进故事。"""
+
+    def __init__(self, session_id, engine):
+        self.session_id = session_id
+        self.engine = engine
+        self.lock = asyncio.Lock()
+        self.created_at = time.time()
+        self.last_active = self.created_at
+
+
+class SessionStore:
+    """按 session_id 保存会话；超过 idle_timeout 秒未活动或超过 max_sessions 时淘汰最久未活动的会话。"""
+
+    def __init__(self, max_sessions=1000, idle_timeout=3600):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, engine):
+        self.evict_idle()
+        while len(self.sessions) >= self.max_sessions:
+            oldest = min(self.sessions.values(), key=lambda session: session.last_active)
+            self.remove(oldest.session_id)
+        session = GameSession(uuid.uuid4().hex, engine)
+        self.sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_active = time.time()
+        return session
+
+    def remove(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.engine.close()
+
+    def evict_idle(self):
+        deadline = time.time() - self.idle_timeout
+        for session_id in [s.session_id for s in self.sessions.values() if s.last_active < deadline]:
+            self.remove(session_id)
+
+
+class GameServer:
+    """
+    backend          所有会话共用的大模型后端（默认 AsyncDashScopeBackend；可用 retrying.RetryingBackend 包装以自动重试，
+                     用 hedging.HedgedBackend 包装以对冲慢请求）
+    response_cache   可选，所有会话共用的响应缓存
+    json_output      新会话默认是否使用JSON结构化输出（请求中的 json_output 优先）
+    warm_connections 启动时预先建立的大模型连接数（后端支持 awarm_up 时）
+    router           可选，所有会话共用的 model_router.ModelRouter（按任务选择模型，失败时降级）
+    rate_limiter     可选，后端使用的 rate_limiter.RateLimiter，只用于在 /metrics 中显示排队情况
+    """
+
+    def __init__(self, backend=None, response_cache=None, max_sessions=1000, idle_timeout=3600, json_output=False,
+                 warm_connections=0, router=None, rate_limiter=None):
+        self.backend = backend or AsyncDashScopeBackend()
+        self.response_cache = response_cache
+        self.json_output = json_output
+        self.warm_connections = warm_connections
+        self.router = router
+        self.rate_limiter = rate_limiter
+        self.parse_stats = ParseStats()  # 所有会话共用
+        self.store = SessionStore(max_sessions, idle_timeout)
+        self.metrics = EndpointMetrics()
+
+    def make_app(self):
+        app = web.Application(middlewares=[self.metrics_middleware])
+        app.router.add_post('/sessions', self.handle_start, name='start')
+        app.router.add_post('/sessions/{session_id}/choose', self.handle_choose, name='choose')
+        app.router.add_post('/sessions/{session_id}/retry', self.handle_retry, name='retry')
+        app.router.add_get('/sessions/{session_id}', self.handle_state, name='state')
+        app.router.add_get('/metrics', self.handle_metrics, name='metrics')
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+    @web.middleware
+    async def metrics_middleware(self, request, handler):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = await handler(request)
+            ok = response.status < 400
+            return response
+        finally:
+            endpoint = request.match_info.route.name or 'unknown'
+            self.metrics.record(endpoint, time.perf_counter() - start, ok)
+
+    async def on_startup(self, app):
+        if self.warm_connections and hasattr(self.backend, 'awarm_up'):
+            opened = await self.backend.awarm_up(self.warm_connections)
+            print(f"已预热{opened}个大模型连接")
+
+    async def on_cleanup(self, app):
+        for session_id in list(self.store.sessions):
+            self.store.remove(session_id)
+        if hasattr(self.backend, 'aclose'):
+            await self.backend.aclose()
+
+    # ------------------------------------------------------------------
+    # 接口
+    # ------------------------------------------------------------------
+    async def handle_start(self, request):
+        body = await self._json(request)
+        story_bg = (body.get('story_bg') or '').strip()
+        if not story_bg:
+            return self._error(400, "故事背景不能为空！")
+        engine = GameEngine(self.backend, self.response_cache, self.parse_stats)
+        if body.get('json_output', self.json_output):
+            engine.enable_json_output()
+        if self.router is not None:
+            engine.enable_routing(self.router)
+        session = self.store.create(engine)
+        turn_request = engine.new_game(story_bg, body.get('model') or DEFAULT_MODEL, body.get('length_range') or '',
+                                       body.get('story_type') or '', body.get('option_style') or '')
+        async with session.lock:
+            return await self._run_turn(session, turn_request)
+
+    async def handle_choose(self, request):
+        session = self._session(request)
+        body = await self._json(request)
+        if session.lock.locked():
+            return self._error(409, "上一次请求仍在生成中")
+        async with session.lock:
+            try:
+                choice_num = int(body.get('choice'))
+            except (TypeError, ValueError):
+                return self._error(400, "请输入有效的数字！")
+            try:
+                chosen_option = session.engine.option_for(choice_num)
+            except ValueError as e:
+                return self._error(400, str(e))
+            return await self._run_turn(session, session.engine.begin_choice(chosen_option))
+
+    async def handle_retry(self, request):
+        session = self._session(request)
+        if session.lock.locked():
+            return self._error(409, "上一次请求仍在生成中")
+        async with session.lock:
+            turn_request = session.engine.begin_retry()
+            if turn_request is None:
+                return self._error(400, "还没有可以重试的请求")
+            return await self._run_turn(session, turn_request)
+
+    async def handle_state(self, request):
+        session = self._session(request)
+        state = session.engine.snapshot()
+        state['session_id'] = session.session_id
+        state['busy'] = session.lock.locked()
+        if request.query.get('story'):
+            state['story'] = ''.join(session.engine.story_store.iter_display_text())
+        return web.json_response(state)
+
+    async def handle_metrics(self, request):
+        return web.json_response({'sessions': len(self.store), 'endpoints': self.metrics.summary(),
+                                  'parsing': self.parse_stats.snapshot(),
+                                  'connections': getattr(self.backend, 'connection_stats', None),
+                                  'hedging': self.backend.hedge_snapshot() if hasattr(self.backend, 'hedge_snapshot') else None,
+                                  'retries': self.backend.retry_snapshot() if hasattr(self.backend, 'retry_snapshot') else None,
+                                  'routing': self.router.snapshot() if self.router is not None else None,
+                                  'rate_limits': self._rate_limit_metrics()})
+
+    # ------------------------------------------------------------------
+    # 内部
+    # ------------------------------------------------------------------
+    async def _run_turn(self, session, turn_request):
+        """执行一轮请求并解析；大模型调用失败时返回502，玩家可以调用 retry。"""
+        engine = session.engine
+        try:
+            text = await engine.generate_async(turn_request)
+        except LLMError as e:
+            return self._error(502, str(e), session_id=session.session_id)
+        except GenerationCancelled as e:
+            # 会话在生成期间被淘汰或删除
+            return self._error(409, str(e), session_id=session.session_id)
+        result = engine.complete_turn(text)
+        return web.json_response({
+            'session_id': session.session_id,
+            'ok': result.ok,
+            'turn': engine.turn,
+            'story': result.story,
+            'options': result.options,
+            'error': result.error,
+            'generation_time': engine.last_generation_time,
+            'connect_time': engine.last_connect_time,
+            'hedged': engine.last_hedged,
+            'rate_limit_wait': engine.last_rate_limit_wait,
+            'route': engine.last_route,
+        })
+
+    def _rate_limit_metrics(self):
+        if self.rate_limiter is None:
+            return None
+        return {'queue_depth': self.rate_limiter.queue_depth(), 'models': self.rate_limiter.snapshot()}
+
+    def _session(self, request):
+        session = self.store.get(request.match_info['session_id'])
+        if session is None:
+            raise web.HTTPNotFound(text='{"error": "会话不存在或已过期"}', content_type='application/json')
+        return session
+
+    async def _json(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text='{"error": "请求体不是有效的JSON"}', content_type='application/json')
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text='{"error": "请求体必须是JSON对象"}', content_type='application/json')
+        return body
+
+    def _error(self, status, message, **extra):
+        return web.json_response(dict(extra, error=message), status=status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文字冒险游戏多会话HTTP服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--api-key', default=os.environ.get('DASHSCOPE_API_KEY'), help="默认读取环境变量 DASHSCOPE_API_KEY")
+    parser.add_argument('--base-url', default="https://dashscope.aliyuncs.com", help="DashScope Host")
+    parser.add_argument('--max-connections', type=int, default=200, help="大模型连接池大小")
+    parser.add_argument('--max-sessions', type=int, default=1000)
+    parser.add_argument('--idle-timeout', type=int, default=3600, help="会话空闲多少秒后淘汰")
+    parser.add_argument('--cache', action='store_true', help="开启本地响应缓存")
+    parser.add_argument('--json-output', action='store_true', help="新会话默认使用JSON结构化输出")
+    parser.add_argument('--warm-connections', type=int, default=8, help="启动时预先建立的大模型连接数")
+    parser.add_argument('--compress', action='store_true', help=f"gzip压缩超过{DEFAULT_COMPRESS_THRESHOLD // 1024}KB的请求体")
+    parser.add_argument('--hedge-percentile', type=float, default=0,
+                        help="开启对冲请求：超过最近延迟的这个百分位仍没有输出时再发一次请求（0 表示不开启）")
+    parser.add_argument('--hedge-model', default=None, help="对冲请求使用的模型，默认与原请求相同")
+    parser.add_argument('--hedge-base-url', default=None, help="对冲请求发往的Host，默认与 --base-url 相同")
+    parser.add_argument('--routes', default=None,
+                        help="按任务选择模型，如 \"opening=qwen-turbo; continuation=qwen-max@40,qwen-turbo; repair=qwen-turbo\"")
+    parser.add_argument('--route-timeout', type=float, default=None, help="路由中没有单独指定超时的模型的超时（秒）")
+    parser.add_argument('--rate-limits', default=None,
+                        help="客户端限流，如 \"*=5rps,100000tpm; qwen-max=2rps,60000tpm\"，超出时排队而不是报错")
+    parser.add_argument('--max-retries', type=int, default=MAX_RETRIES,
+                        help="限流、服务端错误和超时时自动重试的次数（指数退避加抖动）；0 表示不重试")
+    parser.add_argument('--breaker-threshold', type=int, default=FAILURE_THRESHOLD, help="同一Host连续失败多少次后熔断")
+    parser.add_argument('--breaker-cooldown', type=float, default=COOLDOWN, help="熔断多少秒后放行试探请求")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("请通过 --api-key 或环境变量 DASHSCOPE_API_KEY 提供API Key")
+    router = None
+    if args.routes:
+        try:
+            router = ModelRouter(args.routes, args.route_timeout)
+        except ValueError as e:
+            parser.error(str(e))
+
+    limiter = shared_limiter()
+    try:
+        limiter.set_limits(args.rate_limits)
+    except ValueError as e:
+        parser.error(str(e))
+
+    def make_backend(base_url):
+        # 每个Host各自重试和熔断；所有Host共用同一个限流器（限额按Key和模型计算），重试也要排队
+        backend = AsyncDashScopeBackend(args.api_key, base_url, max_connections=args.max_connections,
+                                        compress_threshold=DEFAULT_COMPRESS_THRESHOLD if args.compress else None)
+        return RetryingBackend(RateLimitedBackend(backend, limiter), args.max_retries,
+                               failure_threshold=args.breaker_threshold, cooldown=args.breaker_cooldown)
+
+    backend = make_backend(args.base_url)
+    if args.hedge_percentile:
+        hedge_backend = make_backend(args.hedge_base_url) if args.hedge_base_url else None
+        backend = HedgedBackend(backend, hedge_backend, args.hedge_model, percentile=args.hedge_percentile)
+    response_cache = None
+    if args.cache:
+        from response_cache import LLMResponseCache
+        response_cache = LLMResponseCache()
+    server = GameServer(backend, response_cache, args.max_sessions, args.idle_timeout, args.json_output,
+                        args.warm_connections, router, limiter)
+    print(f"游戏服务已启动: http://{args.host}:{args.port}")
+    web.run_app(server.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
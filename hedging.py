@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对冲请求（hedged requests）：降低偶发的极慢响应造成的长尾延迟。
+
+HedgedBackend 包装一个后端。一次调用在"最近延迟的第 percentile 百分位"内还没有产出任何内容时，
+再发出一个相同的请求（可以换成另一个模型 hedge_model，或另一个Host上的后端 hedge_backend），
+采用先到达的有效结果，取消另一个。流式调用以首段输出为准：先产出首段的请求胜出，之后只读取它。
+
+延迟样本按 (接口, 模型) 分别记录：complete() 记录完整耗时，stream() 记录首段输出的耗时；
+被取消的首个请求以已等待的时间作为样本（真实耗时只会更长），避免百分位越来越低；
+很快就出错（4xx/5xx）的首个请求不计入样本，否则百分位被拉低，之后的请求会过早对冲。
+样本不足 min_samples 个时使用 initial_delay，为 None 则不对冲。
+
+hedge_stats 记录请求数、对冲次数、对冲请求胜出次数和对冲额外消耗的token（估算）。
+被取消的请求按输入token加已收到的输出估算（中文1字符≈1 token），服务端实际计费可能更多。
+"""
+
+import asyncio
+import collections
+import threading
+
+from llm_backend import LoopThreadBackend, LLMError, WrappingBackend
+
+DEFAULT_PERCENTILE = 95
+DEFAULT_WINDOW = 200  # 每个 (接口, 模型) 保留的最近延迟样本数
+MIN_SAMPLES = 10
+MIN_DELAY = 0.05  # 秒；避免延迟很低时几乎每个请求都被对冲
+
+
+class HedgedBackend(LoopThreadBackend, WrappingBackend):
+    """
+    对冲请求的后端包装。
+
+    backend         首选后端
+    hedge_backend   对冲请求使用的后端（例如另一个Host），默认与 backend 相同
+    hedge_model     对冲请求使用的模型，默认与首个请求相同
+    percentile      以最近延迟的第几百分位作为对冲等待时间
+    initial_delay   延迟样本不足时的对冲等待时间（秒），None 表示样本足够之前不对冲
+    validate        可选，validate(文本) 为假的完整结果视为无效，继续等待另一个请求
+    """
+
+    def __init__(self, backend, hedge_backend=None, hedge_model=None, percentile=DEFAULT_PERCENTILE,
+                 window=DEFAULT_WINDOW, min_samples=MIN_SAMPLES, initial_delay=None, min_delay=MIN_DELAY, validate=None):
+        super().__init__()
+        self.backend = backend
+        self.hedge_backend = hedge_backend
+        self.hedge_model = hedge_model
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.validate = validate
+        self.hedge_stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'extra_tokens': 0}
+        self._latencies = {}  # (接口, 模型) -> 最近的延迟样本（秒）
+        self._stats_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # 延迟与统计
+    # ------------------------------------------------------------------
+    def hedge_delay(self, kind, model):
+        """当前的对冲等待时间（秒）；None 表示不对冲。kind 为 'complete' 或 'stream'。"""
+        with self._stats_lock:
+            samples = sorted(self._latencies.get((kind, model), ()))
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(self.min_delay, samples[index])
+
+    def _record_latency(self, kind, model, seconds):
+        with self._stats_lock:
+            samples = self._latencies.get((kind, model))
+            if samples is None:
+                samples = self._latencies[(kind, model)] = collections.deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def _record(self, hedged, hedge_won, extra_tokens):
+        with self._stats_lock:
+            self.hedge_stats['requests'] += 1
+            if hedged:
+                self.hedge_stats['hedged'] += 1
+                self.hedge_stats['extra_tokens'] += extra_tokens
+            if hedge_won:
+                self.hedge_stats['hedge_wins'] += 1
+
+    def hedge_snapshot(self):
+        """供 /metrics 和调试信息使用的统计，含对冲率和各 (接口, 模型) 当前的对冲等待时间。"""
+        with self._stats_lock:
+            stats = dict(self.hedge_stats)
+            keys = list(self._latencies)
+        stats['hedge_rate'] = round(stats['hedged'] / stats['requests'], 4) if stats['requests'] else 0.0
+        stats['delays'] = {f"{kind}:{model}": self.hedge_delay(kind, model) for kind, model in keys}
+        return stats
+
+    def hedge_summary(self):
+        stats = self.hedge_snapshot()
+        return (f"对冲 {stats['hedged']}/{stats['requests']} 次（{stats['hedge_rate'] * 100:.1f}%），"
+                f"对冲请求胜出 {stats['hedge_wins']} 次，额外消耗约 {stats['extra_tokens']} token")
+
+    def _hedge_target(self, model):
+        return self.hedge_backend or self.backend, self.hedge_model or model
+
+    def _background_loop(self):
+        # 与首选后端共用后台事件循环，从而共用它已经预热的连接池
+        return self.backend.event_loop() or super()._background_loop()
+
+    # ------------------------------------------------------------------
+    # 异步接口
+    # ------------------------------------------------------------------
+    async def acomplete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        loop = asyncio.get_running_loop()
+        delay = self.hedge_delay('complete', model)
+        hedge_backend, hedge_model = self._hedge_target(model)
+        input_tokens = len(system_prompt) + len(user_prompt)
+        traces = {'primary': {}, 'hedge': {}}
+        costs = {}  # 没有被采用的请求 -> 消耗的token
+        start = loop.time()
+        tasks = {asyncio.ensure_future(self.backend.acomplete(
+            model, system_prompt, user_prompt, max_tokens, top_p, json_output=json_output, trace=traces['primary'])): 'primary'}
+        hedged = False
+        winner = None
+        result = None
+        error = None
+        try:
+            while tasks and winner is None:
+                timeout = None if hedged or delay is None else max(0.0, delay - (loop.time() - start))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    print(f"首个请求 {delay:.2f} 秒内没有结果，发出对冲请求（{hedge_model}）")  # 调试信息
+                    tasks[asyncio.ensure_future(hedge_backend.acomplete(
+                        hedge_model, system_prompt, user_prompt, max_tokens, top_p, json_output=json_output,
+                        trace=traces['hedge']))] = 'hedge'
+                    continue
+                for task in done:
+                    role = tasks.pop(task)
+                    try:
+                        candidate = task.result()
+                    except LLMError as e:
+                        error = e
+                        costs[role] = 0
+                        continue
+                    if role == 'primary':
+                        self._record_latency('complete', model, loop.time() - start)
+                    if winner is not None or (self.validate is not None and not self.validate(candidate.text)):
+                        error = error or LLMError("大模型返回了无效的响应")
+                        costs[role] = candidate.total_tokens
+                        continue
+                    winner, result = role, candidate
+            if winner is None:
+                raise error
+        finally:
+            for task, role in tasks.items():
+                task.cancel()
+                costs[role] = input_tokens
+                if role == 'primary':
+                    self._record_latency('complete', model, loop.time() - start)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            extra = sum(costs.values()) if winner is not None else costs.get('hedge', 0)
+            self._record(hedged, winner == 'hedge', extra)
+        if trace is not None:
+            trace.update(traces[winner], hedged=hedged, hedge_won=winner == 'hedge')
+        return result
+
+    async def astream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        loop = asyncio.get_running_loop()
+        delay = self.hedge_delay('stream', model)
+        hedge_backend, hedge_model = self._hedge_target(model)
+        input_tokens = len(system_prompt) + len(user_prompt)
+        traces = {'primary': {}, 'hedge': {}}
+        start = loop.time()
+        streams = {'primary': self.backend.astream(model, system_prompt, user_prompt, max_tokens, top_p,
+                                                   json_output=json_output, trace=traces['primary'])}
+        tasks = {asyncio.ensure_future(streams['primary'].__anext__()): 'primary'}
+        costs = {}  # 没有被采用的请求 -> 消耗的token
+        hedged = False
+        winner = None
+        first = ""
+        error = None
+        try:
+            while tasks and winner is None:
+                timeout = None if hedged or delay is None else max(0.0, delay - (loop.time() - start))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    print(f"首个请求 {delay:.2f} 秒内没有输出，发出对冲请求（{hedge_model}）")  # 调试信息
+                    streams['hedge'] = hedge_backend.astream(hedge_model, system_prompt, user_prompt, max_tokens, top_p,
+                                                             json_output=json_output, trace=traces['hedge'])
+                    tasks[asyncio.ensure_future(streams['hedge'].__anext__())] = 'hedge'
+                    continue
+                for task in done:
+                    role = tasks.pop(task)
+                    try:
+                        delta = task.result()
+                    except StopAsyncIteration:
+                        delta = ""
+                    except LLMError as e:
+                        error = e
+                        costs[role] = 0
+                        continue
+                    if role == 'primary':
+                        self._record_latency('stream', model, loop.time() - start)
+                    if winner is not None:
+                        costs[role] = input_tokens + len(delta)
+                        continue
+                    winner, first = role, delta
+            if winner is None:
+                raise error
+        finally:
+            for task, role in tasks.items():
+                task.cancel()
+                costs[role] = input_tokens
+                if role == 'primary':
+                    self._record_latency('stream', model, loop.time() - start)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            for role, stream in streams.items():
+                if role != winner:
+                    await stream.aclose()
+            extra = sum(costs.values()) if winner is not None else costs.get('hedge', 0)
+            self._record(hedged, winner == 'hedge', extra)
+        if trace is not None:
+            trace.update(traces[winner], hedged=hedged, hedge_won=winner == 'hedge')
+        try:
+            if first:
+                yield first
+            async for delta in streams[winner]:
+                yield delta
+        finally:
+            await streams[winner].aclose()
+
+    # ------------------------------------------------------------------
+    # 关闭
+    # ------------------------------------------------------------------
+    def wrapped_backends(self):
+        return list({id(b): b for b in (self.backend, self.hedge_backend) if b is not None}.values())
@@ -4,11 +4,25 @@ import threading
 import queue
 import json
 import markdown2
-import dashscope
-from dashscope import Generation
-from dashscope.api_entities.dashscope_response import Role
-import re
 import os
+import time
+from async_dashscope import AsyncDashScopeBackend, DEFAULT_COMPRESS_THRESHOLD as COMPRESS_THRESHOLD
+from cancellation import GenerationCancelled
+from game_engine import GameEngine
+from hedging import HedgedBackend
+from model_router import OUTCOME_NAMES
+from llm_backend import DashScopeBackend, LLMError
+from rate_limiter import RateLimitedBackend, shared_limiter
+from retrying import RetryingBackend
+from story_store import to_display_text
+from story_index import StoryIndex
+from turn_journal import DEFAULT_JOURNAL_PATH, TurnJournal
+
+WARM_CONNECTIONS = 2  # 预热的连接数：正式请求和后台摘要各一个
+HEDGE_PERCENTILE = 95  # 超过最近延迟的第95百分位仍没有输出时发出对冲请求
+HEDGE_MIN_SAMPLES = 5  # 单人游戏请求少，积累5次延迟后就开始对冲
+RATE_LIMIT_NOTICE = 1.0  # 限流排队超过这么多秒时提示玩家
+JOURNAL_FILE = DEFAULT_JOURNAL_PATH  # 回合日志，程序关闭或崩溃后可从这里继续上次的游戏
 
 class LLMAdventureGame:
     """
@@ -23,23 +37,44 @@ class LLMAdventureGame:
         self.master.configure(bg="#f0f0f0")
 
         # --- 游戏状态变量 ---
-        self.story_history = ""  # 存储完整的故事历史，作为AI的记忆
-        self.last_player_choice = "" # 存储玩家上一次的选择，用于重试
-        self.current_options = [] # 存储当前可用的选项
-        self.last_ai_response = "" # 存储AI的原始响应，用于调试
-        self.current_model = "qwen-turbo"  # 当前使用的模型名称
-        self.paragraph_min_chars = 300 # 段落最小字数
-        self.paragraph_max_chars = 500 # 段落最大字数
+        # 游戏逻辑（提示词、调用AI、解析、故事与记忆）都在无界面的 GameEngine 中，界面只负责显示和输入
+        self.backend = AsyncDashScopeBackend() if AsyncDashScopeBackend.available() else DashScopeBackend()
+        self.limited_backend = None  # 包装 self.backend，在进程内共用的限流器中排队
+        self.retrying_backend = None  # 开启自动重试时包装 self.limited_backend，保留各Host熔断器的状态
+        self.hedged_backend = None  # 开启对冲请求时包装 self.backend，保留最近的延迟样本
+        self.engine = GameEngine(self.backend)
+        self.story_index = None  # 开启回合日志时建立的历史各局全文索引
+        self.story_store = self.engine.story_store  # 按段存储的完整故事（背景、情节、选择、警告），用于显示
+        self.memory = self.engine.memory  # 发送给AI的滚动摘要记忆
+        self.rendered_segments = 0  # 故事显示区域中已渲染的段数
+        self.last_render_time = None  # 最近一次渲染故事显示区域的耗时（秒）
         self.setup_collapsed = False  # 设置区域是否收起
+        self.stream_mode = True  # 是否使用流式输出
+        self.streaming_started = False  # 本轮流式输出是否已开始显示
+        self.speculative_mode = False  # 是否在玩家阅读时预生成四个分支
 
         # --- 异步处理队列 ---
         self.llm_queue = queue.Queue()
+        self.pending_requests = 0  # 尚未返回最终结果的请求数
+        self.fallback_poll_id = None  # 请求进行中时的兜底轮询
+        self.notify_lock = threading.Lock()
+        self.notify_pending = False  # 已发出唤醒事件、主线程尚未开始处理
+        self.queue_metrics = {
+            'wakeups': 0,          # 主线程检查队列的次数
+            'empty_wakeups': 0,    # 检查时队列为空的次数（无效唤醒）
+            'items': 0,            # 处理的消息数
+            'total_latency': 0.0,  # 消息从放入队列到被处理的总延迟（秒）
+            'max_latency': 0.0,
+            'stale': 0,            # 属于已被取代的生成、被丢弃的消息数
+        }
 
         # --- 创建UI界面 ---
         self.setup_ui()
+        self.prewarm_connections()
         
-        # --- 启动队列检查循环 ---
-        self.master.after(100, self.check_llm_queue)
+        # --- 后台线程放入结果后通过虚拟事件唤醒主线程，空闲时不再定时轮询 ---
+        self.master.bind("<<LLMResult>>", lambda event: self.check_llm_queue())
+        self.master.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def save_config(self):
         """保存当前配置到文件。"""
@@ -51,7 +86,23 @@ class LLMAdventureGame:
                 'length_range': self.length_entry.get().strip(),
                 'story_type': self.story_type_entry.get().strip(),
                 'option_style': self.option_style_entry.get().strip(),
-                'story_bg': self.story_bg_text.get("1.0", tk.END).strip()
+                'story_bg': self.story_bg_text.get("1.0", tk.END).strip(),
+                'stream': bool(self.stream_var.get()),
+                'cache': bool(self.cache_var.get()),
+                'async_client': bool(self.async_client_var.get()),
+                'json_output': bool(self.json_output_var.get()),
+                'compress_requests': bool(self.compress_var.get()),
+                'auto_retry': bool(self.auto_retry_var.get()),
+                'hedge_requests': bool(self.hedge_var.get()),
+                'hedge_model': self.hedge_model_entry.get().strip(),
+                'speculative': bool(self.speculative_var.get()),
+                'speculative_concurrency': self.speculative_concurrency_spinbox.get().strip(),
+                'memory_recent_segments': self.memory_recent_spinbox.get().strip(),
+                'memory_max_chars': self.memory_max_chars_entry.get().strip(),
+                'retrieval': bool(self.retrieval_var.get()),
+                'journal': bool(self.journal_var.get()),
+                'model_routes': self.routes_entry.get().strip(),
+                'rate_limits': self.rate_limits_entry.get().strip()
             }
             
             with open('game_config.json', 'w', encoding='utf-8') as f:
@@ -100,6 +151,61 @@ class LLMAdventureGame:
                 self.story_bg_text.delete("1.0", tk.END)
                 self.story_bg_text.insert(tk.END, config['story_bg'])
             
+            if 'stream' in config:
+                self.stream_var.set(bool(config['stream']))
+            
+            if 'cache' in config:
+                self.cache_var.set(bool(config['cache']))
+            
+            if 'async_client' in config:
+                self.async_client_var.set(bool(config['async_client']) and AsyncDashScopeBackend.available())
+            
+            if 'json_output' in config:
+                self.json_output_var.set(bool(config['json_output']))
+            
+            if 'compress_requests' in config:
+                self.compress_var.set(bool(config['compress_requests']))
+
+            if 'auto_retry' in config:
+                self.auto_retry_var.set(bool(config['auto_retry']))
+            
+            if 'hedge_requests' in config:
+                self.hedge_var.set(bool(config['hedge_requests']))
+            
+            if 'hedge_model' in config:
+                self.hedge_model_entry.delete(0, tk.END)
+                self.hedge_model_entry.insert(0, config['hedge_model'])
+            
+            if 'speculative' in config:
+                self.speculative_var.set(bool(config['speculative']))
+            
+            if 'speculative_concurrency' in config:
+                self.speculative_concurrency_spinbox.delete(0, tk.END)
+                self.speculative_concurrency_spinbox.insert(0, str(config['speculative_concurrency']))
+            
+            if 'memory_recent_segments' in config:
+                self.memory_recent_spinbox.delete(0, tk.END)
+                self.memory_recent_spinbox.insert(0, str(config['memory_recent_segments']))
+            
+            if 'memory_max_chars' in config:
+                self.memory_max_chars_entry.delete(0, tk.END)
+                self.memory_max_chars_entry.insert(0, str(config['memory_max_chars']))
+            
+            if 'retrieval' in config:
+                self.retrieval_var.set(bool(config['retrieval']))
+
+            if 'journal' in config:
+                self.journal_var.set(bool(config['journal']))
+            
+            if 'model_routes' in config:
+                self.routes_entry.delete(0, tk.END)
+                self.routes_entry.insert(0, config['model_routes'])
+
+            if 'rate_limits' in config:
+                self.rate_limits_entry.delete(0, tk.END)
+                self.rate_limits_entry.insert(0, config['rate_limits'])
+            
+            self.prewarm_connections()
             messagebox.showinfo("成功", "配置已从 game_config.json 文件加载")
         except Exception as e:
             messagebox.showerror("错误", f"加载配置失败：{str(e)}")
@@ -155,6 +261,68 @@ class LLMAdventureGame:
         self.story_bg_text = scrolledtext.ScrolledText(self.setup_content_frame, height=5, wrap=tk.WORD, font=("Helvetica", 10))
         self.story_bg_text.grid(row=6, column=1, sticky="ew", padx=5, pady=5)
         self.story_bg_text.insert(tk.END, "（这个也自己写）")
+
+        generation_frame = tk.Frame(self.setup_content_frame, bg="#f0f0f0")
+        generation_frame.grid(row=7, column=1, sticky="w", padx=5, pady=5)
+        self.stream_var = tk.BooleanVar(value=self.stream_mode)
+        tk.Checkbutton(generation_frame, text="流式输出（边生成边显示）", variable=self.stream_var, bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT)
+        self.cache_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(generation_frame, text="缓存AI响应（相同提示词直接复用）", variable=self.cache_var, bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 0))
+        # 未安装 aiohttp 时只能使用 dashscope SDK（每个请求一个线程）
+        self.async_client_var = tk.BooleanVar(value=AsyncDashScopeBackend.available())
+        tk.Checkbutton(generation_frame, text="异步HTTP客户端（共用连接池）", variable=self.async_client_var, bg="#f0f0f0", font=("Helvetica", 10),
+                       state=tk.NORMAL if AsyncDashScopeBackend.available() else tk.DISABLED).pack(side=tk.LEFT, padx=(10, 0))
+        self.json_output_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(generation_frame, text="JSON结构化输出", variable=self.json_output_var, bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 0))
+        self.compress_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(generation_frame, text="压缩较大的请求（gzip）", variable=self.compress_var, bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 0))
+        self.auto_retry_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(generation_frame, text="自动重试（限流、服务端错误和超时）", variable=self.auto_retry_var, bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 0))
+
+        speculative_frame = tk.Frame(self.setup_content_frame, bg="#f0f0f0")
+        speculative_frame.grid(row=8, column=1, sticky="w", padx=5, pady=5)
+        self.speculative_var = tk.BooleanVar(value=self.speculative_mode)
+        tk.Checkbutton(speculative_frame, text="预生成全部分支（选择后立即显示，额外消耗token）", variable=self.speculative_var, bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT)
+        tk.Label(speculative_frame, text="并发数:", bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 2))
+        self.speculative_concurrency_spinbox = tk.Spinbox(speculative_frame, from_=1, to=4, width=3, font=("Helvetica", 10))
+        self.speculative_concurrency_spinbox.delete(0, tk.END)
+        self.speculative_concurrency_spinbox.insert(0, "2")
+        self.speculative_concurrency_spinbox.pack(side=tk.LEFT)
+        self.hedge_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(speculative_frame, text="对冲慢请求（迟迟没有输出时再发一次）", variable=self.hedge_var, bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 0))
+        tk.Label(speculative_frame, text="对冲模型:", bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 2))
+        self.hedge_model_entry = tk.Entry(speculative_frame, width=12, font=("Helvetica", 10))
+        self.hedge_model_entry.pack(side=tk.LEFT)
+
+        tk.Label(self.setup_content_frame, text="记忆设置:", bg="#f0f0f0", font=("Helvetica", 10)).grid(row=9, column=0, sticky="w", padx=5, pady=5)
+        memory_frame = tk.Frame(self.setup_content_frame, bg="#f0f0f0")
+        memory_frame.grid(row=9, column=1, sticky="w", padx=5, pady=5)
+        tk.Label(memory_frame, text="原文保留最近段数:", bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT)
+        self.memory_recent_spinbox = tk.Spinbox(memory_frame, from_=2, to=40, width=4, font=("Helvetica", 10))
+        self.memory_recent_spinbox.delete(0, tk.END)
+        self.memory_recent_spinbox.insert(0, str(self.memory.keep_recent))
+        self.memory_recent_spinbox.pack(side=tk.LEFT)
+        tk.Label(memory_frame, text="提示词上限(字):", bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 2))
+        self.memory_max_chars_entry = tk.Entry(memory_frame, width=8, font=("Helvetica", 10))
+        self.memory_max_chars_entry.insert(0, str(self.memory.max_prompt_chars))
+        self.memory_max_chars_entry.pack(side=tk.LEFT)
+        self.retrieval_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(memory_frame, text="检索相关的早前情节（原文放进提示词）", variable=self.retrieval_var, bg="#f0f0f0", font=("Helvetica", 10)).pack(side=tk.LEFT, padx=(10, 0))
+
+        # 按任务选择模型，例如 opening=qwen-turbo; continuation=qwen-max@40,qwen-turbo; repair=qwen-turbo（留空则全部使用上面的模型）
+        tk.Label(self.setup_content_frame, text="模型路由(可选):", bg="#f0f0f0", font=("Helvetica", 10)).grid(row=10, column=0, sticky="w", padx=5, pady=5)
+        self.routes_entry = tk.Entry(self.setup_content_frame, width=50, font=("Helvetica", 10))
+        self.routes_entry.grid(row=10, column=1, sticky="ew", padx=5, pady=5)
+
+        # 本进程内所有请求共用的限额，例如 *=2rps,60000tpm; qwen-max=1rps（留空则不限）
+        tk.Label(self.setup_content_frame, text="请求限流(可选):", bg="#f0f0f0", font=("Helvetica", 10)).grid(row=11, column=0, sticky="w", padx=5, pady=5)
+        self.rate_limits_entry = tk.Entry(self.setup_content_frame, width=50, font=("Helvetica", 10))
+        self.rate_limits_entry.grid(row=11, column=1, sticky="ew", padx=5, pady=5)
+
+        # 回合日志和全文索引写入当前目录（game_journal.jsonl、story_index.sqlite3），默认关闭
+        tk.Label(self.setup_content_frame, text="回合日志:", bg="#f0f0f0", font=("Helvetica", 10)).grid(row=12, column=0, sticky="w", padx=5, pady=5)
+        self.journal_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.setup_content_frame, text=f"记录每一轮到 {JOURNAL_FILE}（可继续上次游戏、搜索历史故事）", variable=self.journal_var, bg="#f0f0f0", font=("Helvetica", 10)).grid(row=12, column=1, sticky="w", padx=5, pady=5)
         
         self.setup_content_frame.columnconfigure(1, weight=1)
 
@@ -178,6 +346,12 @@ class LLMAdventureGame:
         
         self.start_button = tk.Button(button_frame, text="开始 / 重置游戏", command=self.start_game, font=("Helvetica", 10, "bold"), bg="#4CAF50", fg="white", relief=tk.FLAT, padx=10, pady=5)
         self.start_button.pack(side=tk.RIGHT, padx=5)
+
+        self.resume_button = tk.Button(button_frame, text="继续上次游戏", command=self.resume_game, font=("Helvetica", 10), bg="#009688", fg="white", relief=tk.FLAT, padx=10, pady=5)
+        self.resume_button.pack(side=tk.RIGHT, padx=5)
+
+        self.search_button = tk.Button(button_frame, text="搜索故事", command=self.show_search_dialog, font=("Helvetica", 10), bg="#795548", fg="white", relief=tk.FLAT, padx=10, pady=5)
+        self.search_button.pack(side=tk.RIGHT, padx=5)
         
         self.debug_button = tk.Button(button_frame, text="显示AI原始响应", command=self.show_debug_info, font=("Helvetica", 10), bg="#FF9800", fg="white", relief=tk.FLAT, padx=10, pady=5)
         self.debug_button.pack(side=tk.RIGHT, padx=5)
@@ -190,7 +364,8 @@ class LLMAdventureGame:
         
         self.story_display = scrolledtext.ScrolledText(story_frame, wrap=tk.WORD, font=("Helvetica", 11), bg="white", fg="#333")
         self.story_display.pack(fill=tk.BOTH, expand=True)
-        self.story_display.insert(tk.END, "请先设置好API-KEY和故事背景，然后点击\"开始游戏\"。\n\n")
+        # 提示文字放在单独的 loading 区域，开始游戏后可单独移除
+        self.story_display.insert(tk.END, "请先设置好API-KEY和故事背景，然后点击\"开始游戏\"。\n\n", "loading")
 
         # --- 3. 选项显示区域 ---
         options_frame = tk.LabelFrame(main_frame, text="当前选项", padx=10, pady=10, bg="#f0f0f0", font=("Helvetica", 12))
@@ -215,10 +390,15 @@ class LLMAdventureGame:
         
         self.submit_button = tk.Button(choice_frame, text="确认选择", command=self.submit_choice, font=("Helvetica", 10), bg="#2196F3", fg="white", relief=tk.FLAT, padx=10, pady=5)
         self.submit_button.pack(side=tk.LEFT, padx=5)
+
+        # 请求失败或响应无法解析时可用
+        self.retry_button = tk.Button(choice_frame, text="重试", command=self.retry_last_action, font=("Helvetica", 10), bg="#FF9800", fg="white", relief=tk.FLAT, padx=10, pady=5)
+        self.retry_button.pack(side=tk.LEFT, padx=5)
         
         # 禁用选择输入，直到游戏开始
         self.choice_entry.config(state=tk.DISABLED)
         self.submit_button.config(state=tk.DISABLED)
+        self.retry_button.config(state=tk.DISABLED)
 
     def toggle_setup(self):
         """切换设置区域的显示状态。"""
@@ -236,7 +416,7 @@ class LLMAdventureGame:
     def start_game(self):
         """当玩家点击"开始/重置游戏"时触发。"""
         print("开始游戏按钮被点击")  # 调试信息
-        
+
         api_key = self.api_key_entry.get().strip()
         host = self.host_entry.get().strip()
         model_name = self.model_entry.get().strip()
@@ -261,55 +441,159 @@ class LLMAdventureGame:
             messagebox.showerror("错误", "请输入Host地址！")
             return
 
-        print("开始设置API参数")  # 调试信息
+        if not self.apply_settings(api_key, host):
+            return
+
+        # 上一局仍在进行的请求被取消，它已经放入队列的结果会按生成编号丢弃
+        request = self.engine.new_game(story_bg, model_name, length_range_text, story_type, option_style)
+        self.streaming_started = False
+        self.clear_story_display()
+        self.update_story_display("游戏初始化中，正在为您生成开篇情节...")
+        self.toggle_controls(is_generating=True)
+
+        print("开始生成故事")  # 调试信息
+        self._launch(request)
+
+    def resume_game(self):
+        """当玩家点击"继续上次游戏"时触发：从回合日志末尾恢复最近一局，不需要重新生成。"""
+        api_key = self.api_key_entry.get().strip()
+        host = self.host_entry.get().strip()
+        if not api_key or not host:
+            messagebox.showerror("错误", "API-KEY 和 Host地址 不能为空！")
+            return
+        if not self.apply_settings(api_key, host):
+            return
+        if self.engine.journal is None:
+            messagebox.showwarning("警告", "请先在设置中勾选“回合日志”")
+            return
 
-        # 解析长度范围（形如 "300-500"）
-        self.paragraph_min_chars, self.paragraph_max_chars = 300, 500
+        start_time = time.perf_counter()
         try:
-            if '-' in length_range_text:
-                _min, _max = length_range_text.split('-', 1)
-                self.paragraph_min_chars = max(50, int(_min))
-                self.paragraph_max_chars = max(self.paragraph_min_chars + 50, int(_max))
-        except Exception:
-            # 保留默认值
-            pass
-        # 估算可生成的最大token数（中文1字符≈1 token，给出富余）
-        # 为故事正文与四个选项预留空间：上限×2 + 200
-        self.max_new_tokens = int(self.paragraph_max_chars * 2.0 + 200)
-        # 安全上限，避免超出模型限制
-        self.max_new_tokens = max(256, min(self.max_new_tokens, 8192))
+            resumed = self.engine.resume()
+        except (OSError, KeyError, ValueError) as e:
+            messagebox.showerror("错误", f"读取回合日志失败：{str(e)}")
+            return
+        if not resumed:
+            messagebox.showwarning("警告", f"没有找到可以继续的游戏（{JOURNAL_FILE}）")
+            return
+        print(f"从回合日志恢复第{self.engine.turn}轮，耗时{(time.perf_counter() - start_time) * 1000:.1f}ms")  # 调试信息
+
+        self.streaming_started = False
+        self.clear_story_display()
+        if self.engine.current_options:
+            self.update_story_display()
+            self.update_options_display()
+            self.toggle_controls(is_generating=False)
+        else:
+            # 上次的开篇未完成或最后一轮无法解析，由玩家点击"重试"重新生成
+            self.update_story_display("上次的这一轮没有完成，点击“重试”重新生成。")
+            self.update_options_display()
+            self.toggle_controls(is_generating=False)
+            self.retry_button.config(state=tk.NORMAL)
+
+    def apply_settings(self, api_key, host):
+        """把设置区域的选项应用到后端和引擎（开始或继续游戏前调用），设置有误时提示并返回 False。"""
+        routes = self.routes_entry.get().strip()
+        if routes:
+            try:
+                self.engine.enable_routing(routes)
+            except ValueError as e:
+                messagebox.showerror("错误", f"模型路由格式错误：{e}")
+                return False
+        else:
+            self.engine.disable_routing()
+
+        try:
+            shared_limiter().set_limits(self.rate_limits_entry.get().strip())
+        except ValueError as e:
+            messagebox.showerror("错误", f"请求限流格式错误：{e}")
+            return False
 
         print(f"设置API Key和Host")  # 调试信息
-        dashscope.api_key = api_key
-        # 设置自定义host - 使用正确的方式
+        if self.async_client_var.get() and AsyncDashScopeBackend.available():
+            if not isinstance(self.backend, AsyncDashScopeBackend):
+                self.backend = AsyncDashScopeBackend()
+        elif not isinstance(self.backend, DashScopeBackend):
+            self.backend = DashScopeBackend()
         try:
-            # 尝试设置基础URL
-            if hasattr(dashscope, 'base_http_client') and hasattr(dashscope.base_http_client, 'base_url'):
-                dashscope.base_http_client.base_url = host
-            # 如果上面的方式不行，尝试其他方式
-            elif hasattr(dashscope, 'Generation') and hasattr(dashscope.Generation, 'base_url'):
-                dashscope.Generation.base_url = host
-        except Exception as e:
-            print(f"设置Host时出现警告（不影响正常使用）: {e}")
-        
-        self.current_model = model_name  # 保存当前使用的模型
-        self.story_type = story_type or ""
-        self.option_style = option_style or ""
-
-        parts = ["## 故事背景\n", story_bg]
-        if self.story_type:
-            parts.append(f"\n\n## 故事类型\n{self.story_type}")
-        if self.option_style:
-            parts.append(f"\n\n## 选项风格\n{self.option_style}")
-        parts.append("\n\n")
-        self.story_history = "".join(parts)
-
-        self.current_options = []
-        self.update_story_display("游戏初始化中，正在为您生成开篇情节...")
-        self.toggle_controls(is_generating=True)
+            self.backend.configure(api_key, host)
+        except LLMError as e:
+            messagebox.showerror("错误", str(e))
+            return False
+        # 由内到外：限流（重试和对冲请求也要排队）、自动重试、对冲
+        if self.limited_backend is None or self.limited_backend.backend is not self.backend:
+            self.limited_backend = RateLimitedBackend(self.backend)
+        backend = self.limited_backend
+        if self.auto_retry_var.get():
+            if self.retrying_backend is None or self.retrying_backend.backend is not backend:
+                self.retrying_backend = RetryingBackend(backend)
+            backend = self.retrying_backend
+            print(self.retrying_backend.retry_summary())  # 调试信息
+        if self.hedge_var.get():
+            # 对冲在外层：首个请求和对冲请求各自重试
+            if self.hedged_backend is None or self.hedged_backend.backend is not backend:
+                self.hedged_backend = HedgedBackend(backend, percentile=HEDGE_PERCENTILE, min_samples=HEDGE_MIN_SAMPLES)
+            self.hedged_backend.hedge_model = self.hedge_model_entry.get().strip() or None  # 留空时与原请求相同
+            self.engine.backend = self.hedged_backend
+            print(self.hedged_backend.hedge_summary())  # 调试信息
+        else:
+            self.engine.backend = backend
+        if isinstance(self.backend, AsyncDashScopeBackend):
+            self.backend.compress_threshold = COMPRESS_THRESHOLD if self.compress_var.get() else None
+            print(self.backend.connection_summary())  # 调试信息
+
+        self.stream_mode = bool(self.stream_var.get())
+        self.speculative_mode = bool(self.speculative_var.get())
+        if self.json_output_var.get():
+            self.engine.enable_json_output()
+        else:
+            self.engine.disable_json_output()
+        if self.cache_var.get():
+            if self.engine.response_cache is None:
+                self.engine.enable_cache()
+        else:
+            self.engine.disable_cache()
+        if self.engine.speculative_pool:
+            print(self.engine.speculative_pool.summary())  # 调试信息
+        if self.speculative_mode:
+            try:
+                concurrency = int(self.speculative_concurrency_spinbox.get())
+            except ValueError:
+                concurrency = 2
+            self.engine.enable_speculation(concurrency)
+        else:
+            self.engine.disable_speculation()
 
-        print("开始生成故事")  # 调试信息
-        self.generate_next_segment(initial_prompt=self.story_history)
+        try:
+            self.memory.keep_recent = max(1, int(self.memory_recent_spinbox.get()))
+            self.memory.max_prompt_chars = max(1000, int(self.memory_max_chars_entry.get()))
+        except ValueError:
+            pass # 保留原设置
+        if self.retrieval_var.get():
+            try:
+                self.engine.enable_retrieval()
+            except ImportError:
+                self.retrieval_var.set(False)
+                messagebox.showwarning("警告", "检索相关的早前情节需要 numpy，请先运行 pip install numpy")
+        else:
+            self.engine.disable_retrieval()
+        self._apply_journal(bool(self.journal_var.get()))
+        return True
+
+    def _apply_journal(self, enabled):
+        """开启时建立回合日志和全文索引，关闭时写完剩余记录后停止。"""
+        if enabled:
+            if self.engine.journal is None:
+                journal = TurnJournal(JOURNAL_FILE)  # 后台线程批量写入，不阻塞界面
+                # 历史各局的全文索引：每批日志写入磁盘后在写入线程中增量更新，开启时先在后台补上未索引的部分
+                self.story_index = StoryIndex(JOURNAL_FILE)
+                journal.listeners.append(self.story_index.update)
+                threading.Thread(target=self.story_index.update, daemon=True).start()
+                self.engine.enable_journal(journal)
+        elif self.engine.journal is not None:
+            self.engine.journal.close()
+            self.engine.disable_journal()
+            self.story_index = None
 
     def submit_choice(self, event=None):
         """处理玩家的选择输入。"""
@@ -318,323 +602,257 @@ class LLMAdventureGame:
             if not choice_text:
                 messagebox.showwarning("警告", "请输入选项编号！")
                 return
-            
+
             choice_num = int(choice_text)
-            if choice_num < 1 or choice_num > 4:
-                messagebox.showwarning("警告", "请输入1-4之间的数字！")
-                return
-            
-            if choice_num > len(self.current_options):
-                messagebox.showwarning("警告", f"当前只有{len(self.current_options)}个选项！")
-                return
-            
             # 获取选择的选项文本
-            chosen_option = self.current_options[choice_num - 1]
+            chosen_option = self.engine.option_for(choice_num)
             self.make_choice(chosen_option)
-            
+
             # 清空输入框
             self.choice_entry.delete(0, tk.END)
-            
-        except ValueError:
-            messagebox.showwarning("警告", "请输入有效的数字！")
+
+        except ValueError as e:
+            message = str(e) if str(e).startswith(("请输入", "当前只有")) else "请输入有效的数字！"
+            messagebox.showwarning("警告", message)
 
     def make_choice(self, chosen_option):
         """处理玩家的选择。"""
-        self.last_player_choice = chosen_option # 记录选择，以备重试
-        
-        self.story_history += f"\n\n**我的选择是：** *{chosen_option}*\n\n---\n\n"
-        
+        request = self.engine.begin_choice(chosen_option)
+
         self.update_story_display(f"你选择了：'{chosen_option}'。AI正在思考接下来会发生什么...")
         self.toggle_controls(is_generating=True)
 
-        self.generate_next_segment(player_choice=chosen_option)
-
-    def generate_next_segment(self, initial_prompt=None, player_choice=None):
-        """准备prompt并开启线程调用LLM。"""
-        if initial_prompt:
-            prompt = f"这是文字冒险游戏的开篇，请根据以下背景，生成第一段引人入胜的故事情节和四个截然不同的行动选项。故事背景：\n\n{initial_prompt}"
-        else:
-            # 这就是核心：将整个故事历史作为"精简的全篇故事走向"发给AI
-            prompt = f"""
-以下是目前为止的完整故事情节（这是我们的记忆）：
----
-{self.story_history}
----
-玩家刚刚做出的选择是："{player_choice}"
-
-请基于以上所有内容，继续推进故事，并提供四个新的、截然不同的行动选项。
-"""
-
-        system_prompt = f"""
-你是一位才华横溢、充满想象力的文字冒险游戏AI。你的任务是：
-1. 根据玩家的选择和已有的故事，生成一段生动、具体的后续情节（大约{self.paragraph_min_chars}-{self.paragraph_max_chars}字，尽量写满范围上限，细节丰富、包含感官描写与动作）。若未达到最少字数{self.paragraph_min_chars}，请继续扩写，不要提前开始列出选项。
-2. 在情节的结尾，为玩家提供四个风格迥异、导向完全不同剧情分支的行动选项。
-3. 故事类型偏好：{self.story_type if hasattr(self, 'story_type') and self.story_type else '不限'}。
-4. 选项风格要求：{self.option_style if hasattr(self, 'option_style') and self.option_style else '清晰互斥、差异明显'}。
-
-请按照以下格式返回：
-1. 首先写一段故事情节
-2. 然后写"### 行动选项"
-3. 接着列出四个选项，每个选项用"**选项标题**-选项描述"的格式
-
-示例格式：
-随着晨星号缓缓降落在X-17星球表面，你透过驾驶舱的窗户向外望去，只见一片奇异而迷人的景象。这颗星球的地表覆盖着五彩斑斓的植物，远处连绵起伏的山脉反射出不寻常的光芒，仿佛整个世界都被某种神秘力量所笼罩。飞船降落带来的震动逐渐平息后，你意识到必须采取行动了———————不仅要确保自己和船员的安全，还要尽快找到修复飞船的方法。
-
-### 行动选项
-
-**探索周围环境**-你决定先检查一下飞船降落点附近的区域，看看是否能找到任何有用的资源或线索。虽然未知总是伴随着危险，但直觉告诉你，了解这片土地的秘密可能是解决问题的关键所在。
-
-**启动紧急信号发射器**-考虑到情况危急，你认为最明智的选择是立即激活晨星号上的紧急求救信号发射装置，希望有人能够接收到你的求助信息，并前来救援。不过这样做也可能吸引到一些不必要的注意。
-
-**尝试自行修理飞船**-凭借着多年积累下来的机械知识，你觉得或许自己就能够解决当前遇到的问题。于是，你准备打开飞船的引擎舱盖，亲自检查能量核心损坏的具体原因，并寻找可能存在的修复方案。
+        if self.engine.speculative_pool:
+            branch = self.engine.claim_branch(chosen_option)
+            print(self.engine.speculative_pool.summary())  # 调试信息
+            if branch is not None:
+                if branch.is_done():
+                    # 分支已预生成完毕，直接显示
+                    self.process_llm_response(branch.text)
+                else:
+                    self._begin_request()
+                    threading.Thread(target=self._wait_for_branch, args=(branch, request), daemon=True).start()
+                return
 
-**与本地生物交流**-在降落过程中，你注意到不远处有一群外形奇特的生物正在好奇地观察着你们。尽管不知道它们是否友好，但也许这些原住民能提供关于这个星球以及如何获得帮助的信息。因此，你打算尝试接近并尝试与之沟通。
-"""
-        
-        threading.Thread(target=self._call_llm_in_thread, args=(system_prompt, prompt), daemon=True).start()
+        self._launch(request)
 
-    def _call_llm_in_thread(self, system_prompt, user_prompt):
-        """在后台线程中实际调用API，防止UI卡死。"""
+    def _wait_for_branch(self, branch, request):
+        """等待仍在生成中的预生成分支，完成后把结果放入队列；分支失败时在本线程中照常生成这一轮。"""
+        branch.finished.wait()
+        if branch.is_done():
+            self._post_result({"text": branch.text, "generation": request.generation})
+        elif branch.cancel_token.cancelled:
+            self._post_result({"cancelled": True, "generation": request.generation})
+        else:
+            print(f"预生成分支失败，改为正常请求: {branch.error}")  # 调试信息
+            self._call_llm_in_thread(request)
+
+    def _launch(self, request):
+        """开启线程执行引擎给出的请求。"""
+        self._begin_request()
+        threading.Thread(target=self._call_llm_in_thread, args=(request,), daemon=True).start()
+
+    def _call_llm_in_thread(self, request):
+        """
+        在后台线程中实际调用API，防止UI卡死。流式输出时每收到一段增量文本就放入队列。
+        每条消息都带有生成编号，主线程丢弃属于已被取代的生成的消息。
+        """
+        generation = request.generation
         try:
-            print(f"开始调用API，模型: {self.current_model}")  # 调试信息
-            messages = [
-                {"role": Role.SYSTEM, "content": system_prompt},
-                {"role": Role.USER, "content": user_prompt},
-            ]
-            print(f"发送消息长度: {len(str(messages))}")  # 调试信息
-            response = Generation.call(
-                model=self.current_model,
-                messages=messages,
-                result_format='message',
-                max_tokens=getattr(self, 'max_new_tokens', 1024),
-                max_length=getattr(self, 'max_new_tokens', 1024),
-                top_p=0.9
-            )
-            print(f"API调用成功，状态码: {response.status_code}")  # 调试信息
-            self.llm_queue.put(response)
+            print(f"开始调用API，模型: {request.model}，第{generation}次生成")  # 调试信息
+            print(f"发送消息长度: {len(request.system_prompt) + len(request.user_prompt)}")  # 调试信息
+            on_delta = (lambda delta: self._post_result({"stream_chunk": delta, "generation": generation})) if self.stream_mode else None
+            on_fallback = lambda failed, next_model, outcome: self._post_result({"fallback": (failed, next_model, outcome), "generation": generation})
+            wait = self.limited_backend.wait_time(request.model, request.system_prompt, request.user_prompt, request.max_tokens)
+            if wait >= RATE_LIMIT_NOTICE:
+                self._post_result({"rate_limited": wait, "generation": generation})
+            text = self.engine.generate(request, on_delta=on_delta, on_fallback=on_fallback)
+            route = self.engine.last_route
+            print(f"路由: {route['task']} -> {route['model']}，共{len(route['attempts'])}次尝试，{route['latency']:.2f}s")  # 调试信息
+            if self.engine.response_cache:
+                print(self.engine.response_cache.summary())  # 调试信息
+            if self.engine.last_ttft is not None:
+                print(f"首字延迟: {self.engine.last_ttft:.2f}s，总耗时: {self.engine.last_generation_time:.2f}s")  # 调试信息
+            if self.engine.last_rate_limit_wait:
+                print(f"限流排队: {self.engine.last_rate_limit_wait:.2f}s")  # 调试信息
+            if self.engine.last_connect_time is not None:
+                print(f"建立连接: {self.engine.last_connect_time * 1000:.1f}ms（{'复用连接' if self.engine.last_connection_reused else '新建连接'}）")  # 调试信息
+            self._post_result({"text": text, "generation": generation})
+        except GenerationCancelled as e:
+            print(str(e))  # 调试信息
+            self._post_result({"cancelled": True, "generation": generation})
         except Exception as e:
             print(f"API调用失败: {str(e)}")  # 调试信息
-            self.llm_queue.put({"error": str(e)})
+            self._post_result({"error": str(e), "generation": generation})
+
+    def _begin_request(self):
+        """（主线程）登记一个新的后台请求，并启动请求期间的兜底轮询。"""
+        self.pending_requests += 1
+        if self.fallback_poll_id is None:
+            self.fallback_poll_id = self.master.after(100, self._fallback_poll)
+
+    def _fallback_poll(self):
+        """
+        请求进行中时每100ms检查一次队列，防止虚拟事件在不支持多线程的Tcl上丢失；
+        没有进行中的请求时停止，空闲时不唤醒主线程。
+        """
+        self.fallback_poll_id = None
+        self.check_llm_queue()
+        if self.pending_requests > 0 and self.fallback_poll_id is None:
+            self.fallback_poll_id = self.master.after(100, self._fallback_poll)
+
+    def _post_result(self, response_data):
+        """（后台线程）放入结果并立即唤醒Tk主循环。"""
+        self.llm_queue.put((time.perf_counter(), response_data))
+        with self.notify_lock:
+            # 主线程尚未处理上一次唤醒时不重复发送，流式输出的多段会在同一次唤醒中处理
+            if self.notify_pending:
+                return
+            self.notify_pending = True
+        try:
+            self.master.event_generate("<<LLMResult>>", when="tail")
+        except Exception:
+            # Tcl不支持跨线程调用或窗口已关闭时，由兜底轮询处理
+            pass
 
     def check_llm_queue(self):
-        """每100ms检查一次队列，看是否有LLM的返回结果。"""
+        """处理所有已到达的LLM结果（流式输出时一次会有多段），并统计唤醒次数和投递延迟。"""
+        self.queue_metrics['wakeups'] += 1
+        with self.notify_lock:
+            self.notify_pending = False
+        handled = 0
         try:
-            response_data = self.llm_queue.get_nowait()
-            
-            if "error" in response_data:
-                self.handle_api_error(response_data['error'])
-            elif response_data.status_code == 200:
-                # 兼容两种返回格式：text 与 message
-                text_payload = None
-                try:
-                    # 旧版 text
-                    text_payload = response_data.output.text
-                except Exception:
-                    pass
-                if not text_payload:
-                    try:
-                        choices = getattr(response_data.output, 'choices', None)
-                        if choices and len(choices) > 0:
-                            first_choice = choices[0]
-                            message_obj = first_choice['message'] if isinstance(first_choice, dict) else getattr(first_choice, 'message', None)
-                            if message_obj:
-                                if isinstance(message_obj, dict):
-                                    text_payload = message_obj.get('content')
-                                else:
-                                    text_payload = getattr(message_obj, 'content', None)
-                    except Exception:
-                        text_payload = None
-                if text_payload:
-                    self.process_llm_response(text_payload)
-                else:
-                    error_msg = f"API请求成功但未能解析到文本内容。\n原始数据: {getattr(response_data, 'output', None)}"
-                    self.handle_api_error(error_msg)
-            else:
-                error_msg = f"API请求失败\n状态码: {response_data.status_code}\n信息: {response_data.message}"
-                self.handle_api_error(error_msg)
-
+            while True:
+                posted_at, response_data = self.llm_queue.get_nowait()
+                latency = time.perf_counter() - posted_at
+                self.queue_metrics['items'] += 1
+                self.queue_metrics['total_latency'] += latency
+                self.queue_metrics['max_latency'] = max(self.queue_metrics['max_latency'], latency)
+                handled += 1
+                if "text" in response_data or "error" in response_data or "cancelled" in response_data:
+                    self.pending_requests = max(0, self.pending_requests - 1)
+                self._handle_queue_item(response_data)
         except queue.Empty:
             pass # 队列为空，什么都不做
-        finally:
-            self.master.after(100, self.check_llm_queue)
-    
+        if handled == 0:
+            self.queue_metrics['empty_wakeups'] += 1
+
+    def queue_metrics_summary(self):
+        """返回便于打印的队列投递统计。"""
+        metrics = self.queue_metrics
+        average = metrics['total_latency'] / metrics['items'] * 1000 if metrics['items'] else 0.0
+        return (f"队列唤醒{metrics['wakeups']}次（无效{metrics['empty_wakeups']}次），处理{metrics['items']}条消息"
+                f"（丢弃过期{metrics['stale']}条），平均投递延迟{average:.1f}ms，最大{metrics['max_latency'] * 1000:.1f}ms")
+
+    def _handle_queue_item(self, response_data):
+        """处理队列中的一条消息：错误、流式片段或完整的文本。属于已被取代的生成的消息直接丢弃。"""
+        if response_data.get("generation", self.engine.generation) != self.engine.generation:
+            self.queue_metrics['stale'] += 1
+            return
+        if "cancelled" in response_data:
+            return
+        if "error" in response_data:
+            self.handle_api_error(response_data['error'])
+        elif "stream_chunk" in response_data:
+            self.append_stream_chunk(response_data['stream_chunk'])
+        elif "rate_limited" in response_data:
+            self.update_story_display(f"请求较多，排队约{response_data['rate_limited']:.0f}秒后发出...")
+        elif "fallback" in response_data:
+            failed, next_model, outcome = response_data['fallback']
+            # 清除失败模型已经流式显示的部分
+            self.streaming_started = False
+            self.update_story_display(f"模型 {failed} {OUTCOME_NAMES.get(outcome, outcome)}，改用 {next_model} 重新生成...")
+        elif "text" in response_data:
+            self.process_llm_response(response_data['text'])
+
+    def append_stream_chunk(self, chunk):
+        """把流式输出的增量文本追加到故事显示区域。"""
+        if not self.streaming_started:
+            # 第一段到达时移除"AI正在思考..."提示，恢复已有的故事内容
+            self.streaming_started = True
+            self.update_story_display()
+        # 流式预览放在单独的 streaming 区域，完整响应解析后会被正式的情节替换
+        self.story_display.insert(tk.END, to_display_text(chunk), "streaming")
+        self.story_display.see(tk.END)
+
     def handle_api_error(self, error_message):
-        """统一处理API调用失败的情况。"""
-        messagebox.showerror("API 调用失败", f"与AI通信时发生错误：\n{error_message}")
+        """统一处理API调用失败的情况：在故事末尾显示错误（自动重试已经用完），由玩家点击“重试”再试一次。"""
+        self.streaming_started = False
+        self.update_story_display(f"与AI通信时发生错误：\n{error_message}\n\n点击“重试”再试一次。")
         self.toggle_controls(is_generating=False)
+        self.retry_button.config(state=tk.NORMAL if self.engine.last_request is not None else tk.DISABLED)
 
     def retry_last_action(self):
-        """让玩家可以重试上一次失败的请求。"""
+        """让玩家可以重试上一次失败的请求；请求仍在进行时取消它并重新生成。"""
+        request = self.engine.begin_retry()
+        if request is None:
+            return
+        self.streaming_started = False
         self.update_story_display("正在重试...")
         self.toggle_controls(is_generating=True)
-        self.generate_next_segment(player_choice=self.last_player_choice)
+        self._launch(request)
 
     def process_llm_response(self, text_response):
-        """解析LLM返回的文本，并更新UI。"""
-        # 保存AI的原始响应用于调试
-        self.last_ai_response = text_response
-        
-        try:
-            # 使用新的文本解析器
-            story_part, options = self.parse_text_response(text_response)
-            
-            # 更新故事历史
-            self.story_history += story_part
-            
-            # 更新显示
-            self.update_story_display()
-            
-            # 更新选项
-            self.current_options = options
-            self.update_options_display()
-            
-            self.toggle_controls(is_generating=False)
-
-        except Exception as e:
+        """把LLM返回的文本交给引擎解析，并更新UI。"""
+        self.streaming_started = False
+        result = self.engine.complete_turn(text_response)
+        if not result.ok:
             # 改进的错误处理
-            error_msg = f"AI返回的内容无法解析。\n错误: {e}\n\n原始响应:\n{text_response}"
+            error_msg = f"AI返回的内容无法解析。\n错误: {result.error}\n\n原始响应:\n{text_response}"
             messagebox.showwarning("解析错误", error_msg)
-            
-            # 将原始响应添加到故事历史中
-            self.story_history += f"\n\n---\n\n**[系统警告：AI响应无法解析，以下为原始输出]**\n\n{text_response}\n\n"
-            self.update_story_display()
-            
-            # 清空选项
-            self.current_options = []
-            self.update_options_display()
-            
-            self.toggle_controls(is_generating=False)
 
-    def parse_text_response(self, text_response):
-        """解析AI返回的纯文本响应，提取故事和选项。"""
-        # 清理响应文本
-        text = text_response.strip()
-        
-        # 查找"### 行动选项"或类似的分隔符
-        option_markers = [
-            "### 行动选项",
-            "### 选项",
-            "### 选择",
-            "行动选项：",
-            "选项：",
-            "选择："
-        ]
-        
-        story_part = ""
-        options = []
-        
-        # 尝试找到选项部分
-        option_start = -1
-        for marker in option_markers:
-            option_start = text.find(marker)
-            if option_start != -1:
-                break
-        
-        if option_start != -1:
-            # 分离故事和选项
-            story_part = text[:option_start].strip()
-            options_text = text[option_start:].strip()
-            
-            # 提取选项
-            options = self.extract_options_from_text(options_text)
-        else:
-            # 如果没有找到明确的选项标记，尝试其他方法
-            story_part = text
-            options = self.extract_options_from_text(text)
-        
-        # 验证结果
-        if not story_part:
-            raise ValueError("无法提取故事内容")
-        
-        if len(options) != 4:
-            raise ValueError(f"选项数量不正确，期望4个，实际{len(options)}个")
-        
-        return story_part, options
+        # 更新显示
+        self.update_story_display()
+        print(f"故事渲染耗时: {self.last_render_time * 1000:.1f}ms，共{self.rendered_segments}段")  # 调试信息
+        print(self.queue_metrics_summary())  # 调试信息
 
-    def extract_options_from_text(self, text):
-        """从文本中提取选项。"""
-        options = []
-        
-        # 方法1：查找"**选项标题**-描述"格式
-        pattern1 = r'\*\*([^*]+)\*\*-([^\n]+)'
-        matches1 = re.findall(pattern1, text)
-        
-        if len(matches1) >= 4:
-            for title, desc in matches1[:4]:
-                options.append(f"{title}-{desc}")
-            return options
-        
-        # 方法2：查找数字编号的选项
-        pattern2 = r'(\d+)[\.、]\s*([^\n]+)'
-        matches2 = re.findall(pattern2, text)
-        
-        if len(matches2) >= 4:
-            for num, desc in matches2[:4]:
-                options.append(desc.strip())
-            return options
-        
-        # 方法3：查找"选项X："格式
-        pattern3 = r'选项\s*(\d+)[：:]\s*([^\n]+)'
-        matches3 = re.findall(pattern3, text)
-        
-        if len(matches3) >= 4:
-            for num, desc in matches3[:4]:
-                options.append(desc.strip())
-            return options
-        
-        # 方法4：按行分割，查找可能的选项
-        lines = text.split('\n')
-        for line in lines:
-            line = line.strip()
-            if line and len(line) > 10:  # 排除太短的行
-                # 检查是否包含选项关键词
-                if any(keyword in line for keyword in ['**', '选项', '选择', '决定']):
-                    options.append(line)
-                    if len(options) >= 4:
-                        break
-        
-        # 如果还是不够4个，用最后几行作为选项
-        if len(options) < 4:
-            lines = [line.strip() for line in lines if line.strip() and len(line.strip()) > 10]
-            for line in lines[-4:]:
-                if line not in options:
-                    options.append(line)
-                    if len(options) >= 4:
-                        break
-        
-        return options[:4]  # 确保最多返回4个选项
+        # 更新选项
+        self.update_options_display()
+        self.toggle_controls(is_generating=False)
+        if not result.ok:
+            self.retry_button.config(state=tk.NORMAL)
 
     def update_story_display(self, loading_text=None):
-        """更新故事显示区域，将Markdown转换为纯文本显示。"""
+        """
+        更新故事显示区域：移除提示文字和流式预览，只追加尚未渲染的新段，
+        渲染耗时与故事总长度无关。loading_text 会显示在末尾单独的 loading 区域。
+        """
+        start_time = time.perf_counter()
+        self._remove_story_region("loading")
+        self._remove_story_region("streaming")
+
+        # 将Markdown转换为纯文本显示，只插入新增的段
+        for text_content in self.story_store.iter_display_text(self.rendered_segments):
+            self.story_display.insert(tk.END, text_content)
+        self.rendered_segments = len(self.story_store)
+
         if loading_text:
-            self.story_display.delete(1.0, tk.END)
-            self.story_display.insert(tk.END, f"{loading_text}\n\n")
-        else:
-            # 将Markdown转换为纯文本显示
-            try:
-                # 简单的Markdown到纯文本转换
-                text_content = self.story_history
-                # 移除Markdown标记
-                text_content = text_content.replace('**', '').replace('*', '').replace('#', '').replace('---', '\n---\n')
-                self.story_display.delete(1.0, tk.END)
-                self.story_display.insert(tk.END, text_content)
-            except Exception as e:
-                # 如果转换失败，直接显示原始内容
-                self.story_display.delete(1.0, tk.END)
-                self.story_display.insert(tk.END, self.story_history)
+            self.story_display.insert(tk.END, f"\n\n{loading_text}\n\n", "loading")
         
         # 滚动到底部
         self.story_display.see(tk.END)
+        self.last_render_time = time.perf_counter() - start_time
+
+    def _remove_story_region(self, tag):
+        """删除故事显示区域中带有 tag 标记的临时文字。"""
+        ranges = self.story_display.tag_ranges(tag)
+        if ranges:
+            self.story_display.delete(ranges[0], ranges[-1])
+
+    def clear_story_display(self):
+        """开始新游戏时清空故事显示区域。"""
+        self.story_display.delete(1.0, tk.END)
+        self.rendered_segments = 0
 
     def update_options_display(self):
         """更新选项显示区域。"""
         self.options_display.delete(1.0, tk.END)
         
-        if not self.current_options:
+        if not self.engine.current_options:
             self.options_display.insert(tk.END, "暂无可用选项...\n")
             return
         
-        for i, option in enumerate(self.current_options, 1):
+        for i, option in enumerate(self.engine.current_options, 1):
             self.options_display.insert(tk.END, f"{i}. {option}\n")
         
         self.options_display.see(tk.END)
@@ -642,25 +860,97 @@ class LLMAdventureGame:
     def toggle_controls(self, is_generating):
         """切换控件的可用状态，提供视觉反馈。"""
         if is_generating:
+            # 生成中仍可以重置游戏或重试（迟迟没有结果时），进行中的请求会被取消
             self.choice_entry.config(state=tk.DISABLED)
             self.submit_button.config(state=tk.DISABLED)
-            self.start_button.config(state=tk.DISABLED)
+            self.retry_button.config(state=tk.NORMAL)
             self.master.config(cursor="watch")
         else:
             self.choice_entry.config(state=tk.NORMAL)
             self.submit_button.config(state=tk.NORMAL)
             self.start_button.config(state=tk.NORMAL)
+            self.retry_button.config(state=tk.DISABLED)
             self.master.config(cursor="")
             # 聚焦到输入框
             self.choice_entry.focus()
 
+    def prewarm_connections(self):
+        """
+        在玩家填写设置时就预先建立到Host的连接（DNS、TCP和TLS握手），开篇请求直接复用。
+        只在使用异步HTTP客户端时有效；开始游戏后不再预热，以免与正式请求争用同一个空闲连接。
+        """
+        host = self.host_entry.get().strip()
+        if not host or not self.async_client_var.get() or not isinstance(self.backend, AsyncDashScopeBackend):
+            return
+        try:
+            self.backend.configure(self.api_key_entry.get().strip(), host)
+            self.backend.warm_up(WARM_CONNECTIONS)
+        except Exception as e:
+            print(f"预热连接失败: {e}")  # 调试信息
+
     def show_debug_info(self):
         """显示AI的原始响应，以便调试。"""
-        if self.last_ai_response:
-            messagebox.showinfo("AI原始响应", f"AI的原始响应:\n\n{self.last_ai_response}")
+        if self.engine.last_ai_response:
+            info = f"AI的原始响应:\n\n{self.engine.last_ai_response}\n\n解析统计:\n{self.engine.parse_stats.describe()}"
+            if self.engine.router is not None:
+                info += f"\n\n模型路由:\n{self.engine.router.describe()}"
+            if isinstance(self.engine.backend, HedgedBackend):
+                info += f"\n\n{self.engine.backend.hedge_summary()}"
+            if self.retrying_backend is not None:
+                info += f"\n\n自动重试:\n{self.retrying_backend.retry_summary()}"
+            info += f"\n\n请求限流:\n{shared_limiter().describe()}"
+            if self.engine.journal is not None:
+                info += f"\n\n{self.engine.journal.summary()}\n{self.story_index.summary()}"
+            if self.engine.retriever is not None:
+                info += f"\n\n{self.engine.retriever.summary()}"
+                for score, text, segment in self.engine.last_retrieved:
+                    info += f"\n  [{score:.2f}] 第{segment}段: {text[:40]}"
+            messagebox.showinfo("AI原始响应", info)
         else:
             messagebox.showwarning("AI原始响应", "没有可显示的AI原始响应。")
 
+    def show_search_dialog(self):
+        """在历史各局（回合日志）中搜索段落，可以只搜当前这一局。"""
+        if self.story_index is None:
+            messagebox.showwarning("警告", "请先在设置中勾选“回合日志”，并开始或继续一局游戏")
+            return
+        index, journal = self.story_index, self.engine.journal  # 对话框打开期间关闭日志也不影响搜索
+        dialog = tk.Toplevel(self.master)
+        dialog.title("搜索故事")
+        dialog.geometry("800x500")
+
+        search_frame = tk.Frame(dialog, padx=10, pady=5)
+        search_frame.pack(fill=tk.X)
+        query_entry = tk.Entry(search_frame, font=("Helvetica", 11))
+        query_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        current_only_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(search_frame, text="只搜当前这一局", variable=current_only_var, font=("Helvetica", 10)).pack(side=tk.LEFT, padx=5)
+
+        results_display = scrolledtext.ScrolledText(dialog, wrap=tk.WORD, font=("Helvetica", 10), bg="white", fg="#333")
+        results_display.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        results_display.insert(tk.END, "输入要查找的词，多个词用空格分开，用双引号括起的部分作为一个短语。\n")
+
+        def run_search(event=None):
+            session = journal.start_offset if current_only_var.get() else None
+            try:
+                hits = index.search(query_entry.get(), session=session)
+            except Exception as e:
+                messagebox.showerror("错误", f"搜索失败：{str(e)}", parent=dialog)
+                return
+            results_display.delete(1.0, tk.END)
+            results_display.insert(tk.END, f"找到{len(hits)}条（{index.last_search_time * 1000:.1f}ms）\n\n")
+            for hit in hits:
+                results_display.insert(tk.END, f"[{hit.title} · 第{hit.turn}轮] {hit.snippet}\n\n")
+
+        query_entry.bind('<Return>', run_search)
+        tk.Button(search_frame, text="搜索", command=run_search, font=("Helvetica", 10), bg="#795548", fg="white", relief=tk.FLAT, padx=10).pack(side=tk.LEFT, padx=5)
+        query_entry.focus()
+
+    def on_close(self):
+        """关闭窗口：中止进行中的请求，写完回合日志后退出。"""
+        self.engine.close()
+        self.master.destroy()
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = LLMAdventureGame(root)
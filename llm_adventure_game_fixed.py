@@ -3,10 +3,13 @@ from tkinter import scrolledtext, messagebox, simpledialog
 import threading
 import queue
 import json
+import time
 import markdown2
 import dashscope
 from dashscope import Generation
-import re
+from response_parser import ParseStats, recover_json_object
+
+MODEL = 'qwen-max'  # 调用的模型，解析统计也按它记录
 
 class LLMAdventureGame:
     """
@@ -22,6 +25,7 @@ class LLMAdventureGame:
         # --- 游戏状态变量 ---
         self.story_history = ""  # 存储完整的故事历史，作为AI的记忆
         self.last_player_choice = "" # 存储玩家上一次的选择，用于重试
+        self.parse_stats = ParseStats()  # 每种解析方法的成功次数和耗时
         self.current_options = [] # 存储当前可用的选项
         self.last_ai_response = "" # 存储AI的原始响应，用于调试
 
@@ -198,7 +202,7 @@ class LLMAdventureGame:
         try:
             # 推荐使用qwen-max或qwen-plus模型以获得更好的故事创作能力
             response = Generation.call(
-                model='qwen-max',
+                model=MODEL,
                 system_prompt=system_prompt,
                 prompt=user_prompt,
                 result_format='text' # 我们要求它返回纯文本（JSON字符串）
@@ -328,7 +332,7 @@ class LLMAdventureGame:
     def show_debug_info(self):
         """显示AI的原始响应，以便调试。"""
         if self.last_ai_response:
-            messagebox.showinfo("AI原始响应", f"AI的原始响应:\n\n{self.last_ai_response}")
+            messagebox.showinfo("AI原始响应", f"AI的原始响应:\n\n{self.last_ai_response}\n\n解析统计:\n{self.parse_stats.describe()}")
         else:
             messagebox.showwarning("AI原始响应", "没有可显示的AI原始响应。")
 
@@ -337,30 +341,33 @@ class LLMAdventureGame:
         # 清理响应文本
         cleaned_response = text_response.strip()
         
-        # 尝试多种解析方法
+        # 尝试多种解析方法（名称用于解析统计）
         methods = [
             # 方法1：直接解析
-            lambda: json.loads(cleaned_response),
+            ('json', lambda: json.loads(cleaned_response)),
             
             # 方法2：提取JSON部分
-            lambda: self._extract_json_part(cleaned_response),
+            ('json_extracted', lambda: self._extract_json_part(cleaned_response)),
             
             # 方法3：修复常见的JSON格式问题
-            lambda: self._fix_and_parse_json(cleaned_response),
+            ('json_unfenced', lambda: self._fix_and_parse_json(cleaned_response)),
             
             # 方法4：尝试解析为Python字典格式
-            lambda: self._parse_python_dict(cleaned_response)
+            ('python_dict', lambda: recover_json_object(cleaned_response))
         ]
         
-        for i, method in enumerate(methods):
+        start_time = time.perf_counter()
+        for i, (name, method) in enumerate(methods):
             try:
                 data = method()
                 if self._validate_response_data(data):
+                    self.parse_stats.record(MODEL, name, (time.perf_counter() - start_time) * 1e6)
                     return data
             except Exception as e:
                 print(f"解析方法{i+1}失败: {e}")
                 continue
         
+        self.parse_stats.record_failure(MODEL, (time.perf_counter() - start_time) * 1e6)
         raise ValueError("所有解析方法都失败了")
 
     def _extract_json_part(self, text):
@@ -393,21 +400,6 @@ class LLMAdventureGame:
             # 如果失败，尝试提取JSON部分
             return self._extract_json_part(text)
 
-    def _parse_python_dict(self, text):
-        """尝试解析Python字典格式"""
-        # 查找类似Python字典的格式
-        pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
-        matches = re.findall(pattern, text)
-        
-        if matches:
-            # 尝试将Python字典转换为JSON
-            dict_str = matches[0]
-            # 替换单引号为双引号
-            dict_str = dict_str.replace("'", '"')
-            return json.loads(dict_str)
-        
-        raise ValueError("未找到有效的字典格式")
-
     def _validate_response_data(self, data):
         """验证响应数据的格式"""
         if not isinstance(data, dict):
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可替换的大模型后端。GameEngine 只依赖这里的接口，便于在没有图形界面、
+没有API Key的环境中做基准测试或接入其他服务。
+"""
+
+import asyncio
+import functools
+import queue
+import threading
+import time
+
+try:
+    import dashscope
+    from dashscope import Generation
+    from dashscope.api_entities.dashscope_response import Role
+except ImportError:  # 无头运行或测试时可以不安装 dashscope
+    dashscope = None
+    Generation = None
+    Role = None
+
+
+class LLMError(Exception):
+    """
+    大模型调用失败。status_code 为HTTP状态码（网络异常等情况下为 None），
+    retry_after 为服务端在 Retry-After 中建议的等待秒数（没有时为 None）。
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LLMTimeoutError(LLMError):
+    """大模型调用超时。"""
+
+
+class LLMResult:
+    """一次调用的结果。"""
+
+    def __init__(self, text, input_tokens=0, output_tokens=0):
+        self.text = text
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+
+def extract_text_payload(response_data):
+    """从响应中取出文本，兼容 output.text 与 output.choices[0].message.content 两种格式。"""
+    text_payload = None
+    try:
+        # 旧版 text
+        text_payload = response_data.output.text
+    except Exception:
+        pass
+    if not text_payload:
+        try:
+            choices = getattr(response_data.output, 'choices', None)
+            if choices and len(choices) > 0:
+                first_choice = choices[0]
+                message_obj = first_choice['message'] if isinstance(first_choice, dict) else getattr(first_choice, 'message', None)
+                if message_obj:
+                    if isinstance(message_obj, dict):
+                        text_payload = message_obj.get('content')
+                    else:
+                        text_payload = getattr(message_obj, 'content', None)
+        except Exception:
+            text_payload = None
+    return text_payload
+
+
+def extract_usage(response_data, system_prompt, user_prompt, text):
+    """取出 (输入token, 输出token)；没有用量信息时按中文1字符≈1 token估算。"""
+    usage = getattr(response_data, 'usage', None)
+    try:
+        return int(usage.input_tokens), int(usage.output_tokens)
+    except Exception:
+        return len(system_prompt) + len(user_prompt), len(text or "")
+
+
+class LLMBackend:
+    """
+    后端接口。
+
+    complete() 返回完整的 LLMResult；stream() 逐段产出增量文本，
+    默认实现退化为一次 complete()。json_output=True 时要求模型只输出一个JSON对象（结构化输出），
+    不支持的后端可以忽略它。trace 是可选的字典，支持的后端会在其中写入本次请求的连接信息
+    （connect_time：建立连接的秒数，复用连接时为0；reused：是否复用了连接池中的连接），
+    调用方也可以在其中放入 cancel_token（cancellation.CancelToken），供排队等待的后端在取消时放弃请求。
+    acomplete()/astream() 是供 asyncio 使用的版本，默认在线程池中执行同步调用，
+    原生支持 asyncio 的后端（async_dashscope.AsyncDashScopeBackend）会覆盖它们。
+    """
+
+    def complete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        raise NotImplementedError
+
+    def stream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        yield self.complete(model, system_prompt, user_prompt, max_tokens, top_p, json_output, trace).text
+
+    async def acomplete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.complete, model, system_prompt, user_prompt, max_tokens, top_p, json_output, trace))
+
+    async def astream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        result = await self.acomplete(model, system_prompt, user_prompt, max_tokens, top_p, json_output, trace)
+        yield result.text
+
+    def event_loop(self):
+        """原生支持 asyncio 的后端返回执行同步调用的后台事件循环（可在其中取消请求），其他后端返回 None。"""
+        return None
+
+
+class WrappingBackend(LLMBackend):
+    """
+    包装另一个后端的基类（限流、自动重试、对冲）。
+
+    连接池相关的方法和统计（awarm_up、connection_stats 等）转交给被包装的后端，
+    关闭时一并关闭 wrapped_backends() 中的后端。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        if name == 'backend':
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def event_loop(self):
+        return self.backend.event_loop()
+
+    def wrapped_backends(self):
+        return [self.backend]
+
+    async def aclose(self):
+        for backend in self.wrapped_backends():
+            if hasattr(backend, 'aclose'):
+                await backend.aclose()
+
+    def close(self):
+        for backend in self.wrapped_backends():
+            if hasattr(backend, 'close'):
+                backend.close()
+
+
+class LoopThreadBackend(LLMBackend):
+    """
+    原生 asyncio 后端的基类：子类实现 acomplete()/astream()，
+    同步的 complete()/stream() 在后台事件循环线程中执行它们（供Tk界面的工作线程等同步代码使用）。
+    """
+
+    def __init__(self):
+        self._loop = None  # 供同步调用使用的后台事件循环
+        self._loop_lock = threading.Lock()
+
+    def _background_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            return self._loop
+
+    def event_loop(self):
+        return self._background_loop()
+
+    def complete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        future = asyncio.run_coroutine_threadsafe(
+            self.acomplete(model, system_prompt, user_prompt, max_tokens, top_p, json_output=json_output, trace=trace),
+            self._background_loop())
+        return future.result()
+
+    def stream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        chunks = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for delta in self.astream(model, system_prompt, user_prompt, max_tokens, top_p, json_output=json_output,
+                                                trace=trace):
+                    chunks.put(delta)
+            except BaseException as e:
+                chunks.put(e)
+                raise
+            finally:
+                chunks.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._background_loop())
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    if isinstance(item, LLMError):
+                        raise item
+                    raise LLMError(str(item) or type(item).__name__)
+                yield item
+        finally:
+            # 调用方提前停止读取时中止请求
+            future.cancel()
+
+
+class DashScopeBackend(LLMBackend):
+    """通过 dashscope SDK 的 Generation.call 调用阿里云百炼。"""
+
+    def configure(self, api_key, host=None):
+        """设置API Key和自定义Host。"""
+        if dashscope is None:
+            raise LLMError("未安装 dashscope，请先运行 pip install dashscope")
+        dashscope.api_key = api_key
+        self.api_key = api_key  # 供限流按Key区分（rate_limiter.RateLimitedBackend）
+        if not host:
+            return
+        # 设置自定义host - 使用正确的方式
+        try:
+            # 尝试设置基础URL
+            if hasattr(dashscope, 'base_http_client') and hasattr(dashscope.base_http_client, 'base_url'):
+                dashscope.base_http_client.base_url = host
+            # 如果上面的方式不行，尝试其他方式
+            elif hasattr(dashscope, 'Generation') and hasattr(dashscope.Generation, 'base_url'):
+                dashscope.Generation.base_url = host
+        except Exception as e:
+            print(f"设置Host时出现警告（不影响正常使用）: {e}")
+
+    def _messages(self, system_prompt, user_prompt):
+        return [
+            {"role": Role.SYSTEM, "content": system_prompt},
+            {"role": Role.USER, "content": user_prompt},
+        ]
+
+    @staticmethod
+    def _format_args(json_output):
+        """结构化输出：要求模型返回JSON对象。"""
+        return {'response_format': {'type': 'json_object'}} if json_output else {}
+
+    def complete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        if Generation is None:
+            raise LLMError("未安装 dashscope，请先运行 pip install dashscope")
+        response = Generation.call(
+            model=model,
+            messages=self._messages(system_prompt, user_prompt),
+            result_format='message',
+            max_tokens=max_tokens,
+            max_length=max_tokens,
+            top_p=top_p,
+            **self._format_args(json_output)
+        )
+        if response.status_code != 200:
+            raise LLMError(f"API请求失败\n状态码: {response.status_code}\n信息: {response.message}", response.status_code)
+        text = extract_text_payload(response)
+        if not text:
+            raise LLMError(f"API请求成功但未能解析到文本内容。\n原始数据: {getattr(response, 'output', None)}", response.status_code)
+        input_tokens, output_tokens = extract_usage(response, system_prompt, user_prompt, text)
+        return LLMResult(text, input_tokens, output_tokens)
+
+    def stream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        if Generation is None:
+            raise LLMError("未安装 dashscope，请先运行 pip install dashscope")
+        responses = Generation.call(
+            model=model,
+            messages=self._messages(system_prompt, user_prompt),
+            result_format='message',
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stream=True,
+            incremental_output=True,
+            **self._format_args(json_output)
+        )
+        for response in responses:
+            if response.status_code != 200:
+                raise LLMError(f"API请求失败\n状态码: {response.status_code}\n信息: {response.message}", response.status_code)
+            delta = extract_text_payload(response)
+            if delta:
+                yield delta
+
+
+class CallableBackend(LLMBackend):
+    """
+    用普通函数充当后端：fn(model, system_prompt, user_prompt) -> 文本。
+    用于测试、基准以及接入其他服务；latency 可模拟每次调用的耗时（秒）。json_output 被忽略，
+    需要时 fn 可以根据系统提示词判断。
+    """
+
+    def __init__(self, fn, latency=0.0):
+        self.fn = fn
+        self.latency = latency
+
+    def complete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        if self.latency:
+            time.sleep(self.latency)
+        text = self.fn(model, system_prompt, user_prompt)
+        return LLMResult(text, len(system_prompt) + len(user_prompt), len(text))
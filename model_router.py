@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按任务选择模型：开篇、继续、修复（失败后重试）和摘要各自使用一组按顺序尝试的模型（降级链）。
+
+排在前面的模型超时、出错或返回的内容无法解析时，GameEngine 改用下一个模型。
+路由表可以用一行文本描述（界面和命令行使用），任务之间用分号分隔，模型之间用逗号分隔，
+模型后面可以用 @秒数 指定超时：
+
+    opening=qwen-turbo; continuation=qwen-max@40,qwen-turbo; repair=qwen-turbo; summary=qwen-turbo
+
+没有出现在路由表中的任务使用玩家填写的模型。ModelRouter 还按 (任务, 模型) 统计尝试次数、
+各种结果的次数和平均耗时，可在多个引擎（会话）间共用。
+"""
+
+import threading
+
+OPENING = "opening"            # 开篇
+CONTINUATION = "continuation"  # 根据玩家选择继续（包括预生成分支）
+REPAIR = "repair"              # 失败后重试
+SUMMARY = "summary"            # 后台整理前情提要
+TASKS = (OPENING, CONTINUATION, REPAIR, SUMMARY)
+TASK_NAMES = {OPENING: "开篇", CONTINUATION: "继续", REPAIR: "修复", SUMMARY: "摘要"}
+
+# 一次尝试的结果
+OK = "ok"
+TIMEOUT = "timeout"
+ERROR = "error"
+PARSE_FAILED = "parse_failed"
+OUTCOMES = (OK, TIMEOUT, ERROR, PARSE_FAILED)
+OUTCOME_NAMES = {OK: "成功", TIMEOUT: "超时", ERROR: "出错", PARSE_FAILED: "返回的内容无法解析"}
+
+
+class Route:
+    """降级链中的一个模型；timeout 为这个模型的超时（秒），None 表示使用路由表的默认值。"""
+
+    def __init__(self, model, timeout=None):
+        self.model = model
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"Route({self.model!r}, {self.timeout!r})"
+
+
+def parse_routes(spec):
+    """把一行路由描述解析为 {任务: [Route]}，格式错误时抛出 ValueError。"""
+    table = {}
+    for part in (spec or "").replace("；", ";").split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        task, sep, models = part.partition("=")
+        task = task.strip()
+        if not sep or task not in TASKS:
+            raise ValueError(f"无效的路由：{part}（任务只能是 {', '.join(TASKS)}）")
+        routes = []
+        for item in models.replace("，", ",").split(","):
+            model, _, timeout = item.strip().partition("@")
+            if not model.strip():
+                continue
+            try:
+                routes.append(Route(model.strip(), float(timeout) if timeout.strip() else None))
+            except ValueError:
+                raise ValueError(f"无效的超时：{item.strip()}")
+        if not routes:
+            raise ValueError(f"任务 {task} 没有指定模型")
+        table[task] = routes
+    return table
+
+
+class ModelRouter:
+    """
+    任务到模型降级链的路由表。
+
+    table     {任务: [模型名、"模型@秒数" 或 Route]}，也可以是 parse_routes() 接受的一行文本
+    timeout   没有单独指定超时的模型使用的超时（秒），None 表示不限
+    """
+
+    def __init__(self, table=None, timeout=None):
+        if isinstance(table, str):
+            table = parse_routes(table)
+        self.table = {}
+        for task, routes in (table or {}).items():
+            if task not in TASKS:
+                raise ValueError(f"未知的任务：{task}")
+            self.table[task] = [route if isinstance(route, Route) else parse_routes(f"{task}={route}")[task][0]
+                                for route in routes]
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._stats = {}  # (任务, 模型) -> 统计
+
+    def routes(self, task, default_model):
+        """任务的降级链；路由表中没有这个任务时只有 default_model。"""
+        routes = self.table.get(task) or [Route(default_model)]
+        return [Route(route.model, route.timeout if route.timeout is not None else self.timeout) for route in routes]
+
+    def first_model(self, task, default_model):
+        return self.routes(task, default_model)[0].model
+
+    def spec(self):
+        """路由表的一行描述（parse_routes 的逆操作）。"""
+        return "; ".join(f"{task}=" + ",".join(route.model + (f"@{route.timeout:g}" if route.timeout else "") for route in routes)
+                         for task, routes in self.table.items())
+
+    # ------------------------------------------------------------------
+    # 统计
+    # ------------------------------------------------------------------
+    def record(self, task, model, outcome, seconds):
+        with self._lock:
+            stats = self._stats.get((task, model))
+            if stats is None:
+                stats = self._stats[(task, model)] = dict({name: 0 for name in OUTCOMES}, attempts=0, total_time=0.0)
+            stats['attempts'] += 1
+            stats[outcome] += 1
+            stats['total_time'] += seconds
+
+    def snapshot(self):
+        """{任务: {模型: {attempts, ok, timeout, error, parse_failed, mean_time}}}"""
+        with self._lock:
+            result = {}
+            for (task, model), stats in self._stats.items():
+                entry = {name: stats[name] for name in ('attempts',) + OUTCOMES}
+                entry['mean_time'] = round(stats['total_time'] / stats['attempts'], 3)
+                result.setdefault(task, {})[model] = entry
+            return result
+
+    def describe(self):
+        """供调试信息显示的多行文本。"""
+        lines = []
+        for task, models in self.snapshot().items():
+            for model, stats in models.items():
+                lines.append(f"{TASK_NAMES.get(task, task)} {model}：尝试{stats['attempts']}次，成功{stats[OK]}次，"
+                             f"超时{stats[TIMEOUT]}次，出错{stats[ERROR]}次，无法解析{stats[PARSE_FAILED]}次，"
+                             f"平均{stats['mean_time']:.2f}s")
+        return "\n".join(lines) or "暂无路由记录"
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成模拟的AI响应语料，覆盖各个解析器接受的所有格式，供解析器基准和一致性测试使用。
+
+格式：
+  marker        故事 + "### 行动选项" + 四个"**标题**-描述"
+  numbered      故事 + "### 选项" + "1. 标题-描述"（或"1、"）
+  label         故事 + "选项1：标题-描述"（没有分隔标记）
+  json          {"story": ..., "options": [...]}
+  fenced_json   ```json 代码块，前后带说明文字
+  python_dict   Python字典写法（单引号）
+  large         marker 格式，故事长达100KB
+  large_json    json 格式，故事长达100KB
+"""
+
+import json
+import random
+
+FORMATS = ["marker", "numbered", "label", "json", "fenced_json", "python_dict", "large", "large_json"]
+LARGE_MAX_CHARS = 100 * 1024
+
+SENTENCES = [
+    "你推开沉重的石门，潮湿的空气里混着铁锈的味道。",
+    "远处传来低沉的钟声，仿佛在提醒你时间所剩无几。",
+    "火把的光在墙上投下摇晃的影子，脚下的石板微微发烫。",
+    "一只通体银白的狐狸从阴影中探出头来，好奇地打量着你。",
+    "风从裂缝中灌进来，带着海盐和硫磺的气息。",
+    "你想起导师临别时的叮嘱：不要相信会说话的镜子。",
+    "墙上的壁画描绘着一场古老的战争，画中人的眼睛似乎在跟随你移动。",
+    "背包里的罗盘指针疯狂旋转，最后停在了一个不可能的方向。",
+    "能量读数显示还剩3.5小时，你必须在那之前找到出口。",
+    "船长O'Brien的声音从通讯器里传来：\"坚持住，我们马上到。\"",
+    "你在日志里写下：第2天，补给还够用一周。",
+]
+OPTION_TITLES = ["点燃火把", "原路返回", "检查墙壁", "大声呼喊", "跟随狐狸", "打开背包", "躲进阴影", "研究罗盘",
+                 "联系飞船", "绘制地图"]
+
+
+def make_story(rng, chars):
+    """生成约 chars 字、分为若干段的故事。"""
+    paragraphs = []
+    total = 0
+    while total < chars:
+        paragraph = "".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 5)))
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def make_options(rng):
+    titles = rng.sample(OPTION_TITLES, 4)
+    return [(title, f"你决定{title}。这样做也许会带来新的线索，但也可能招来意想不到的危险。") for title in titles]
+
+
+def make_response(fmt, rng, story_chars=None):
+    """生成一条 fmt 格式的响应，返回 (文本, 故事, 选项列表)。"""
+    if story_chars is None:
+        story_chars = rng.randint(20 * 1024, LARGE_MAX_CHARS) if fmt.startswith("large") else rng.randint(200, 900)
+    story = make_story(rng, story_chars)
+    pairs = make_options(rng)
+    options = [f"{title}-{desc}" for title, desc in pairs]
+
+    if fmt in ("marker", "large"):
+        text = story + "\n\n### 行动选项\n\n" + "\n\n".join(f"**{title}**-{desc}" for title, desc in pairs)
+    elif fmt == "numbered":
+        sep = rng.choice([". ", "、"])
+        text = story + "\n\n### 选项\n\n" + "\n".join(f"{i}{sep}{option}" for i, option in enumerate(options, 1))
+    elif fmt == "label":
+        text = story + "\n\n" + "\n".join(f"选项{i}：{option}" for i, option in enumerate(options, 1))
+    elif fmt in ("json", "large_json"):
+        text = json.dumps({"story": story, "options": options}, ensure_ascii=False, indent=2)
+    elif fmt == "fenced_json":
+        body = json.dumps({"story": story, "options": options}, ensure_ascii=False, indent=2)
+        text = f"好的，以下是故事的下一段：\n\n```json\n{body}\n```\n\n希望这个响应符合要求。"
+    elif fmt == "python_dict":
+        text = repr({'story': story, 'options': options})
+    else:
+        raise ValueError(f"未知的格式: {fmt}")
+    return text, story, options
+
+
+def make_corpus(per_format=250, seed=0, formats=FORMATS):
+    """返回 [(格式, 文本, 故事, 选项)]；large 类格式的条数为其他格式的十分之一。"""
+    rng = random.Random(seed)
+    corpus = []
+    for fmt in formats:
+        count = max(1, per_format // 10) if fmt.startswith("large") else per_format
+        for _ in range(count):
+            text, story, options = make_response(fmt, rng)
+            corpus.append((fmt, text, story, options))
+    return corpus
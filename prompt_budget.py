@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按token预算构造提示词：先为输出预留token，再把系统提示词、示例、故事记忆和玩家选择
+放进模型的上下文窗口；超出时依次裁掉示例和较早的故事记忆，保证请求不会因上下文过长被拒绝，
+输出也不会因输入过长被截断。
+"""
+
+import re
+
+# 模型上下文窗口与单次最大输出token数：(上下文窗口, 最大输出)
+MODEL_CONTEXT_TABLE = {
+    'qwen-turbo': (131072, 8192),
+    'qwen-plus': (131072, 8192),
+    'qwen-max': (32768, 8192),
+    'qwen-long': (1000000, 8192),
+}
+DEFAULT_CONTEXT = (8192, 2048)  # 未知模型按较小的窗口处理
+
+# 估算器系数，按 qwen 分词器在中文故事和英文文本上的实测结果校准并略微取大
+CJK_TOKENS_PER_CHAR = 0.7
+OTHER_TOKENS_PER_CHAR = 0.3
+MESSAGE_OVERHEAD_TOKENS = 8  # 每条消息的角色标记等开销
+SAFETY_MARGIN = 1.1  # 估算误差的富余
+
+CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+_TOKENIZERS = {}  # 按模型缓存分词器（含"不可用"的结果），加载一次约需数百毫秒
+
+
+def context_limits(model):
+    """返回模型的 (上下文窗口, 最大输出token数)，支持带版本后缀的模型名。"""
+    if model in MODEL_CONTEXT_TABLE:
+        return MODEL_CONTEXT_TABLE[model]
+    for name, limits in MODEL_CONTEXT_TABLE.items():
+        if model.startswith(name + '-'):
+            return limits
+    return DEFAULT_CONTEXT
+
+
+def estimate_tokens_by_chars(text):
+    """不依赖分词器的token估算：中文约0.7 token/字，其他字符约0.3 token/字。"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return int((cjk * CJK_TOKENS_PER_CHAR + other * OTHER_TOKENS_PER_CHAR) * SAFETY_MARGIN) + 1
+
+
+class TokenCounter:
+    """优先使用 dashscope 自带的本地分词器（需要 tiktoken），不可用时退回字符估算。"""
+
+    def __init__(self, model):
+        self.model = model
+        if model not in _TOKENIZERS:
+            try:
+                from dashscope import get_tokenizer
+                _TOKENIZERS[model] = get_tokenizer(model)
+            except Exception:
+                _TOKENIZERS[model] = None
+        self.tokenizer = _TOKENIZERS[model]
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            try:
+                return len(self.tokenizer.encode(text))
+            except Exception:
+                pass
+        return estimate_tokens_by_chars(text)
+
+
+def output_tokens_for(paragraph_max_chars, option_count=4, option_chars=120):
+    """为一段故事加四个选项预留的输出token数。"""
+    chars = paragraph_max_chars + option_count * option_chars + 50
+    return int(chars * CJK_TOKENS_PER_CHAR * SAFETY_MARGIN) + 64
+
+
+class BudgetedPrompt:
+    """预算计算的结果。"""
+
+    def __init__(self, system_prompt, user_prompt, max_tokens, input_tokens, context_window, trimmed):
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.max_tokens = max_tokens
+        self.input_tokens = input_tokens
+        self.context_window = context_window
+        self.trimmed = trimmed  # 被裁剪的内容说明，如 ["示例", "较早的故事记忆(1200字)"]
+
+    def describe(self):
+        text = f"输入约{self.input_tokens} token，预留输出{self.max_tokens} token，上下文窗口{self.context_window}"
+        if self.trimmed:
+            text += f"，已裁剪: {'、'.join(self.trimmed)}"
+        return text
+
+
+class PromptBudget:
+    """
+    按模型上下文窗口构造提示词。
+
+    fit() 的参数：
+      system_prompt  必须保留的系统指令
+      few_shot       可选的示例，超出预算时最先被去掉
+      history        故事记忆，超出预算时从最早的部分开始裁剪
+      render_user    render_user(history) -> 完整的用户提示词（包含玩家选择等固定内容）
+      desired_output 希望预留的输出token数
+    """
+
+    def __init__(self, model, context_table=None):
+        self.model = model
+        self.counter = TokenCounter(model)
+        self.context_window, self.max_output = (context_table or {}).get(model) or context_limits(model)
+
+    def count(self, text):
+        return self.counter.count(text)
+
+    def fit(self, system_prompt, few_shot, history, render_user, desired_output):
+        # 1. 先为输出预留token
+        max_tokens = max(256, min(int(desired_output), self.max_output))
+        input_budget = self.context_window - max_tokens - 2 * MESSAGE_OVERHEAD_TOKENS
+        trimmed = []
+
+        system_tokens = self.count(system_prompt)
+        few_shot_tokens = self.count(few_shot)
+        user_prompt = render_user(history)
+        user_tokens = self.count(user_prompt)
+
+        # 2. 超出时先去掉示例
+        if few_shot and system_tokens + few_shot_tokens + user_tokens > input_budget:
+            few_shot = ""
+            few_shot_tokens = 0
+            trimmed.append("示例")
+
+        # 3. 再从最早的部分裁剪故事记忆
+        if system_tokens + user_tokens > input_budget and history:
+            original_length = len(history)
+            fixed_tokens = system_tokens + self.count(render_user(""))
+            history_budget = input_budget - fixed_tokens
+            history = self._trim_front(history, history_budget)
+            user_prompt = render_user(history)
+            user_tokens = self.count(user_prompt)
+            trimmed.append(f"较早的故事记忆({original_length - len(history)}字)")
+
+        # 4. 兜底：固定内容本身就超出预算时，截掉用户提示词的开头
+        if system_tokens + user_tokens > input_budget:
+            user_prompt = self._trim_front(user_prompt, input_budget - system_tokens)
+            user_tokens = self.count(user_prompt)
+            trimmed.append("用户提示词开头")
+
+        final_system = system_prompt + few_shot
+        return BudgetedPrompt(
+            final_system,
+            user_prompt,
+            max_tokens,
+            system_tokens + few_shot_tokens + user_tokens + 2 * MESSAGE_OVERHEAD_TOKENS,
+            self.context_window,
+            trimmed,
+        )
+
+    def _trim_front(self, text, token_budget):
+        """保留 text 末尾、token 数不超过 token_budget 的部分。"""
+        if token_budget <= 0:
+            return ""
+        tokens = self.count(text)
+        while text and tokens > token_budget:
+            # 按比例估算需要去掉的字数，多去一点以减少迭代次数
+            keep = int(len(text) * token_budget / tokens * 0.98)
+            text = text[len(text) - keep:] if keep > 0 else ""
+            tokens = self.count(text)
+        return text
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+客户端限流：同一进程中的多个窗口、会话和后台任务（预生成、摘要）共用同一个API Key时，
+按服务商的每秒请求数（RPS）和每分钟token数（TPM）限制排队发出请求，而不是一起发出后收到一批429。
+
+每个 (API Key, 模型) 有两个令牌桶：请求桶每秒补充 rps 个，token桶每秒补充 tpm/60 个。
+请求到来时立即按到达顺序预约（桶的余额可以为负，后来的请求排在更后面），然后等待到预约的时刻再发出，
+因此排队是先到先得的，不会有请求一直抢不到。token按输入字数加 max_tokens 估算（中文1字符≈1 token），
+请求完成后按实际用量退还多预约的部分（失败的请求至少计入输入部分）；请求在排队时被取消则请求数和token全部退还。
+同步调用可以在 trace 中传入 cancel_token（cancellation.CancelToken），排队期间被取消时立即放弃。
+
+限额按 (Key, 模型)、模型、Key、默认 的顺序查找，可以用一行文本描述（界面和命令行使用）：
+
+    *=5rps,100000tpm; qwen-max=2rps,60000tpm; sk-batch/qwen-turbo=1rps
+
+shared_limiter() 返回进程内共用的限流器。
+"""
+
+import asyncio
+import threading
+import time
+
+from llm_backend import WrappingBackend
+
+ANY = "*"
+
+
+class RateLimit:
+    """rps：每秒请求数，tpm：每分钟token数，None 表示不限。"""
+
+    def __init__(self, rps=None, tpm=None):
+        self.rps = rps
+        self.tpm = tpm
+
+    def spec(self):
+        parts = []
+        if self.rps:
+            parts.append(f"{self.rps:g}rps")
+        if self.tpm:
+            parts.append(f"{self.tpm:g}tpm")
+        return ",".join(parts)
+
+    def describe(self):
+        return self.spec() or "不限"
+
+    def __eq__(self, other):
+        return isinstance(other, RateLimit) and (self.rps, self.tpm) == (other.rps, other.tpm)
+
+
+def parse_limits(spec):
+    """把一行限额描述解析为 {(Key 或 None, 模型 或 None): RateLimit}，格式错误时抛出 ValueError。"""
+    limits = {}
+    for part in (spec or "").replace("；", ";").split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        target, sep, values = part.partition("=")
+        if not sep or not target.strip():
+            raise ValueError(f"无效的限额：{part}（格式为 模型=5rps,100000tpm）")
+        key, _, model = target.strip().rpartition("/")
+        rps = tpm = None
+        for item in values.replace("，", ",").split(","):
+            item = item.strip().lower()
+            try:
+                if item.endswith("rps"):
+                    rps = float(item[:-3])
+                elif item.endswith("tpm"):
+                    tpm = float(item[:-3])
+                elif item:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"无效的限额：{item}（只支持 rps 和 tpm）")
+        model = model.strip()
+        limits[(key.strip() or None, None if model == ANY else model)] = RateLimit(rps, tpm)
+    return limits
+
+
+def mask_key(key):
+    """统计和调试信息中只显示Key的前几位。"""
+    if not key or len(key) <= 8:
+        return key or "default"
+    return key[:6] + "…"
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个，最多积累 capacity 个。余额可以为负，表示已经被后来的请求预约。"""
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """预约 amount 个，返回需要等待的秒数。"""
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount, now):
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def wait_time(self, amount, now):
+        """现在预约 amount 个需要等待的秒数（不预约）。"""
+        tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        return max(0.0, (min(amount, self.capacity) - tokens) / self.rate)
+
+
+class Reservation:
+    """一次预约：delay 为需要等待的秒数，tokens 为预约的token数。"""
+
+    def __init__(self, pair, tokens, delay):
+        self.pair = pair
+        self.tokens = tokens
+        self.delay = delay
+
+
+class RateLimiter:
+    """
+    按 (API Key, 模型) 限制每秒请求数和每分钟token数。
+
+    limits    {(Key 或 None, 模型 或 None): RateLimit}，也可以是 parse_limits() 接受的一行文本
+    default   没有匹配的限额时使用的 RateLimit，None 表示不限
+    """
+
+    def __init__(self, limits=None, default=None, clock=time.monotonic):
+        self.limits = {}
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}  # (Key, 模型) -> (请求桶, token桶)，不限时为 None
+        self._stats = {}    # (Key, 模型) -> 统计
+        self.set_limits(limits)
+        if default is not None:
+            self.set_limit(rps=default.rps, tpm=default.tpm)
+
+    # ------------------------------------------------------------------
+    # 设置
+    # ------------------------------------------------------------------
+    def set_limits(self, limits):
+        """替换全部限额（一行文本或字典）；只重建限额有变化的令牌桶，统计保留。"""
+        if isinstance(limits, str):
+            limits = parse_limits(limits)
+        with self._lock:
+            self._replace_limits(dict(limits or {}))
+
+    def set_limit(self, model=None, rps=None, tpm=None, key=None):
+        """设置某个模型和/或Key的限额；model 和 key 都为 None 时设置默认限额。"""
+        with self._lock:
+            self._replace_limits({**self.limits, (key, model): RateLimit(rps, tpm)})
+
+    def _replace_limits(self, limits):
+        # 限额不变的桶保留当前余额，否则重新开局或重新应用设置后会立即放行一批请求
+        old = {pair: self.limit_for(*pair) for pair in self._buckets}
+        self.limits = limits
+        self._buckets = {pair: buckets for pair, buckets in self._buckets.items() if self.limit_for(*pair) == old[pair]}
+
+    def spec(self):
+        """限额的一行描述（parse_limits 的逆操作）。"""
+        return "; ".join(f"{key + '/' if key else ''}{model or ANY}={limit.spec()}" for (key, model), limit in self.limits.items())
+
+    def limit_for(self, key, model):
+        for pair in ((key, model), (None, model), (key, None), (None, None)):
+            if pair in self.limits:
+                return self.limits[pair]
+        return None
+
+    def _buckets_for(self, pair, now):
+        buckets = self._buckets.get(pair)
+        if buckets is None:
+            limit = self.limit_for(*pair)
+            request_bucket = TokenBucket(limit.rps, max(1.0, limit.rps), now) if limit and limit.rps else None
+            token_bucket = TokenBucket(limit.tpm / 60.0, limit.tpm, now) if limit and limit.tpm else None
+            buckets = self._buckets[pair] = (request_bucket, token_bucket)
+        return buckets
+
+    def _stats_for(self, pair):
+        stats = self._stats.get(pair)
+        if stats is None:
+            stats = self._stats[pair] = {'requests': 0, 'queued': 0, 'waiting': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+        return stats
+
+    # ------------------------------------------------------------------
+    # 预约与等待
+    # ------------------------------------------------------------------
+    def reserve(self, key, model, tokens):
+        """按到达顺序预约一次请求，返回 Reservation；调用方等待 delay 秒后发出请求。"""
+        pair = (key, model)
+        with self._lock:
+            now = self.clock()
+            request_bucket, token_bucket = self._buckets_for(pair, now)
+            delay = 0.0
+            if request_bucket is not None:
+                delay = request_bucket.reserve(1, now)
+            if token_bucket is not None:
+                tokens = min(tokens, token_bucket.capacity)
+                delay = max(delay, token_bucket.reserve(tokens, now))
+            else:
+                tokens = 0
+            stats = self._stats_for(pair)
+            stats['requests'] += 1
+            if delay > 0:
+                stats['queued'] += 1
+                stats['waiting'] += 1
+                stats['total_wait'] += delay
+                stats['max_wait'] = max(stats['max_wait'], delay)
+        return Reservation(pair, tokens, delay)
+
+    def _done_waiting(self, reservation):
+        if reservation.delay > 0:
+            with self._lock:
+                self._stats_for(reservation.pair)['waiting'] -= 1
+
+    def acquire(self, key, model, tokens, cancel_token=None):
+        """预约并等待（同步版本）；cancel_token 在排队时被取消会退还预约并抛出 GenerationCancelled。"""
+        reservation = self.reserve(key, model, tokens)
+        try:
+            if reservation.delay > 0:
+                if cancel_token is None:
+                    time.sleep(reservation.delay)
+                elif cancel_token.wait(reservation.delay):
+                    self.cancel(reservation)
+                    cancel_token.check()
+        finally:
+            self._done_waiting(reservation)
+        return reservation
+
+    async def aacquire(self, key, model, tokens):
+        """预约并等待（asyncio 版本）；排队时被取消会退还预约。"""
+        reservation = self.reserve(key, model, tokens)
+        try:
+            if reservation.delay > 0:
+                await asyncio.sleep(reservation.delay)
+        except asyncio.CancelledError:
+            self.cancel(reservation)
+            raise
+        finally:
+            self._done_waiting(reservation)
+        return reservation
+
+    def settle(self, reservation, used_tokens):
+        """请求结束后按实际用量退还多预约的token。"""
+        refund = reservation.tokens - used_tokens
+        if refund <= 0:
+            return
+        with self._lock:
+            buckets = self._buckets.get(reservation.pair)
+            if buckets and buckets[1] is not None:
+                buckets[1].refund(refund, self.clock())
+
+    def cancel(self, reservation):
+        """没有发出的请求：退还预约的请求数和全部token，后面排队的请求不再为它多等。"""
+        with self._lock:
+            buckets = self._buckets.get(reservation.pair)
+            if not buckets:
+                return
+            now = self.clock()
+            if buckets[0] is not None:
+                buckets[0].refund(1, now)
+            if buckets[1] is not None and reservation.tokens:
+                buckets[1].refund(reservation.tokens, now)
+
+    # ------------------------------------------------------------------
+    # 统计
+    # ------------------------------------------------------------------
+    def wait_time(self, key, model, tokens=0):
+        """现在发出一个请求需要排队的秒数。"""
+        with self._lock:
+            now = self.clock()
+            request_bucket, token_bucket = self._buckets_for((key, model), now)
+            wait = request_bucket.wait_time(1, now) if request_bucket is not None else 0.0
+            if token_bucket is not None:
+                wait = max(wait, token_bucket.wait_time(tokens, now))
+            return wait
+
+    def queue_depth(self, key=None, model=None):
+        """正在排队的请求数；key、model 为 None 时不按它筛选。"""
+        with self._lock:
+            return sum(stats['waiting'] for (k, m), stats in self._stats.items()
+                       if (key is None or k == key) and (model is None or m == model))
+
+    def snapshot(self):
+        """{"Key/模型": {limit, requests, queued, waiting, wait_time, mean_wait, max_wait}}，供 /metrics 和调试信息使用。"""
+        with self._lock:
+            pairs = {pair: dict(stats) for pair, stats in self._stats.items()}
+        result = {}
+        for (key, model), stats in pairs.items():
+            limit = self.limit_for(key, model)
+            result[f"{mask_key(key)}/{model}"] = {
+                'limit': limit.describe() if limit else "不限",
+                'requests': stats['requests'],
+                'queued': stats['queued'],
+                'waiting': stats['waiting'],
+                'wait_time': round(self.wait_time(key, model), 3),
+                'mean_wait': round(stats['total_wait'] / stats['queued'], 3) if stats['queued'] else 0.0,
+                'max_wait': round(stats['max_wait'], 3),
+            }
+        return result
+
+    def describe(self):
+        lines = [f"{name}（{stats['limit']}）：请求{stats['requests']}次，排队{stats['queued']}次，"
+                 f"平均等待{stats['mean_wait']:.2f}s，最长{stats['max_wait']:.2f}s，当前排队{stats['waiting']}个"
+                 for name, stats in self.snapshot().items()]
+        return "\n".join(lines) or "暂无限流记录"
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def shared_limiter():
+    """进程内共用的限流器（默认不限，按需 set_limits()）。"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
+
+
+class RateLimitedBackend(WrappingBackend):
+    """
+    发出请求前先在限流器中排队的后端包装。
+
+    backend   实际发出请求的后端；有 api_key 属性时按它区分Key
+    limiter   RateLimiter，默认为进程内共用的 shared_limiter()
+    key       限流使用的Key，默认取 backend.api_key
+    """
+
+    def __init__(self, backend, limiter=None, key=None):
+        super().__init__(backend)
+        self.limiter = limiter or shared_limiter()
+        self.key = key
+
+    def api_key_for_limits(self):
+        return self.key or getattr(self.backend, 'api_key', None)
+
+    def wait_time(self, model, system_prompt="", user_prompt="", max_tokens=0):
+        """这个请求现在发出需要排队的秒数（供界面提示）。"""
+        return self.limiter.wait_time(self.api_key_for_limits(), model, len(system_prompt) + len(user_prompt) + max_tokens)
+
+    @staticmethod
+    def _cancel_token(trace):
+        return trace.get('cancel_token') if trace is not None else None
+
+    @staticmethod
+    def _record_wait(trace, reservation):
+        if trace is not None:
+            trace['rate_limit_wait'] = reservation.delay
+
+    def complete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        reservation = self.limiter.acquire(self.api_key_for_limits(), model, len(system_prompt) + len(user_prompt) + max_tokens,
+                                           self._cancel_token(trace))
+        self._record_wait(trace, reservation)
+        used = len(system_prompt) + len(user_prompt)  # 请求失败（超时、5xx、429）时输入部分同样计入用量
+        try:
+            result = self.backend.complete(model, system_prompt, user_prompt, max_tokens, top_p,
+                                           json_output=json_output, trace=trace)
+            used = result.total_tokens
+            return result
+        finally:
+            self.limiter.settle(reservation, used)
+
+    def stream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        reservation = self.limiter.acquire(self.api_key_for_limits(), model, len(system_prompt) + len(user_prompt) + max_tokens,
+                                           self._cancel_token(trace))
+        self._record_wait(trace, reservation)
+        used = len(system_prompt) + len(user_prompt)
+        try:
+            for delta in self.backend.stream(model, system_prompt, user_prompt, max_tokens, top_p,
+                                             json_output=json_output, trace=trace):
+                used += len(delta)
+                yield delta
+        finally:
+            self.limiter.settle(reservation, used)
+
+    async def acomplete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        reservation = await self.limiter.aacquire(self.api_key_for_limits(), model,
+                                                  len(system_prompt) + len(user_prompt) + max_tokens)
+        self._record_wait(trace, reservation)
+        used = len(system_prompt) + len(user_prompt)
+        try:
+            result = await self.backend.acomplete(model, system_prompt, user_prompt, max_tokens, top_p,
+                                                  json_output=json_output, trace=trace)
+            used = result.total_tokens
+            return result
+        finally:
+            self.limiter.settle(reservation, used)
+
+    async def astream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        reservation = await self.limiter.aacquire(self.api_key_for_limits(), model,
+                                                  len(system_prompt) + len(user_prompt) + max_tokens)
+        self._record_wait(trace, reservation)
+        used = len(system_prompt) + len(user_prompt)
+        stream = self.backend.astream(model, system_prompt, user_prompt, max_tokens, top_p,
+                                      json_output=json_output, trace=trace)
+        try:
+            async for delta in stream:
+                used += len(delta)
+                yield delta
+        finally:
+            await stream.aclose()
+            self.limiter.settle(reservation, used)
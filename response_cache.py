@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI响应的本地持久化缓存（SQLite）。
+
+以 (模型, 系统提示词, 用户提示词, 采样参数) 为键保存AI的原始文本响应，
+按条数、总大小和存活时间做LRU淘汰。使用WAL模式，可在多个游戏进程之间共享同一个缓存文件。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "llm_cache.sqlite3"
+
+
+class LLMResponseCache:
+    """
+    AI响应缓存。
+
+    max_entries      最多保存的条数
+    max_bytes        响应文本总大小上限（字节）
+    max_age_seconds  超过该时间未写入的条目视为过期
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=1000, max_bytes=50 * 1024 * 1024, max_age_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.local = threading.local()  # sqlite3 连接不能跨线程使用，每个线程各自建立连接
+        self.lock = threading.Lock()
+        self.hits = 0    # 本进程的命中次数
+        self.misses = 0  # 本进程的未命中次数
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout = 30000")
+            self.local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses(created_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO stats(name, value) VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+
+    @staticmethod
+    def make_key(model, system_prompt, user_prompt, params=None):
+        """根据模型、提示词和采样参数生成缓存键。"""
+        payload = json.dumps(
+            [model, system_prompt, user_prompt, params or {}],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """读取缓存，未命中或已过期时返回 None。"""
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and now - row[1] > self.max_age_seconds:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            row = None
+
+        if row is None:
+            with self.lock:
+                self.misses += 1
+            conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'misses'")
+            return None
+
+        conn.execute(
+            "UPDATE responses SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?", (now, key)
+        )
+        conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'hits'")
+        with self.lock:
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, model, response):
+        """写入缓存，并按需淘汰。"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses(key, model, response, size, created_at, last_access, hit_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, model, response, len(response.encode('utf-8')), now, now),
+            )
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn, now):
+        """删除过期条目，再按最近访问时间淘汰，直到条数和总大小都在上限内。"""
+        evicted = conn.execute(
+            "DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,)
+        ).rowcount
+
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            over_count = max(0, count - self.max_entries)
+            rows = conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT ?", (max(1, over_count),)
+            ).fetchall()
+            if not rows:
+                break
+            conn.executemany("DELETE FROM responses WHERE key = ?", [(row[0],) for row in rows])
+            evicted += len(rows)
+            count -= len(rows)
+            total -= sum(row[1] for row in rows)
+
+        if evicted:
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'evictions'", (evicted,))
+
+    def clear(self):
+        """清空缓存。"""
+        self._connect().execute("DELETE FROM responses")
+
+    def stats(self):
+        """返回本进程与缓存文件累计的命中统计。"""
+        conn = self._connect()
+        totals = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'total_hits': totals.get('hits', 0),
+            'total_misses': totals.get('misses', 0),
+            'evictions': totals.get('evictions', 0),
+            'entries': count,
+            'bytes': total,
+        }
+
+    def summary(self):
+        """返回便于打印的统计信息。"""
+        stats = self.stats()
+        return (f"响应缓存命中率: {stats['hit_rate']:.0%}（命中{stats['hits']}，未命中{stats['misses']}），"
+                f"缓存{stats['entries']}条/{stats['bytes'] / 1024:.0f}KB，累计淘汰{stats['evictions']}条")
@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI响应解析：从AI返回的纯文本中提取故事和四个选项，以及从JSON/Python字典写法的响应中恢复对象。
+"""
+
+import ast
+import json
+import re
+import threading
+
+# "### 行动选项"或类似的分隔符，按优先级排列
+OPTION_MARKERS = [
+    "### 行动选项",
+    "### 选项",
+    "### 选择",
+    "行动选项：",
+    "选项：",
+    "选择："
+]
+
+
+def parse_text_response(text_response):
+    """解析AI返回的纯文本响应，提取故事和选项。"""
+    # 清理响应文本
+    text = text_response.strip()
+    
+    story_part = ""
+    options = []
+    
+    # 尝试找到选项部分
+    option_start = -1
+    # 查找"### 行动选项"或类似的分隔符
+    for marker in OPTION_MARKERS:
+        option_start = text.find(marker)
+        if option_start != -1:
+            break
+    
+    if option_start != -1:
+        # 分离故事和选项
+        story_part = text[:option_start].strip()
+        options_text = text[option_start:].strip()
+        
+        # 提取选项
+        options = extract_options_from_text(options_text)
+    else:
+        # 如果没有找到明确的选项标记，尝试其他方法
+        story_part = text
+        options = extract_options_from_text(text)
+    
+    # 验证结果
+    if not story_part:
+        raise ValueError("无法提取故事内容")
+    
+    if len(options) != 4:
+        raise ValueError(f"选项数量不正确，期望4个，实际{len(options)}个")
+    
+    return story_part, options
+
+
+def extract_options_from_text(text):
+    """从文本中提取选项。"""
+    options = []
+    
+    # 方法1：查找"**选项标题**-描述"格式
+    pattern1 = r'\*\*([^*]+)\*\*-([^\n]+)'
+    matches1 = re.findall(pattern1, text)
+    
+    if len(matches1) >= 4:
+        for title, desc in matches1[:4]:
+            options.append(f"{title}-{desc}")
+        return options
+    
+    # 方法2：查找数字编号的选项
+    pattern2 = r'(\d+)[\.、]\s*([^\n]+)'
+    matches2 = re.findall(pattern2, text)
+    
+    if len(matches2) >= 4:
+        for num, desc in matches2[:4]:
+            options.append(desc.strip())
+        return options
+    
+    # 方法3：查找"选项X："格式
+    pattern3 = r'选项\s*(\d+)[：:]\s*([^\n]+)'
+    matches3 = re.findall(pattern3, text)
+    
+    if len(matches3) >= 4:
+        for num, desc in matches3[:4]:
+            options.append(desc.strip())
+        return options
+    
+    # 方法4：按行分割，查找可能的选项
+    lines = text.split('\n')
+    for line in lines:
+        line = line.strip()
+        if line and len(line) > 10:  # 排除太短的行
+            # 检查是否包含选项关键词
+            if any(keyword in line for keyword in ['**', '选项', '选择', '决定']):
+                options.append(line)
+                if len(options) >= 4:
+                    break
+    
+    # 如果还是不够4个，用最后几行作为选项
+    if len(options) < 4:
+        lines = [line.strip() for line in lines if line.strip() and len(line.strip()) > 10]
+        for line in lines[-4:]:
+            if line not in options:
+                options.append(line)
+                if len(options) >= 4:
+                    break
+    
+    return options[:4]  # 确保最多返回4个选项
+
+
+# ----------------------------------------------------------------------
+# 流式解析器
+# ----------------------------------------------------------------------
+_DIGIT = re.compile(r'\d')
+_DIGITS = re.compile(r'\d*')
+_SPACES = re.compile(r'\s*')
+_NON_SPACE = re.compile(r'\S')
+_MARKER_TAIL = max(len(marker) for marker in OPTION_MARKERS) - 1
+
+
+class _BoldOptionScanner:
+    """逐段模拟 re.findall(r'\\*\\*([^*]+)\\*\\*-([^\\n]+)') 的状态机（方法1）。"""
+
+    IDLE, STAR1, OPEN, RUN, CLOSE1, CLOSE2, DASH, DESC = range(8)
+
+    def __init__(self, limit=4):
+        self.limit = limit
+        self.state = self.IDLE
+        self.title = []
+        self.desc = []
+        self.matches = []
+
+    def done(self):
+        return len(self.matches) >= self.limit
+
+    def feed(self, text):
+        i, n = 0, len(text)
+        while i < n and not self.done():
+            state = self.state
+            if state == self.IDLE:
+                j = text.find('*', i)
+                if j == -1:
+                    return
+                self.state, i = self.STAR1, j + 1
+            elif state == self.RUN:
+                j = text.find('*', i)
+                if j == -1:
+                    self.title.append(text[i:])
+                    return
+                self.title.append(text[i:j])
+                self.state, i = self.CLOSE1, j + 1
+            elif state == self.DESC:
+                j = text.find('\n', i)
+                if j == -1:
+                    self.desc.append(text[i:])
+                    return
+                self.desc.append(text[i:j])
+                self._emit()
+                i = j
+            else:
+                c = text[i]
+                i += 1
+                if state == self.STAR1:
+                    self.state = self.OPEN if c == '*' else self.IDLE
+                elif state == self.OPEN:
+                    if c != '*':
+                        self.state, self.title = self.RUN, [c]
+                elif state == self.CLOSE1:
+                    self.state = self.CLOSE2 if c == '*' else self.IDLE
+                elif state == self.CLOSE2:
+                    if c == '-':
+                        self.state = self.DASH
+                    elif c == '*':
+                        self.state = self.OPEN  # "***" 从下一个星号重新开始
+                    else:
+                        self.state, self.title = self.RUN, [c]  # 以结尾的"**"作为新的开头
+                elif state == self.DASH:
+                    if c == '\n':
+                        self.state, self.title = self.RUN, ['-\n']
+                    else:
+                        self.state, self.desc = self.DESC, [c]
+
+    def finish(self):
+        if self.state == self.DESC and not self.done():
+            self._emit()
+
+    def _emit(self):
+        self.matches.append(f"{''.join(self.title)}-{''.join(self.desc)}")
+        self.state, self.title, self.desc = self.IDLE, [], []
+
+
+class _NumberedOptionScanner:
+    """
+    逐段模拟 re.findall(r'(\\d+)[\\.、]\\s*([^\\n]+)')（方法2），
+    label=True 时模拟 re.findall(r'选项\\s*(\\d+)[：:]\\s*([^\\n]+)')（方法3）。
+    """
+
+    IDLE, XUAN, LABEL_SPACE, DIGITS, SEP_SPACE, DESC = range(6)
+
+    def __init__(self, label=False, limit=4):
+        self.label = label
+        self.separators = '：:' if label else '.、'
+        self.limit = limit
+        self.state = self.IDLE
+        self.desc = []
+        self.matches = []
+
+    def done(self):
+        return len(self.matches) >= self.limit
+
+    def feed(self, text):
+        i, n = 0, len(text)
+        while i < n and not self.done():
+            state = self.state
+            if state == self.IDLE:
+                if self.label:
+                    j = text.find('选', i)
+                    if j == -1:
+                        return
+                    self.state, i = self.XUAN, j + 1
+                else:
+                    m = _DIGIT.search(text, i)
+                    if m is None:
+                        return
+                    self.state, i = self.DIGITS, m.end()
+            elif state == self.XUAN:
+                # 不是"项"时从当前字符重新查找（它可能是下一个"选"）
+                if text[i] == '项':
+                    self.state, i = self.LABEL_SPACE, i + 1
+                else:
+                    self.state = self.IDLE
+            elif state == self.LABEL_SPACE:
+                i = _SPACES.match(text, i).end()
+                if i < n:
+                    if _DIGIT.match(text, i):
+                        self.state, i = self.DIGITS, i + 1
+                    else:
+                        self.state = self.IDLE
+            elif state == self.DIGITS:
+                i = _DIGITS.match(text, i).end()
+                if i < n:
+                    if text[i] in self.separators:
+                        self.state, i = self.SEP_SPACE, i + 1
+                    else:
+                        self.state = self.IDLE
+            elif state == self.SEP_SPACE:
+                i = _SPACES.match(text, i).end()
+                if i < n:
+                    self.state, self.desc = self.DESC, []
+            elif state == self.DESC:
+                j = text.find('\n', i)
+                if j == -1:
+                    self.desc.append(text[i:])
+                    return
+                self.desc.append(text[i:j])
+                self._emit()
+                i = j
+
+    def finish(self):
+        # 文本已去掉首尾空白，结束时停在空白状态说明描述为空，匹配失败
+        if self.state == self.DESC and not self.done():
+            self._emit()
+
+    def _emit(self):
+        self.matches.append(''.join(self.desc).strip())
+        self.state, self.desc = self.IDLE, []
+
+
+class _LineOptionScanner:
+    """方法4：按行查找含关键词的行，不够时用最后几行长度超过10的行补足。"""
+
+    KEYWORDS = ['**', '选项', '选择', '决定']
+
+    def __init__(self):
+        self.partial = []
+        self.keyword_lines = []
+        self.long_lines = []
+
+    def feed(self, text):
+        lines = text.split('\n')
+        if len(lines) == 1:
+            self.partial.append(text)
+            return
+        self.partial.append(lines[0])
+        self._line(''.join(self.partial))
+        for line in lines[1:-1]:
+            self._line(line)
+        self.partial = [lines[-1]]
+
+    def finish(self):
+        self._line(''.join(self.partial))
+        self.partial = []
+
+    def _line(self, line):
+        line = line.strip()
+        if line and len(line) > 10:
+            if len(self.keyword_lines) < 4 and any(keyword in line for keyword in self.KEYWORDS):
+                self.keyword_lines.append(line)
+            self.long_lines = (self.long_lines + [line])[-4:]
+
+    def options(self):
+        options = list(self.keyword_lines)
+        if len(options) < 4:
+            for line in self.long_lines:
+                if line not in options:
+                    options.append(line)
+                    if len(options) >= 4:
+                        break
+        return options[:4]
+
+
+class _OptionRegion:
+    """从某个位置（某个分隔标记或全文开头）开始的文本，同时运行 extract_options_from_text 的四种方法。"""
+
+    def __init__(self, start, marker=None):
+        self.start = start
+        self.marker = marker
+        self.bold = _BoldOptionScanner()
+        self.numbered = _NumberedOptionScanner()
+        self.labelled = _NumberedOptionScanner(label=True)
+        self.lines = _LineOptionScanner()
+
+    def feed(self, text):
+        # 前面的方法已找到4个选项时，后面的方法不会被用到，不再扫描
+        self.bold.feed(text)
+        if self.bold.done():
+            return
+        self.numbered.feed(text)
+        if self.numbered.done():
+            return
+        self.labelled.feed(text)
+        if self.labelled.done():
+            return
+        self.lines.feed(text)
+
+    def finish(self):
+        for scanner in (self.bold, self.numbered, self.labelled, self.lines):
+            scanner.finish()
+
+    def options(self):
+        for scanner in (self.bold, self.numbered, self.labelled):
+            if scanner.done():
+                return scanner.matches[:4]
+        return self.lines.options()
+
+
+class StreamingOptionParser:
+    """
+    单遍、增量的响应解析器，结果与 parse_text_response 完全一致。
+
+    流式输出时每收到一段文本就调用 feed()，返回本段中新完成的"**标题**-描述"选项，可以提前显示；
+    全部收到后调用 finish() 得到 (故事, 选项)，无法解析时与 parse_text_response 一样抛出 ValueError。
+    每个字符只被扫描常数次，不需要在结束后重新搜索整段文本。
+    """
+
+    def __init__(self):
+        self.pieces = []  # 去掉首尾空白后的文本
+        self.length = 0
+        self.tail = ""  # 上一段末尾的几个字符，用于查找跨段的分隔标记
+        self.held_space = ""  # 末尾的空白，等后面出现非空白字符时再处理
+        self.started = False
+        self.regions = [_OptionRegion(0)]  # 全文 + 已找到的各个分隔标记
+        self.best = len(OPTION_MARKERS)  # 已找到的最高优先级标记的序号，未找到时为标记总数（全文）
+        self.emitted = 0
+
+    @property
+    def boundary(self):
+        """故事与选项的分界位置（当前优先级最高的分隔标记），尚未找到时为 None。"""
+        return self.regions[0].start if self.regions[0].marker else None
+
+    def feed(self, chunk):
+        if not chunk:
+            return []
+        if not self.started:
+            m = _NON_SPACE.search(chunk)
+            if m is None:
+                return []
+            chunk = chunk[m.start():]
+            self.started = True
+        chunk = self.held_space + chunk
+        text = chunk.rstrip()
+        self.held_space = chunk[len(text):]
+        if not text:
+            return []
+
+        window = self.tail + text
+        new_regions = []
+        # 所有分隔标记都含有"选"字，没有时不必逐个查找
+        if '选' in window:
+            window_start = self.length - len(self.tail)
+            for priority in range(self.best):
+                k = window.find(OPTION_MARKERS[priority])
+                if k != -1:
+                    region = _OptionRegion(window_start + k, OPTION_MARKERS[priority])
+                    region.feed(window[k:])
+                    new_regions.append(region)
+                    self.best = priority
+                    break
+        if new_regions:
+            # 找到更高优先级的标记后，低优先级的区域和全文区域都不会再被使用，不必再扫描
+            self.regions = new_regions
+            self.emitted = 0
+        else:
+            for region in self.regions:
+                region.feed(text)
+
+        self.pieces.append(text)
+        self.length += len(text)
+        self.tail = window[-_MARKER_TAIL:]
+        matches = self.regions[0].bold.matches
+        if len(matches) == self.emitted:
+            return []
+        new = matches[self.emitted:4]
+        self.emitted = len(matches)
+        return new
+
+    def finish(self):
+        """返回 (故事, 选项)，与 parse_text_response 对同一段完整文本的结果相同。"""
+        text = "".join(self.pieces)
+        region = self.regions[0]
+        region.finish()
+        options = region.options()
+        story_part = text[:region.start].strip() if region.marker else text
+
+        if not story_part:
+            raise ValueError("无法提取故事内容")
+
+        if len(options) != 4:
+            raise ValueError(f"选项数量不正确，期望4个，实际{len(options)}个")
+
+        return story_part, options
+
+
+def parse_text_response_streaming(text_response, chunk_size=None):
+    """用 StreamingOptionParser 一次解析完整文本（chunk_size 可模拟流式分段）。"""
+    parser = StreamingOptionParser()
+    if chunk_size:
+        for i in range(0, len(text_response), chunk_size):
+            parser.feed(text_response[i:i + chunk_size])
+    else:
+        parser.feed(text_response)
+    return parser.finish()
+
+
+# ----------------------------------------------------------------------
+# JSON / Python字典恢复
+# ----------------------------------------------------------------------
+MAX_OBJECT_DEPTH = 32  # 括号嵌套超过这个深度的候选直接放弃，避免解析器递归过深
+# 一个记号：完整的（或到行尾为止未闭合的）单/双引号字符串，或一个括号。
+# 字符串内每个字符只能匹配一个分支，不会回溯，匹配耗时与长度成线性关系
+_OBJECT_TOKEN = re.compile(r'''"(?:[^"\\\n]|\\.)*"?|'(?:[^'\\\n]|\\.)*'?|[{}\[\]]''')
+_CLOSERS = {'}': '{', ']': '['}
+
+
+def find_object_spans(text, max_depth=MAX_OBJECT_DEPTH):
+    """
+    单遍扫描，返回文本中最外层的、括号配对完整的 {...} 片段的 (起点, 终点) 列表。
+
+    只在对象内部识别单引号和双引号字符串，字符串中的括号和另一种引号不计入；
+    字符串不能跨行，遇到换行说明这个"引号"并不是字符串的开头。
+    内部嵌套超过 max_depth 层的对象不记录，但它外面的对象照常记录。
+    扫描位置只会前进，耗时与文本长度成线性关系。
+    """
+    spans = []
+    pos = 0
+    while True:
+        first = text.find('{', pos)
+        if first == -1:
+            break
+        stack = [['{', first, 1]]  # [括号, 位置, 内部到达过的最大深度]
+        pos = len(text)
+        for m in _OBJECT_TOKEN.finditer(text, first + 1):
+            ch = m.group()[0]
+            if ch == '{' or ch == '[':
+                stack.append([ch, m.start(), len(stack) + 1])
+                continue
+            if ch not in _CLOSERS:
+                continue  # 字符串
+            opener, start, peak = stack.pop()
+            if opener != _CLOSERS[ch]:
+                # 括号不配对，整段放弃，从下一个 { 重新开始
+                pos = m.end()
+                break
+            depth = len(stack) + 1
+            if stack and peak > stack[-1][2]:
+                stack[-1][2] = peak
+            if ch == '}' and peak - depth < max_depth:
+                # 新闭合的对象包含了之前记录的内层对象，只保留最外层
+                while spans and spans[-1][0] > start:
+                    spans.pop()
+                spans.append((start, m.end()))
+            if not stack:
+                pos = m.end()
+                break
+    return spans
+
+
+def recover_json_object(text):
+    """
+    从文本中恢复 JSON 对象或 Python 字典写法的对象，返回字典，找不到时抛出 ValueError。
+
+    候选片段由 find_object_spans 给出（按括号配对、识别引号的线性扫描，字符串中的撇号和括号不会破坏配对），
+    优先尝试含有 story 的片段；每个片段先按 JSON 解析，失败再按 Python 字面量解析（单引号、撇号、True/None 都能正确处理）。
+    """
+    spans = find_object_spans(text)
+    candidates = [text[start:end] for start, end in spans]
+    candidates = [c for c in candidates if 'story' in c] or candidates[:1]
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            try:
+                data = ast.literal_eval(candidate)
+            except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                continue
+        if isinstance(data, dict):
+            return data
+    raise ValueError("未找到有效的字典格式")
+
+
+# ----------------------------------------------------------------------
+# 结构化输出与解析统计
+# ----------------------------------------------------------------------
+def story_and_options(data):
+    """检查对象是否为 {"story": 字符串, "options": [四个字符串]}，返回 (故事, 选项)，否则抛出 ValueError。"""
+    if not isinstance(data, dict) or 'story' not in data or 'options' not in data:
+        raise ValueError("JSON对象缺少 story 或 options")
+    story_part, options = data['story'], data['options']
+    if not isinstance(story_part, str) or not story_part.strip():
+        raise ValueError("无法提取故事内容")
+    if not isinstance(options, list) or not all(isinstance(option, str) for option in options):
+        raise ValueError("options 不是字符串列表")
+    if len(options) != 4:
+        raise ValueError(f"选项数量不正确，期望4个，实际{len(options)}个")
+    return story_part.strip(), [option.strip() for option in options]
+
+
+def parse_json_response(text_response):
+    """结构化输出的快速路径：整段文本就是一个JSON对象，一次 json.loads 即可。"""
+    return story_and_options(json.loads(text_response))
+
+
+# 策略名 -> 解析函数；函数返回 (故事, 选项)，失败时抛出 ValueError
+PARSE_STRATEGIES = {
+    'json': parse_json_response,
+    'json_recovered': lambda text: story_and_options(recover_json_object(text)),
+    'text': parse_text_response,
+}
+JSON_STRATEGY_ORDER = ('json', 'json_recovered', 'text')
+TEXT_STRATEGY_ORDER = ('text',)
+
+
+def parse_response(text_response, json_output=False):
+    """
+    按顺序尝试各解析策略，返回 (故事, 选项, 成功的策略名)。
+    json_output 为 True 时先按JSON解析，失败再退回到纯文本解析；全部失败时抛出最后一个策略的 ValueError。
+    """
+    error = None
+    for name in (JSON_STRATEGY_ORDER if json_output else TEXT_STRATEGY_ORDER):
+        try:
+            story_part, options = PARSE_STRATEGIES[name](text_response)
+        except ValueError as e:
+            error = e
+            continue
+        return story_part, options, name
+    raise error
+
+
+class ParseStats:
+    """
+    按模型统计每轮由哪个解析策略成功、解析耗时（微秒，包含之前失败的策略），
+    以及所有策略都失败、只能整轮重试的次数。可在多个线程或会话间共用。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _entry(self, model):
+        entry = self._models.get(model)
+        if entry is None:
+            entry = self._models[model] = {'turns': 0, 'retries': 0, 'retry_us': 0.0, 'strategies': {}}
+        return entry
+
+    def record(self, model, strategy, elapsed_us):
+        with self._lock:
+            entry = self._entry(model)
+            entry['turns'] += 1
+            stats = entry['strategies'].setdefault(strategy, {'count': 0, 'total_us': 0.0, 'max_us': 0.0})
+            stats['count'] += 1
+            stats['total_us'] += elapsed_us
+            stats['max_us'] = max(stats['max_us'], elapsed_us)
+
+    def record_failure(self, model, elapsed_us):
+        with self._lock:
+            entry = self._entry(model)
+            entry['turns'] += 1
+            entry['retries'] += 1
+            entry['retry_us'] += elapsed_us
+
+    def snapshot(self):
+        """{模型: {turns, retries, retry_rate, strategies: {策略: {count, share, mean_us, max_us}}}}"""
+        with self._lock:
+            result = {}
+            for model, entry in self._models.items():
+                turns = entry['turns']
+                result[model] = {
+                    'turns': turns,
+                    'retries': entry['retries'],
+                    'retry_rate': round(entry['retries'] / turns, 4) if turns else 0.0,
+                    'strategies': {
+                        name: {
+                            'count': stats['count'],
+                            'share': round(stats['count'] / turns, 4),
+                            'mean_us': round(stats['total_us'] / stats['count'], 1),
+                            'max_us': round(stats['max_us'], 1),
+                        }
+                        for name, stats in entry['strategies'].items()
+                    },
+                }
+            return result
+
+    def describe(self):
+        """供调试信息显示的多行文本。"""
+        lines = []
+        for model, entry in self.snapshot().items():
+            lines.append(f"{model}：{entry['turns']}轮，整轮重试{entry['retries']}次")
+            for name, stats in sorted(entry['strategies'].items(), key=lambda item: -item[1]['count']):
+                lines.append(f"  {name}: {stats['count']}次（{stats['share'] * 100:.0f}%），平均{stats['mean_us']:.0f}us，最长{stats['max_us']:.0f}us")
+        return "\n".join(lines) or "暂无解析记录"
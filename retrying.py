@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自动重试与熔断：限流（429）、服务端错误（5xx）、超时和网络错误时自动重试，不再直接报错给玩家。
+
+RetryingBackend 包装一个后端。可重试的失败按指数退避加全抖动等待后重试
+（第 n 次重试前等待 0 ~ min(max_delay, base_delay × 2^n) 秒之间的随机时间，避免大量客户端同时重试），
+服务端在 Retry-After 中给出等待时间时至少等待这么久。其他错误（400、鉴权失败等）重试也没有用，直接抛出。
+流式调用只在还没有产出任何内容时重试，已经显示给玩家的内容不会重复。
+
+每个Host一个熔断器（CircuitBreaker）：连续 failure_threshold 次可重试的失败后断开 cooldown 秒，
+期间的调用立即抛出 CircuitOpenError，不再排队等待超时；冷却结束后放行一个试探请求，
+成功则恢复，失败则再断开一个冷却期。
+
+retry_stats 记录调用次数、重试次数、放弃重试的次数、熔断次数、熔断期间被拒绝的调用和退避等待的总时间。
+"""
+
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from llm_backend import LLMError, LLMTimeoutError, WrappingBackend
+
+MAX_RETRIES = 3
+BASE_DELAY = 0.5  # 秒
+MAX_DELAY = 8.0   # 秒，单次退避等待的上限（也是 Retry-After 的上限）
+FAILURE_THRESHOLD = 5
+COOLDOWN = 30.0   # 秒
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_NAMES = {CLOSED: "正常", OPEN: "熔断中", HALF_OPEN: "试探中"}
+
+
+class CircuitOpenError(LLMError):
+    """熔断期间的调用被拒绝（不会发出请求，也不会被重试）。"""
+
+
+def is_retryable(error):
+    """超时、网络错误（没有状态码）、429 和 5xx 可以重试。"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, LLMTimeoutError) or error.status_code is None:
+        return True
+    return error.status_code == 429 or error.status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    一个Host的熔断器。
+
+    failure_threshold   连续多少次可重试的失败后断开
+    cooldown            断开后多少秒放行一个试探请求
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0   # 连续失败次数
+        self.opens = 0      # 累计断开次数
+        self._opened_at = 0.0
+        self._probing = False  # 半开状态下是否已经放行了试探请求
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行一次请求；半开状态下只放行一个试探请求。"""
+        with self._lock:
+            if self.state == OPEN:
+                if self.clock() - self._opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def retry_in(self):
+        """距离放行试探请求还有多少秒。"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.cooldown - (self.clock() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """记录一次可重试的失败；这次失败使熔断器断开时返回 True。"""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self._opened_at = self.clock()
+                self.opens += 1
+                return True
+            return False
+
+    def release(self):
+        """请求被调用方中止、没有结果时，允许半开状态再放行一个试探请求。"""
+        with self._lock:
+            self._probing = False
+
+
+class RetryingBackend(WrappingBackend):
+    """
+    自动重试和熔断的后端包装。
+
+    backend             实际发出请求的后端；有 url 属性时按其Host区分熔断器
+    max_retries         每次调用最多重试几次（0 表示不重试，只保留熔断）
+    base_delay          指数退避的初始等待（秒）
+    max_delay           单次退避等待的上限（秒）
+    failure_threshold   熔断器连续失败多少次后断开
+    cooldown            熔断器断开的时间（秒）
+    """
+
+    def __init__(self, backend, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN, seed=None):
+        super().__init__(backend)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.breakers = {}  # Host -> CircuitBreaker
+        self.retry_stats = {'calls': 0, 'retries': 0, 'gave_up': 0, 'breaker_opens': 0, 'rejected': 0,
+                            'backoff_time': 0.0}
+        self._random = random.Random(seed)
+        self._stats_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # 熔断与统计
+    # ------------------------------------------------------------------
+    def host(self):
+        url = getattr(self.backend, 'url', None)
+        return (urlsplit(url).netloc if url else "") or type(self.backend).__name__
+
+    def breaker(self):
+        """当前Host的熔断器（修改 base_url 后使用另一个）。"""
+        host = self.host()
+        with self._stats_lock:
+            breaker = self.breakers.get(host)
+            if breaker is None:
+                breaker = self.breakers[host] = CircuitBreaker(self.failure_threshold, self.cooldown)
+            return breaker
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.retry_stats[name] += amount
+
+    def _admit(self, breaker):
+        """熔断期间立即失败。"""
+        if not breaker.allow():
+            self._count('rejected')
+            raise CircuitOpenError(f"{self.host()} 连续请求失败，已暂停请求，{breaker.retry_in():.0f} 秒后再试", 503)
+
+    def _after_failure(self, breaker, error, attempt, can_retry=True):
+        """处理一次失败，返回重试前要等待的秒数；不再重试时返回 None。已经产出内容的流式调用 can_retry 为假。"""
+        if not is_retryable(error):
+            breaker.record_success()  # 服务端正常响应了，只是请求本身有问题
+            return None
+        if breaker.record_failure():
+            self._count('breaker_opens')
+            print(f"{self.host()} 连续失败 {breaker.failures} 次，熔断 {self.cooldown:g} 秒")  # 调试信息
+        if not can_retry or attempt >= self.max_retries or breaker.state == OPEN:
+            self._count('gave_up')
+            return None
+        delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if error.retry_after:
+            delay = max(delay, min(self.max_delay, error.retry_after))
+        self._count('retries')
+        self._count('backoff_time', delay)
+        print(f"请求失败（{error.status_code or type(error).__name__}），{delay:.2f} 秒后第 {attempt + 1} 次重试")  # 调试信息
+        return delay
+
+    def retry_snapshot(self):
+        """供 /metrics 和调试信息使用的统计，含各Host熔断器的状态。"""
+        with self._stats_lock:
+            stats = dict(self.retry_stats)
+            breakers = dict(self.breakers)
+        stats['backoff_time'] = round(stats['backoff_time'], 3)
+        stats['breakers'] = {host: {'state': breaker.state, 'failures': breaker.failures, 'opens': breaker.opens}
+                             for host, breaker in breakers.items()}
+        return stats
+
+    def retry_summary(self):
+        stats = self.retry_snapshot()
+        states = "，".join(f"{host} {STATE_NAMES[b['state']]}" for host, b in stats['breakers'].items())
+        return (f"调用 {stats['calls']} 次，重试 {stats['retries']} 次（退避共 {stats['backoff_time']:.1f} 秒），"
+                f"放弃 {stats['gave_up']} 次，熔断 {stats['breaker_opens']} 次，熔断期间拒绝 {stats['rejected']} 次"
+                + (f"；{states}" if states else ""))
+
+    # ------------------------------------------------------------------
+    # 同步接口
+    # ------------------------------------------------------------------
+    def complete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        breaker = self.breaker()
+        self._count('calls')
+        attempt = 0
+        while True:
+            self._admit(breaker)
+            try:
+                result = self.backend.complete(model, system_prompt, user_prompt, max_tokens, top_p,
+                                               json_output=json_output, trace=trace)
+            except LLMError as e:
+                delay = self._after_failure(breaker, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    def stream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        breaker = self.breaker()
+        self._count('calls')
+        attempt = 0
+        while True:
+            self._admit(breaker)
+            produced = False
+            try:
+                for delta in self.backend.stream(model, system_prompt, user_prompt, max_tokens, top_p,
+                                                 json_output=json_output, trace=trace):
+                    produced = True
+                    yield delta
+            except LLMError as e:
+                delay = self._after_failure(breaker, e, attempt, can_retry=not produced)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return
+
+    # ------------------------------------------------------------------
+    # 异步接口（取消调用的任务会立即中止退避等待）
+    # ------------------------------------------------------------------
+    async def acomplete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        breaker = self.breaker()
+        self._count('calls')
+        attempt = 0
+        while True:
+            self._admit(breaker)
+            try:
+                result = await self.backend.acomplete(model, system_prompt, user_prompt, max_tokens, top_p,
+                                                      json_output=json_output, trace=trace)
+            except LLMError as e:
+                delay = self._after_failure(breaker, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    async def astream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        breaker = self.breaker()
+        self._count('calls')
+        attempt = 0
+        while True:
+            self._admit(breaker)
+            produced = False
+            stream = self.backend.astream(model, system_prompt, user_prompt, max_tokens, top_p,
+                                          json_output=json_output, trace=trace)
+            try:
+                async for delta in stream:
+                    produced = True
+                    yield delta
+            except LLMError as e:
+                delay = self._after_failure(breaker, e, attempt, can_retry=not produced)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            finally:
+                await stream.aclose()
+            breaker.record_success()
+            return
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分支预生成：玩家阅读当前情节时，在后台为四个选项提前生成后续内容。
+"""
+
+import threading
+
+from cancellation import CancelToken, GenerationCancelled
+
+
+class SpeculativeBranch:
+    """一个选项对应的预生成任务。"""
+
+    PENDING = "pending"      # 等待并发名额
+    RUNNING = "running"      # 正在请求API
+    DONE = "done"            # 已生成完成
+    FAILED = "failed"        # 请求失败
+    CANCELLED = "cancelled"  # 已取消（未开始即被丢弃，或生成中被中止）
+
+    def __init__(self, option, system_prompt, user_prompt):
+        self.option = option
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.status = self.PENDING
+        self.text = None
+        self.error = None
+        self.tokens = 0
+        self.discarded = False  # 玩家选择了其他分支，结果将被丢弃
+        self.cancel_token = CancelToken()  # 丢弃时中止进行中的请求
+        self.finished = threading.Event()
+
+    def is_done(self):
+        return self.status == self.DONE
+
+
+class SpeculativeBranchPool:
+    """
+    管理一轮选项的预生成任务。
+
+    generate_fn(system_prompt, user_prompt, cancel_token) 需要返回 (文本, 消耗token数)，
+    cancel_token 被取消时应中止请求并抛出 GenerationCancelled；max_concurrency 限制同时进行的请求数量。
+    """
+
+    def __init__(self, generate_fn, max_concurrency=2):
+        self.generate_fn = generate_fn
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self.lock = threading.Lock()
+        self.branches = {}
+        self.stats = {
+            'rounds': 0,          # 启动的预生成轮数
+            'launched': 0,        # 实际发出的请求数
+            'hits': 0,            # 选择时分支已完成
+            'partial_hits': 0,    # 选择时分支仍在生成，沿用该请求
+            'misses': 0,          # 分支未开始或失败，需要重新生成
+            'cancelled': 0,       # 未发出即被取消的请求数
+            'aborted': 0,         # 生成中被中止的请求数
+            'used_tokens': 0,     # 被玩家采用的分支消耗的token
+            'wasted_tokens': 0,   # 被丢弃的分支消耗的token
+        }
+
+    def start_round(self, branch_prompts):
+        """
+        开始新一轮预生成。branch_prompts 为 [(选项, system_prompt, user_prompt), ...]。
+        上一轮尚未使用的分支会被全部丢弃。
+        """
+        self.discard_all()
+        with self.lock:
+            self.stats['rounds'] += 1
+            self.branches = {}
+            for option, system_prompt, user_prompt in branch_prompts:
+                self.branches[option] = SpeculativeBranch(option, system_prompt, user_prompt)
+            branches = list(self.branches.values())
+
+        for branch in branches:
+            threading.Thread(target=self._run_branch, args=(branch,), daemon=True).start()
+
+    def _run_branch(self, branch):
+        """在后台线程中生成一个分支，受并发上限约束。"""
+        with self.semaphore:
+            with self.lock:
+                if branch.discarded:
+                    branch.status = SpeculativeBranch.CANCELLED
+                    self.stats['cancelled'] += 1
+                    branch.finished.set()
+                    return
+                branch.status = SpeculativeBranch.RUNNING
+                self.stats['launched'] += 1
+
+            try:
+                text, tokens = self.generate_fn(branch.system_prompt, branch.user_prompt, branch.cancel_token)
+                status = SpeculativeBranch.DONE
+                error = None
+            except GenerationCancelled as e:
+                text, tokens = None, 0
+                status = SpeculativeBranch.CANCELLED
+                error = str(e)
+            except Exception as e:
+                text, tokens = None, 0
+                status = SpeculativeBranch.FAILED
+                error = str(e)
+
+        with self.lock:
+            branch.text = text
+            branch.tokens = tokens
+            branch.error = error
+            branch.status = status
+            if status == SpeculativeBranch.CANCELLED:
+                self.stats['aborted'] += 1
+            elif branch.discarded:
+                self.stats['wasted_tokens'] += tokens
+            branch.finished.set()
+
+    def claim(self, option):
+        """
+        玩家选择了 option：返回对应的分支（可能已完成或仍在生成），
+        若分支不可用则返回 None，由调用方走正常生成流程。其余分支全部丢弃。
+        """
+        with self.lock:
+            branch = self.branches.pop(option, None)
+            if branch is not None and branch.status in (SpeculativeBranch.DONE, SpeculativeBranch.RUNNING):
+                if branch.status == SpeculativeBranch.DONE:
+                    self.stats['hits'] += 1
+                else:
+                    self.stats['partial_hits'] += 1
+            else:
+                if branch is not None:
+                    # 还在排队的分支直接取消，避免与正常请求重复
+                    branch.discarded = True
+                self.stats['misses'] += 1
+                branch = None
+
+        self.discard_all()
+        if branch is not None:
+            threading.Thread(target=self._account_used, args=(branch,), daemon=True).start()
+        return branch
+
+    def _account_used(self, branch):
+        """分支完成后把它消耗的token记为有效消耗。"""
+        branch.finished.wait()
+        with self.lock:
+            self.stats['used_tokens'] += branch.tokens
+
+    def discard_all(self):
+        """丢弃当前轮所有未被采用的分支：排队中的不再发出，生成中的请求被中止。"""
+        with self.lock:
+            running = []
+            for branch in self.branches.values():
+                if branch.discarded:
+                    continue
+                branch.discarded = True
+                if branch.status in (SpeculativeBranch.DONE, SpeculativeBranch.FAILED):
+                    self.stats['wasted_tokens'] += branch.tokens
+                elif branch.status == SpeculativeBranch.RUNNING:
+                    running.append(branch)
+            self.branches = {}
+        for branch in running:
+            branch.cancel_token.cancel()
+
+    def hit_rate(self):
+        """命中率：选择时分支已完成或正在生成的比例。"""
+        with self.lock:
+            total = self.stats['hits'] + self.stats['partial_hits'] + self.stats['misses']
+            if total == 0:
+                return 0.0
+            return (self.stats['hits'] + self.stats['partial_hits']) / total
+
+    def summary(self):
+        """返回便于打印的统计信息。"""
+        hit_rate = self.hit_rate()
+        with self.lock:
+            stats = dict(self.stats)
+        return (f"预生成命中率: {hit_rate:.0%}（完成命中{stats['hits']}，生成中命中{stats['partial_hits']}，未命中{stats['misses']}），"
+                f"有效token: {stats['used_tokens']}，浪费token: {stats['wasted_tokens']}，中止请求: {stats['aborted']}")
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回合日志的全文索引（SQLite）：在历史上所有局的故事里查找段落。
+
+回合日志（turn_journal.py）就是各局的存档：每条 start 记录是一局（局的编号为该记录在日志中的偏移），
+每条记录（故事背景、玩家的选择和这一轮的情节）是一篇文档（编号为记录的偏移）。
+中文没有空格分词，索引按单字和相邻两字（字符n-gram）建立倒排表，查询时先用倒排表求交集得到候选，
+再按偏移从内存映射（mmap）的日志中只读出候选记录，核对短语确实连续出现，不需要把整局读入内存。
+
+日志只追加，索引记录已处理到的字节偏移，update() 只处理新增的部分；
+把 update 加入 TurnJournal.listeners 后，每轮的记录写入磁盘时索引随之更新。
+"""
+
+import argparse
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from turn_journal import DEFAULT_JOURNAL_PATH, START, TURN, parse_line
+
+DEFAULT_INDEX_PATH = "story_index.sqlite3"
+SNIPPET_CHARS = 30  # 搜索结果中命中位置前后各显示的字数
+TITLE_CHARS = 20
+
+
+def normalize(text):
+    """统一全角/半角和大小写，索引和查询使用同一种形式。"""
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def ngrams(text):
+    """text（已 normalize）中的单字和相邻两字，跳过空白。"""
+    grams = set()
+    previous = None
+    for char in text:
+        if char.isspace():
+            previous = None
+            continue
+        grams.add(char)
+        if previous is not None:
+            grams.add(previous + char)
+        previous = char
+    return grams
+
+
+def query_grams(term):
+    """核对前先要求全部出现的n-gram：一个字时用单字，否则用相邻两字。"""
+    grams = {gram for gram in ngrams(term) if len(gram) == 2}
+    return grams or ngrams(term)
+
+
+def parse_query(query):
+    """
+    拆分查询：用双引号括起的部分是一个短语（可以包含空格），其余部分按空格拆成多个词，
+    全部出现的文档才算命中，每个词都要连续出现。
+    """
+    terms = []
+    for index, part in enumerate(query.split('"')):
+        if index % 2:
+            part = part.strip()
+            if part:
+                terms.append(normalize(part))
+        else:
+            terms.extend(normalize(word) for word in part.split())
+    return terms
+
+
+def record_text(record):
+    """一条日志记录中可以被搜索的文字：故事背景，或玩家的选择和这一轮的情节（无法解析时为原始输出）。"""
+    if record.get('type') == START:
+        return record.get('background') or ""
+    choice = record.get('choice') or ""
+    story = record.get('story') if record.get('ok') else record.get('raw')
+    return f"{choice}\n{story or ''}" if choice else (story or "")
+
+
+class SearchHit:
+    """一条搜索结果。"""
+
+    def __init__(self, session, doc, turn, title, snippet):
+        self.session = session  # 所在的局（start 记录在日志中的偏移）
+        self.doc = doc          # 记录在日志中的偏移
+        self.turn = turn        # 第几轮，故事背景为 0
+        self.title = title      # 这一局故事背景的开头
+        self.snippet = snippet  # 命中位置附近的文字
+
+
+class StoryIndex:
+    """
+    回合日志的全文索引。
+
+    journal_path   回合日志（turn_journal.TurnJournal 写入的文件）
+    path           索引文件
+    """
+
+    def __init__(self, journal_path, path=DEFAULT_INDEX_PATH):
+        self.journal_path = journal_path
+        self.path = path
+        self.local = threading.local()  # sqlite3 连接不能跨线程使用，每个线程各自建立连接
+        self.update_lock = threading.Lock()  # 同时只有一个线程更新索引
+        self.last_search_time = None  # 最近一次搜索的耗时（秒）
+        self.last_candidates = 0  # 最近一次搜索倒排表求交后需要核对的记录数
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout = 30000")
+            self.local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode = WAL")
+        # 主键按 (gram, session, doc) 聚集存放，同一个n-gram的倒排表连续，按局过滤只扫描其中一段
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                gram TEXT NOT NULL,
+                session INTEGER NOT NULL,
+                doc INTEGER NOT NULL,
+                PRIMARY KEY (gram, session, doc)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc INTEGER PRIMARY KEY,
+                session INTEGER NOT NULL,
+                turn INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session INTEGER PRIMARY KEY,
+                started_at REAL,
+                title TEXT NOT NULL,
+                turns INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO meta(name, value) VALUES ('indexed_upto', 0)")
+
+    # ------------------------------------------------------------------
+    # 更新
+    # ------------------------------------------------------------------
+    def update(self):
+        """索引日志中新增的完整记录，返回处理的记录数。写了一半的最后一行留到下次。"""
+        with self.update_lock:
+            if not os.path.exists(self.journal_path):
+                return 0
+            size = os.path.getsize(self.journal_path)
+            conn = self._connect()
+            upto = conn.execute("SELECT value FROM meta WHERE name = 'indexed_upto'").fetchone()[0]
+            if size < upto:
+                # 日志被删除后重新开始记录，旧索引作废
+                self._clear(conn)
+                upto = 0
+            if size == upto:
+                return 0
+
+            count = 0
+            with open(self.journal_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    position = upto
+                    while position < size:
+                        end = mm.find(b"\n", position, size)
+                        if end == -1:
+                            break
+                        record = parse_line(mm[position:end])
+                        if record is not None and self._index_record(conn, position, record):
+                            count += 1
+                        position = end + 1
+                    conn.execute("UPDATE meta SET value = ? WHERE name = 'indexed_upto'", (position,))
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            return count
+
+    def _index_record(self, conn, offset, record):
+        if record.get('type') == START:
+            session, turn = offset, 0
+            title = " ".join((record.get('background') or "").replace("## 故事背景", "").split())[:TITLE_CHARS]
+            conn.execute("INSERT OR REPLACE INTO sessions(session, started_at, title, turns) VALUES (?, ?, ?, 0)",
+                         (session, record.get('time'), title))
+        elif record.get('type') == TURN and record.get('start_offset') is not None:
+            session, turn = record['start_offset'], record.get('turn', 0)
+            conn.execute("UPDATE sessions SET turns = MAX(turns, ?) WHERE session = ?", (turn, session))
+        else:
+            return False
+        conn.execute("INSERT OR REPLACE INTO docs(doc, session, turn) VALUES (?, ?, ?)", (offset, session, turn))
+        conn.executemany("INSERT OR IGNORE INTO postings(gram, session, doc) VALUES (?, ?, ?)",
+                         [(gram, session, offset) for gram in ngrams(normalize(record_text(record)))])
+        return True
+
+    def _clear(self, conn):
+        for table in ("postings", "docs", "sessions"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute("UPDATE meta SET value = 0 WHERE name = 'indexed_upto'")
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    def search(self, query, session=None, limit=20):
+        """
+        查找全部词（或双引号括起的短语）都连续出现的记录，最新的在前，最多 limit 条。
+        session 为局的编号（start 记录的偏移，即 TurnJournal.start_offset）时只在这一局中查找。
+        """
+        start_time = time.perf_counter()
+        terms = parse_query(query)
+        hits = []
+        candidates = self._candidates(terms, session) if terms else []
+        self.last_candidates = len(candidates)
+        if candidates:
+            conn = self._connect()
+            with open(self.journal_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for doc in sorted(candidates, reverse=True):
+                    end = mm.find(b"\n", doc)
+                    record = parse_line(mm[doc:end if end != -1 else len(mm)])
+                    if record is None:
+                        continue
+                    text = normalize(record_text(record))
+                    positions = [text.find(term) for term in terms]
+                    if min(positions) < 0:
+                        continue
+                    doc_session, turn, title = conn.execute(
+                        "SELECT docs.session, docs.turn, COALESCE(sessions.title, '') FROM docs "
+                        "LEFT JOIN sessions USING (session) WHERE doc = ?",
+                        (doc,)).fetchone()
+                    hits.append(SearchHit(doc_session, doc, turn, title, _snippet(text, positions[0], len(terms[0]))))
+                    if len(hits) >= limit:
+                        break
+        self.last_search_time = time.perf_counter() - start_time
+        return hits
+
+    def _candidates(self, terms, session):
+        """倒排表求交：返回包含全部查询n-gram的记录偏移。"""
+        conn = self._connect()
+        grams = set()
+        for term in terms:
+            grams |= query_grams(term)
+        if not grams:
+            return []
+        result = None
+        for gram in grams:
+            if session is None:
+                rows = conn.execute("SELECT doc FROM postings WHERE gram = ?", (gram,))
+            else:
+                rows = conn.execute("SELECT doc FROM postings WHERE gram = ? AND session = ?", (gram, session))
+            docs = {row[0] for row in rows}
+            result = docs if result is None else result & docs
+            if not result:
+                return []
+        return result
+
+    def sessions(self):
+        """已索引的各局：[(编号, 开始时间, 故事背景开头, 轮数)]，最新的在前。"""
+        return self._connect().execute(
+            "SELECT session, started_at, title, turns FROM sessions ORDER BY session DESC").fetchall()
+
+    def stats(self):
+        conn = self._connect()
+        return {
+            'sessions': conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+            'docs': conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0],
+            'postings': conn.execute("SELECT COUNT(*) FROM postings").fetchone()[0],
+            'indexed_bytes': conn.execute("SELECT value FROM meta WHERE name = 'indexed_upto'").fetchone()[0],
+        }
+
+    def summary(self):
+        """返回便于打印的统计信息。"""
+        stats = self.stats()
+        text = (f"全文索引: {stats['sessions']}局，{stats['docs']}条记录，{stats['postings']}个倒排项，"
+                f"已索引日志{stats['indexed_bytes'] / 1024:.0f}KB")
+        if self.last_search_time is not None:
+            text += f"，最近一次搜索{self.last_search_time * 1000:.1f}ms（核对{self.last_candidates}条）"
+        return text
+
+
+def _snippet(text, position, length):
+    start = max(0, position - SNIPPET_CHARS)
+    end = min(len(text), position + length + SNIPPET_CHARS)
+    snippet = " ".join(text[start:end].split())
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在回合日志记录的历史各局中搜索")
+    parser.add_argument('query', nargs='?', help="搜索的词，用双引号括起的部分作为一个短语；省略时列出各局")
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL_PATH, help="回合日志文件")
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help="索引文件")
+    parser.add_argument('--session', type=int, default=None, help="只在这一局中查找（局的编号见不带查询词时的列表）")
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    index = StoryIndex(args.journal, args.index)
+    print(f"新索引{index.update()}条记录")
+    if not args.query:
+        for session, started_at, title, turns in index.sessions():
+            started = time.strftime('%Y-%m-%d %H:%M', time.localtime(started_at)) if started_at else "-"
+            print(f"{session:>12}  {started}  {turns:>4}轮  {title}")
+        return
+    for hit in index.search(args.query, session=args.session, limit=args.limit):
+        print(f"[{hit.session} {hit.title} · 第{hit.turn}轮] {hit.snippet}")
+    print(index.summary())
+
+
+if __name__ == "__main__":
+    main()
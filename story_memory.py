@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+滚动摘要记忆：最近N段情节原文保留，更早的情节在后台折叠进一份不断更新的前情提要，
+使每轮发送给AI的提示词长度保持稳定。
+所有实例共用一个线程池折叠摘要，多会话服务中空闲的会话不占用线程。
+"""
+
+import concurrent.futures
+import threading
+
+SUMMARY_WORKERS = 4  # 共用线程池的大小；摘要不阻塞提示词构造，排队只会让摘要晚一些更新
+
+_shared_executor = None
+_shared_lock = threading.Lock()
+
+
+def shared_executor():
+    """进程内共用的摘要线程池。"""
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = concurrent.futures.ThreadPoolExecutor(SUMMARY_WORKERS, thread_name_prefix="summary")
+        return _shared_executor
+
+
+def local_summarize(previous_summary, new_text, max_chars):
+    """
+    不调用AI的本地摘要：保留每段的开头句子，超出上限时优先保留较新的内容。
+    作为AI摘要失败时的兜底，也用于离线测试。
+    """
+    pieces = [previous_summary] if previous_summary else []
+    for paragraph in new_text.split('\n'):
+        paragraph = paragraph.strip().replace('**', '').replace('*', '').replace('#', '')
+        if not paragraph or paragraph == '---':
+            continue
+        # 每段只保留第一句
+        for sep in ('。', '！', '？', '.', '!', '?'):
+            idx = paragraph.find(sep)
+            if idx != -1:
+                paragraph = paragraph[:idx + 1]
+                break
+        pieces.append(paragraph[:120])
+    summary = ''.join(pieces)
+    if len(summary) > max_chars:
+        summary = summary[-max_chars:]
+    return summary
+
+
+class RollingSummaryMemory:
+    """
+    故事记忆。background 始终完整保留；最近 keep_recent 段保留原文；
+    更早的段由 summarize_fn(旧摘要, 新内容, 字数上限) 在线程池中折叠进摘要（executor 默认为 shared_executor()），
+    同一实例同时最多有一个折叠任务。render() 只读取当前状态，从不等待摘要完成，结果不超过 max_prompt_chars。
+    """
+
+    def __init__(self, keep_recent=6, max_prompt_chars=6000, summary_max_chars=1500, summarize_fn=None, executor=None):
+        self.keep_recent = max(1, int(keep_recent))
+        self.max_prompt_chars = int(max_prompt_chars)
+        self.summary_max_chars = int(summary_max_chars)
+        self.summarize_fn = summarize_fn or local_summarize
+
+        self.background = ""
+        self.summary = ""
+        self.recent = []    # 保留原文的最近情节
+        self.pending = []   # 等待折叠进摘要的情节
+        self.generation = 0  # reset() 后递增，丢弃旧任务的结果
+
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.folding = False  # 是否已有折叠任务在线程池中
+        self.closed = False
+
+    def reset(self, background=""):
+        """开始新游戏时清空记忆。"""
+        with self.lock:
+            self.generation += 1
+            self.background = background
+            self.summary = ""
+            self.recent = []
+            self.pending = []
+
+    def checkpoint(self):
+        """当前记忆的快照（不含背景），用于写入回合日志，可直接转换为JSON。"""
+        with self.lock:
+            return {'summary': self.summary, 'pending': list(self.pending), 'recent': list(self.recent)}
+
+    def restore(self, background, checkpoint):
+        """从 checkpoint() 的快照恢复记忆；尚未折叠的情节重新交给线程池。"""
+        self.reset(background)
+        with self.lock:
+            self.summary = checkpoint.get('summary', "")
+            self.pending = list(checkpoint.get('pending', []))
+            self.recent = list(checkpoint.get('recent', []))
+            self._schedule_fold()
+
+    def add_segment(self, text):
+        """追加一段情节（玩家选择或AI生成的故事）。"""
+        if not text:
+            return
+        with self.lock:
+            self.recent.append(text)
+            if len(self.recent) > self.keep_recent:
+                overflow = len(self.recent) - self.keep_recent
+                self.pending.extend(self.recent[:overflow])
+                del self.recent[:overflow]
+                self._schedule_fold()
+
+    def close(self):
+        """停止折叠摘要（会话结束时调用）；进行中的任务结束后丢弃结果。"""
+        with self.lock:
+            self.closed = True
+            self.generation += 1
+            self.pending = []
+            self.idle.set()
+
+    def _schedule_fold(self):
+        """（持有锁时调用）有待折叠的情节且没有进行中的任务时，向线程池提交一个。"""
+        if self.closed or self.folding or not self.pending:
+            return
+        self.folding = True
+        self.idle.clear()
+        try:
+            (self.executor or shared_executor()).submit(self._fold)
+        except RuntimeError:  # 线程池已关闭（解释器退出时）
+            self.folding = False
+            self.idle.set()
+
+    def _fold(self):
+        """线程池任务：把 pending 中的情节折叠进摘要，直到没有新的情节。"""
+        while True:
+            with self.lock:
+                if self.closed or not self.pending:
+                    self.folding = False
+                    self.idle.set()
+                    return
+                batch = list(self.pending)
+                previous_summary = self.summary
+                generation = self.generation
+
+            new_text = '\n'.join(batch)
+            try:
+                summary = self.summarize_fn(previous_summary, new_text, self.summary_max_chars)
+            except Exception as e:
+                print(f"生成摘要失败，改用本地摘要: {e}")  # 调试信息
+                summary = local_summarize(previous_summary, new_text, self.summary_max_chars)
+            summary = (summary or "")[-self.summary_max_chars:]
+
+            with self.lock:
+                if generation != self.generation:
+                    continue
+                self.summary = summary
+                # 折叠期间可能有新的情节进入 pending，只移除已处理的部分
+                del self.pending[:len(batch)]
+
+    def wait_idle(self, timeout=None):
+        """等待后台摘要全部完成（供测试和基准使用，游戏流程中不需要调用）。"""
+        return self.idle.wait(timeout)
+
+    def render(self):
+        """生成用于提示词的故事上下文。"""
+        with self.lock:
+            background = self.background
+            summary = self.summary
+            pending = list(self.pending)
+            recent = list(self.recent)
+
+        parts = []
+        if summary:
+            parts.append(f"## 前情提要\n\n{summary}\n\n")
+        if pending:
+            # 尚未折叠的旧情节先按原文附上，超出上限时会在下面被截断
+            parts.append(''.join(pending))
+        head = background
+        tail = ''.join(recent)
+        middle = ''.join(parts)
+
+        budget = self.max_prompt_chars - len(head) - len(tail)
+        if budget < len(middle):
+            # 优先保留靠后的内容
+            middle = middle[-budget:] if budget > 0 else ""
+        context = head + middle + tail
+        if len(context) > self.max_prompt_chars:
+            # 最近情节本身已超出上限时，只保留其末尾
+            keep = max(0, self.max_prompt_chars - len(head))
+            context = head + tail[len(tail) - keep:]
+        return context
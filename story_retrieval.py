@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索增强的故事记忆：滚动摘要会把早期情节压缩得只剩梗概，人物、物品和伏笔的细节容易丢失。
+这里把每段情节切成短片段建立本地向量索引，每轮构造提示词前按玩家的选择取回最相关的几段原文放进提示词。
+
+向量化只依赖 NumPy：片段中的相邻两字、三字（字符n-gram）哈希到 DIM 维的稀疏特征，
+片段向量为对数词频并归一化，IDF 在查询时按当前文档频率计算，新增片段不需要重算已有向量。
+稀疏矩阵按特征编号排序存放（相当于倒排表），查询只取出查询中各特征对应的区间，用 bincount 一次累加出
+全部片段的得分，几万个片段时一次检索也只需几毫秒。新增片段先放在很小的未排序尾部，满了以后排序成一段，
+大小相近的段再两两合并，段数与片段数成对数关系；出现在大多数片段中的特征（相当于停用词）查询时跳过。
+"""
+
+import re
+import threading
+import time
+
+import numpy as np
+
+DIM = 1 << 20  # 哈希特征的维数
+NGRAM_SIZES = (2, 3)
+CHUNK_CHARS = 200  # 每个片段的最大字数，按句子切分后合并
+TOP_K = 3
+MIN_SCORE = 0.1  # 低于该相似度的片段不放进提示词
+TAIL_SIZE = 1 << 15  # 未排序尾部积累到这么多个非零项时排序成一段
+MAX_DF_RATIO = 0.5  # 出现在超过这个比例的片段中的特征查询时跳过
+
+_IGNORED = re.compile(r'[\s*#>`_\-—…]+')  # 空白和Markdown标记不参与向量化
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;\n])')
+_PRIME = np.uint64(1000003)
+_MIX = np.uint64(0xBF58476D1CE4E5B9)
+
+
+def split_chunks(text, max_chars=CHUNK_CHARS):
+    """按句子切分后合并成不超过 max_chars 字的片段，单句过长时直接截断成几段。"""
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        while len(sentence) > max_chars:
+            chunks.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        current += sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def hash_ngrams(text, sizes=NGRAM_SIZES, dim=DIM):
+    """返回 text 中字符n-gram的 (特征编号, 出现次数)，按特征编号升序；哈希整体用 NumPy 向量化计算。"""
+    text = _IGNORED.sub('', text).lower()
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    parts = []
+    for n in sizes:
+        count = len(codes) - n + 1
+        if count <= 0:
+            continue
+        hashes = np.full(count, n, dtype=np.uint64)  # 以 n 为初值，不同长度的n-gram哈希不同
+        for offset in range(n):
+            hashes = hashes * _PRIME + codes[offset:offset + count]
+        hashes ^= hashes >> np.uint64(29)
+        hashes *= _MIX
+        hashes ^= hashes >> np.uint64(32)
+        parts.append(hashes & np.uint64(dim - 1))
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    features, counts = np.unique(np.concatenate(parts), return_counts=True)
+    return features.astype(np.int64), counts
+
+
+class StoryRetriever:
+    """
+    故事片段的向量索引。
+
+    add_segment(text) 追加一段情节（与 RollingSummaryMemory.add_segment 一一对应，不需要检索的段用 skip_segment()），
+    返回该段的序号；
+    search(query, k, before_segment) 返回 [(相似度, 片段原文, 段序号)]，只在序号小于 before_segment 的段中查找，
+    用于排除仍以原文留在提示词中的最近几段。
+    """
+
+    def __init__(self, dim=DIM, chunk_chars=CHUNK_CHARS, tail_size=TAIL_SIZE):
+        self.dim = dim
+        self.chunk_chars = chunk_chars
+        self.tail_size = tail_size
+        self.lock = threading.Lock()  # 预生成分支和正式请求可能在不同线程中构造提示词
+        self.last_search_time = None  # 最近一次检索的耗时（秒）
+        self.reset()
+
+    def reset(self):
+        """开始新游戏时清空索引。"""
+        with self.lock:
+            self.df = np.zeros(self.dim, dtype=np.int32)  # 各特征出现在多少个片段中
+            self.chunks = []
+            self.chunk_segments = []
+            self.segments = 0
+            # 已按特征编号排序的各段非零项 [(特征编号, 片段编号, 权重)]，从大到小
+            self._runs = []
+            # 尚未排序的非零项，格式相同
+            self._tail = []
+            self._tail_entries = 0
+            self._segment_array = np.empty(0, dtype=np.int32)
+
+    def add_segment(self, text):
+        """追加一段情节；空文本不计入段序号，返回 None。"""
+        if not text:
+            return None
+        with self.lock:
+            segment = self.segments
+            self.segments += 1
+            for chunk in split_chunks(text, self.chunk_chars):
+                self._add_chunk(chunk, segment)
+            return segment
+
+    def skip_segment(self):
+        """占用一个段序号但不建立索引（玩家的选择：原文很短，又带有相同的格式文字，只会互相匹配）。"""
+        with self.lock:
+            self.segments += 1
+            return self.segments - 1
+
+    def _add_chunk(self, chunk, segment):
+        features, counts = hash_ngrams(chunk, dim=self.dim)
+        if not len(features):
+            return
+        weights = 1.0 + np.log(counts)
+        weights /= np.linalg.norm(weights)
+        doc = len(self.chunks)
+        self.chunks.append(chunk)
+        self.chunk_segments.append(segment)
+        self.df[features] += 1
+        self._tail.append((features, np.full(len(features), doc, dtype=np.int32), weights.astype(np.float32)))
+        self._tail_entries += len(features)
+        if self._tail_entries >= self.tail_size:
+            self._runs.append(_sorted_run(self._tail))
+            self._tail = []
+            self._tail_entries = 0
+            # 最后一段不小于前一段的一半时合并，各段大小按2的幂递减
+            while len(self._runs) > 1 and 2 * len(self._runs[-1][0]) >= len(self._runs[-2][0]):
+                self._runs[-2:] = [_sorted_run(self._runs[-2:])]
+
+    def search(self, query, k=TOP_K, before_segment=None, min_score=MIN_SCORE):
+        """返回与 query 最相关的至多 k 个片段 [(相似度, 片段原文, 段序号)]，相似度从高到低。"""
+        start_time = time.perf_counter()
+        with self.lock:
+            results = self._search(query, k, before_segment, min_score)
+        self.last_search_time = time.perf_counter() - start_time
+        return results
+
+    def _search(self, query, k, before_segment, min_score):
+        n = len(self.chunks)
+        features, counts = hash_ngrams(query, dim=self.dim)
+        if not n or not len(features) or k <= 0:
+            return []
+        df = self.df[features]
+        known = df > 0
+        features, counts, df = features[known], counts[known], df[known]
+        if not len(features):
+            return []
+        common = df > n * MAX_DF_RATIO
+        if common.any() and not common.all():
+            features, counts, df = features[~common], counts[~common], df[~common]
+        # 查询向量：对数词频 × IDF，归一化后与片段向量（对数词频，已归一化）做点积
+        query_weights = (1.0 + np.log(counts)) * (np.log((n + 1) / (df + 1)) + 1.0)
+        query_weights /= np.linalg.norm(query_weights)
+
+        docs = []
+        contributions = []
+        # 已排序的各段：每个查询特征对应一段连续区间，拼接出全部下标
+        for run_features, run_docs, run_weights in self._runs:
+            lo = np.searchsorted(run_features, features, 'left')
+            hi = np.searchsorted(run_features, features, 'right')
+            lengths = hi - lo
+            total = int(lengths.sum())
+            if total:
+                index = np.repeat(lo - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+                docs.append(run_docs[index])
+                contributions.append(run_weights[index] * np.repeat(query_weights, lengths))
+        # 尚未排序的尾部：直接筛出查询中出现的特征
+        if self._tail:
+            if len(self._tail) > 1:
+                self._tail = [tuple(np.concatenate([part[i] for part in self._tail]) for i in range(3))]
+            tail_features, tail_docs, tail_weights = self._tail[0]
+            mask = np.isin(tail_features, features)
+            if mask.any():
+                docs.append(tail_docs[mask])
+                contributions.append(tail_weights[mask] * query_weights[np.searchsorted(features, tail_features[mask])])
+        if not docs:
+            return []
+        scores = np.bincount(np.concatenate(docs), weights=np.concatenate(contributions), minlength=n)
+
+        if before_segment is not None:
+            if len(self._segment_array) != n:
+                self._segment_array = np.asarray(self.chunk_segments, dtype=np.int32)
+            scores[self._segment_array >= before_segment] = 0.0
+        candidates = np.flatnonzero(scores >= min_score)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(float(scores[doc]), self.chunks[doc], self.chunk_segments[doc]) for doc in candidates]
+
+    def nonzero(self):
+        """稀疏矩阵的非零项数。"""
+        return sum(len(run[0]) for run in self._runs) + self._tail_entries
+
+    def summary(self):
+        """返回便于打印的统计信息。"""
+        text = f"检索索引: {self.segments}段，{len(self.chunks)}个片段，{self.nonzero()}个非零项（{len(self._runs)}个已排序段）"
+        if self.last_search_time is not None:
+            text += f"，最近一次检索{self.last_search_time * 1000:.2f}ms"
+        return text
+
+
+def _sorted_run(parts):
+    """把若干组 (特征编号, 片段编号, 权重) 合并成按特征编号排序的一段。"""
+    features, docs, weights = (np.concatenate([part[i] for part in parts]) for i in range(3))
+    order = np.argsort(features, kind='stable')
+    return features[order], docs[order], weights[order]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按段存储的故事内容：故事背景、AI生成的情节、玩家选择、系统警告各为一段，
+追加为O(1)，提示词文本和显示文本都按段惰性生成，不需要拼接出一个完整的大字符串。
+"""
+
+
+class StorySegment:
+    """故事中的一段。"""
+
+    BACKGROUND = "background"  # 故事背景、类型、选项风格
+    STORY = "story"            # AI生成的情节
+    CHOICE = "choice"          # 玩家的选择
+    WARNING = "warning"        # 系统警告（如AI响应无法解析时的原始输出）
+
+    __slots__ = ("kind", "text")
+
+    def __init__(self, kind, text):
+        self.kind = kind
+        self.text = text
+
+    def display_text(self):
+        """移除Markdown标记后用于界面显示的文本。"""
+        return to_display_text(self.text)
+
+
+def to_display_text(text):
+    """移除Markdown标记，转换为适合ScrolledText显示的纯文本。"""
+    return text.replace('**', '').replace('*', '').replace('#', '').replace('---', '\n---\n')
+
+
+class StoryStore:
+    """故事内容的分段存储。"""
+
+    def __init__(self):
+        self.segments = []
+        self.char_count = 0
+
+    def reset(self, background=""):
+        """开始新游戏。"""
+        self.segments = []
+        self.char_count = 0
+        if background:
+            self.append(StorySegment.BACKGROUND, background)
+
+    def append(self, kind, text):
+        """追加一段内容，返回该段的序号。"""
+        self.segments.append(StorySegment(kind, text))
+        self.char_count += len(text)
+        return len(self.segments) - 1
+
+    def __len__(self):
+        return len(self.segments)
+
+    def iter_prompt_text(self, start=0):
+        """按段产出原始（Markdown）文本，拼接后即完整的故事历史。"""
+        for index in range(start, len(self.segments)):
+            yield self.segments[index].text
+
+    def iter_display_text(self, start=0):
+        """按段产出用于显示的纯文本。"""
+        for index in range(start, len(self.segments)):
+            yield self.segments[index].display_text()
+
+    def prompt_text(self):
+        """拼接出完整的原始文本（仅在确实需要整段字符串时使用）。"""
+        return "".join(self.iter_prompt_text())
+
+    def tail_text(self, max_chars):
+        """返回最后不超过 max_chars 个字符的原始文本，只拼接末尾用到的几段。"""
+        parts = []
+        remaining = max_chars
+        for segment in reversed(self.segments):
+            if remaining <= 0:
+                break
+            text = segment.text
+            if len(text) > remaining:
+                text = text[len(text) - remaining:]
+            parts.append(text)
+            remaining -= len(text)
+        return "".join(reversed(parts))
+
+    def background_text(self):
+        """故事背景段的文本。"""
+        for segment in self.segments:
+            if segment.kind == StorySegment.BACKGROUND:
+                return segment.text
+        return ""
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试本机 DashScope 替身服务：两种返回格式、流式输出和故障注入
+"""
+
+import asyncio
+
+import dashscope
+from dashscope import Generation
+
+from async_dashscope import AsyncDashScopeBackend
+from fake_dashscope_server import FakeDashScopeServer
+from llm_backend import LLMError, extract_text_payload
+from response_parser import parse_response, parse_text_response
+
+
+def run_with_server(func, **options):
+    server = FakeDashScopeServer(**options)
+    base_url = server.start()
+    try:
+        return func(server, base_url)
+    finally:
+        server.stop()
+
+
+def test_sdk_result_formats():
+    def check(server, base_url):
+        dashscope.base_http_api_url = f"{base_url}/api/v1"
+        for result_format in ('message', 'text'):
+            response = Generation.call(model="qwen-turbo", api_key="test-key", result_format=result_format,
+                                       messages=[{"role": "user", "content": "开始"}])
+            assert response.status_code == 200
+            story, options = parse_text_response(extract_text_payload(response))
+            assert story and len(options) == 4
+    try:
+        run_with_server(check)
+    finally:
+        dashscope.base_http_api_url = "https://dashscope.aliyuncs.com/api/v1"
+
+
+def test_async_stream():
+    async def collect(base_url):
+        backend = AsyncDashScopeBackend("test-key", base_url)
+        try:
+            return [delta async for delta in backend.astream("qwen-turbo", "系统", "用户", 512)]
+        finally:
+            await backend.aclose()
+
+    chunks = run_with_server(lambda server, base_url: asyncio.run(collect(base_url)), chunk_tokens=16)
+    assert len(chunks) > 1
+    assert len(parse_text_response("".join(chunks))[1]) == 4
+
+
+def test_json_output():
+    def call(server, base_url):
+        backend = AsyncDashScopeBackend("test-key", base_url)
+        try:
+            return backend.complete("qwen-turbo", "系统", "用户", 512, json_output=True).text
+        finally:
+            backend.close()
+
+    story, options, strategy = parse_response(run_with_server(call), json_output=True)
+    assert strategy == 'json' and story and len(options) == 4
+
+
+def test_warm_up_and_compression():
+    def check(server, base_url):
+        backend = AsyncDashScopeBackend("test-key", base_url, compress_threshold=256)
+        try:
+            assert backend.warm_up(2).result() == 2
+            trace = {}
+            text = backend.complete("qwen-turbo", "很长的系统提示词" * 100, "用户", 512, trace=trace).text
+            assert trace == {'reused': True, 'connect_time': 0.0}  # 第一次请求就复用了预热的连接
+            assert len(parse_text_response(text)[1]) == 4
+            stats = backend.connection_stats
+            assert stats['new'] == 2 and stats['reused'] == 1 and stats['compressed'] == 1 and stats['bytes_saved'] > 0
+        finally:
+            backend.close()
+    run_with_server(check)
+
+
+def test_fault_injection():
+    def call(base_url):
+        backend = AsyncDashScopeBackend("test-key", base_url)
+        try:
+            return backend.complete("qwen-turbo", "系统", "用户", 512).text
+        finally:
+            backend.close()
+
+    def rate_limited(server, base_url):
+        try:
+            call(base_url)
+            assert False, "应当返回429"
+        except LLMError as e:
+            assert e.status_code == 429
+        assert server.stats['rate_limited'] == 1
+    run_with_server(rate_limited, rate_429=1.0)
+
+    def malformed(server, base_url):
+        try:
+            parse_text_response(call(base_url))
+            assert False, "应当无法解析"
+        except ValueError:
+            pass
+    run_with_server(malformed, malformed_rate=1.0, seed=1)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试无界面的游戏引擎和多会话服务的会话管理
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import game_engine
+from cancellation import GenerationCancelled
+from game_engine import GameEngine
+from game_server import SessionStore
+from llm_backend import CallableBackend, LoopThreadBackend, LLMResult
+from model_router import ModelRouter, parse_routes
+from response_cache import LLMResponseCache
+
+RESPONSE = """你推开沉重的石门，潮湿的空气里混着铁锈的味道。
+
+### 行动选项
+
+**点燃火把**-照亮前方的走廊。
+
+**原路返回**-回到地面寻找同伴。
+
+**检查墙壁**-墙上似乎刻着文字。
+
+**大声呼喊**-看看是否有人回应。
+"""
+
+
+def make_engine(responses=None):
+    responses = list(responses or [])
+
+    def fn(model, system_prompt, user_prompt):
+        return responses.pop(0) if responses else RESPONSE
+
+    return GameEngine(CallableBackend(fn))
+
+
+def test_start_and_choose():
+    engine = make_engine()
+    result = engine.start("地下城探险", "qwen-turbo", "300-500")
+    assert result.ok
+    assert result.options[0] == "点燃火把-照亮前方的走廊。"
+    assert engine.paragraph_min_chars == 300
+
+    result = engine.choose(2)
+    assert result.ok
+    assert engine.last_player_choice == "原路返回-回到地面寻找同伴。"
+    assert engine.turn == 2
+    assert "我的选择是" in engine.story_store.prompt_text()
+    engine.close()
+
+
+def test_invalid_choice():
+    engine = make_engine()
+    engine.start("地下城探险")
+    for choice in (0, 5):
+        try:
+            engine.choose(choice)
+            assert False, "应当抛出 ValueError"
+        except ValueError:
+            pass
+    engine.close()
+
+
+def test_parse_failure_then_retry():
+    engine = make_engine(["这段响应没有任何选项"])
+    result = engine.start("地下城探险")
+    assert not result.ok
+    assert engine.current_options == []
+
+    result = engine.retry()
+    assert result.ok
+    assert len(engine.current_options) == 4
+    engine.close()
+
+
+def test_generate_async():
+    engine = make_engine()
+    request = engine.new_game("地下城探险")
+    deltas = []
+    text = asyncio.run(engine.generate_async(request, on_delta=deltas.append))
+    assert text == RESPONSE
+    assert deltas == [RESPONSE]
+    assert engine.complete_turn(text).ok
+    engine.close()
+
+
+def test_session_store_evicts_oldest():
+    store = SessionStore(max_sessions=2)
+    first = store.create(make_engine())
+    second = store.create(make_engine())
+    first.last_active -= 10
+    third = store.create(make_engine())
+    assert store.get(first.session_id) is None
+    assert store.get(second.session_id) is second
+    assert store.get(third.session_id) is third
+    assert len(store) == 2
+
+
+def test_json_output_strategies():
+    options = ["点燃火把-照亮前方", "原路返回-回到地面", "检查墙壁-寻找文字", "大声呼喊-等待回应"]
+    body = json.dumps({"story": "你推开石门。", "options": options}, ensure_ascii=False)
+    engine = make_engine([body, "好的：\n" + body, "完全无法解析的输出", RESPONSE])
+    engine.enable_json_output()
+    request = engine.new_game("地下城探险")
+    assert request.json_output and '"story"' in request.system_prompt
+    assert engine.complete_turn(engine.generate(request)).options == options
+    assert engine.choose(1).ok
+    assert not engine.choose(1).ok
+    assert engine.retry().ok  # JSON输出模式下，纯文本响应仍能由后面的策略解析
+
+    stats = engine.parse_stats.snapshot()[engine.current_model]
+    assert stats['turns'] == 4 and stats['retries'] == 1
+    assert {name: s['count'] for name, s in stats['strategies'].items()} == {'json': 1, 'json_recovered': 1, 'text': 1}
+    engine.close()
+
+
+def test_parse_routes():
+    table = parse_routes("opening=qwen-turbo; continuation=qwen-max@40,qwen-turbo；repair=qwen-turbo")
+    assert [route.model for route in table['continuation']] == ["qwen-max", "qwen-turbo"]
+    assert table['continuation'][0].timeout == 40.0 and table['continuation'][1].timeout is None
+    assert ModelRouter(table).spec() == "opening=qwen-turbo; continuation=qwen-max@40,qwen-turbo; repair=qwen-turbo"
+    for spec in ("unknown=qwen-turbo", "opening=", "opening=qwen-max@fast"):
+        try:
+            parse_routes(spec)
+            assert False, "应当抛出 ValueError"
+        except ValueError:
+            pass
+
+
+def test_routing_falls_back_on_parse_failure():
+    models = []
+
+    def fn(model, system_prompt, user_prompt):
+        models.append(model)
+        return "快速模型的输出没有选项" if model == "fast" else RESPONSE
+
+    engine = GameEngine(CallableBackend(fn))
+    engine.enable_routing("opening=fast,heavy; continuation=heavy; repair=fast")
+    assert engine.start("地下城探险", "qwen-turbo").ok
+    assert models == ["fast", "heavy"]
+    assert engine.last_route['model'] == "heavy"
+    assert [attempt['outcome'] for attempt in engine.last_route['attempts']] == ["parse_failed", "ok"]
+
+    assert engine.choose(1).ok and models[-1] == "heavy"
+    request = engine.begin_retry()
+    assert request.kind == "repair" and request.model == "fast"
+    stats = engine.router.snapshot()
+    assert stats['opening']['fast']['parse_failed'] == 1 and stats['opening']['heavy']['ok'] == 1
+    assert [entry['turn'] for entry in engine.route_log] == [1, 2]
+
+    engine.memory.summarize_fn("", "新的情节", 100)  # 未配置摘要路由时使用玩家填写的模型
+    assert models[-1] == "qwen-turbo"
+    engine.close()
+
+
+def test_fallback_response_is_cached_and_parsed_once():
+    def fn(model, system_prompt, user_prompt):
+        return "快速模型的输出没有选项" if model == "fast" else RESPONSE
+
+    parses = []
+    original_parse = game_engine.parse_response
+
+    def counting_parse(text, json_output=False):
+        parses.append(text)
+        return original_parse(text, json_output)
+
+    game_engine.parse_response = counting_parse
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = GameEngine(CallableBackend(fn))
+            engine.enable_routing("opening=fast,heavy")
+            engine.enable_cache(LLMResponseCache(os.path.join(tmp, "cache.sqlite3")))
+            request = engine.new_game("地下城探险")
+            assert engine.complete_turn(engine.generate(request)).ok
+            assert parses == ["快速模型的输出没有选项", RESPONSE]  # 每个响应只解析一次
+            row = engine.response_cache._connect().execute("SELECT model FROM responses").fetchone()
+            assert row[0] == "heavy"  # 按实际给出响应的模型记录
+            engine.close()
+    finally:
+        game_engine.parse_response = original_parse
+
+
+def test_async_cache_runs_off_event_loop():
+    class RecordingCache(LLMResponseCache):
+        threads = []
+
+        def get(self, key):
+            self.threads.append(threading.get_ident())
+            return super().get(key)
+
+        def put(self, key, model, response):
+            self.threads.append(threading.get_ident())
+            return super().put(key, model, response)
+
+    async def run(engine):
+        loop_thread = threading.get_ident()
+        text = await engine.generate_async(engine.new_game("地下城探险"))
+        return loop_thread, text
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine()
+        engine.enable_cache(RecordingCache(os.path.join(tmp, "cache.sqlite3")))
+        loop_thread, text = asyncio.run(run(engine))
+        assert text == RESPONSE
+        assert len(RecordingCache.threads) == 2 and loop_thread not in RecordingCache.threads  # 读和写都不在事件循环线程中
+        engine.close()
+
+
+class SlowModelBackend(LoopThreadBackend):
+    """名为 slow 的模型要很久才返回，用来测试降级链的超时。"""
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = 0
+
+    async def acomplete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        try:
+            await asyncio.sleep(5 if model == "slow" else 0)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return LLMResult(RESPONSE)
+
+    async def astream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        yield (await self.acomplete(model, system_prompt, user_prompt, max_tokens, top_p, json_output, trace)).text
+
+
+def test_routing_falls_back_on_timeout():
+    backend = SlowModelBackend()
+    engine = GameEngine(backend)
+    engine.enable_routing("opening=slow@0.1,fast; continuation=slow@0.1,fast")
+    fallbacks = []
+    request = engine.new_game("地下城探险")
+    text = engine.generate(request, on_delta=lambda delta: None, on_fallback=lambda *args: fallbacks.append(args))
+    assert engine.complete_turn(text).ok
+    assert fallbacks == [("slow", "fast", "timeout")]
+    assert engine.last_route['model'] == "fast" and engine.last_route['attempts'][0]['outcome'] == "timeout"
+
+    request = engine.begin_choice(engine.option_for(1))
+    assert asyncio.run(engine.generate_async(request)) == RESPONSE
+    assert engine.last_route['model'] == "fast"
+    assert backend.cancelled == 2
+    engine.close()
+
+
+def test_new_game_cancels_inflight_generation():
+    backend = SlowModelBackend()
+    engine = GameEngine(backend)
+    request = engine.new_game("地下城探险", model="slow")
+    outcome = []
+    worker = threading.Thread(target=lambda: outcome.append(_generate_or_cancelled(engine, request)))
+    worker.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    fresh = engine.new_game("太空冒险", model="fast")
+    worker.join(2)
+    assert not worker.is_alive() and time.perf_counter() - start < 1
+    assert outcome == ["cancelled"]
+    time.sleep(0.05)
+    assert backend.cancelled == 1  # 网络请求被中止，而不只是结果被丢弃
+    assert fresh.generation == request.generation + 1 == engine.generation
+    assert engine.complete_turn(engine.generate(fresh)).ok
+    engine.close()
+
+
+def test_retry_cancels_async_generation():
+    backend = SlowModelBackend()
+    engine = GameEngine(backend)
+    request = engine.new_game("地下城探险", model="slow")
+
+    async def run():
+        task = asyncio.ensure_future(engine.generate_async(request))
+        await asyncio.sleep(0.05)
+        engine.begin_retry()
+        try:
+            await task
+            assert False, "应当抛出 GenerationCancelled"
+        except GenerationCancelled as e:
+            assert e.generation == request.generation
+
+    asyncio.run(run())
+    assert backend.cancelled == 1
+    engine.close()
+
+
+def test_discarded_branches_are_aborted():
+    backend = SlowModelBackend()
+    engine = GameEngine(backend)
+    engine.enable_speculation(max_concurrency=4)
+    engine.new_game("地下城探险", model="slow")
+    engine.current_options = ["向左走", "向右走"]
+    engine.start_speculation()
+    time.sleep(0.1)
+    branch = engine.claim_branch("向左走")  # 另一个分支的请求被中止
+    time.sleep(0.1)
+    assert engine.speculative_pool.stats['aborted'] == 1 and backend.cancelled == 1
+    engine.cancel_generation()  # 重置时被采用的分支也被中止
+    assert branch.finished.wait(1) and branch.status == "cancelled"
+    engine.close()
+
+
+def test_engine_without_numpy():
+    # numpy 只在开启检索时需要：屏蔽 numpy 后引擎和服务端照常导入，开启检索时报 ImportError 且保持关闭
+    code = (
+        "import sys; sys.modules['numpy'] = None\n"
+        "import game_engine, game_server\n"
+        "engine = game_engine.GameEngine(backend=None)\n"
+        "try:\n"
+        "    engine.enable_retrieval()\n"
+        "except ImportError:\n"
+        "    assert engine.retriever is None\n"
+        "    print('ok')\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.stdout.strip().endswith("ok"), result.stderr
+
+
+def _generate_or_cancelled(engine, request):
+    try:
+        return engine.generate(request)
+    except GenerationCancelled:
+        return "cancelled"
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试对冲请求：慢请求被对冲、先到的有效结果胜出、落后的请求被取消，以及统计
+"""
+
+import asyncio
+
+from async_dashscope import AsyncDashScopeBackend
+from fake_dashscope_server import FakeDashScopeServer
+from hedging import HedgedBackend
+from llm_backend import LLMBackend, LLMError, LLMResult
+from response_parser import parse_text_response
+
+
+class ScriptedBackend(LLMBackend):
+    """按顺序为每次调用安排 (延迟秒数, 文本或异常)，记录调用的模型和被取消的调用。"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.models = []
+        self.cancelled = 0
+
+    async def acomplete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        delay, outcome = self.script.pop(0)
+        self.models.append(model)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return LLMResult(outcome, len(system_prompt) + len(user_prompt), len(outcome))
+
+    async def astream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        result = await self.acomplete(model, system_prompt, user_prompt, max_tokens, top_p, json_output, trace)
+        for i in range(0, len(result.text), 2):
+            yield result.text[i:i + 2]
+
+
+def make_hedged(script, **options):
+    backend = ScriptedBackend(script)
+    return backend, HedgedBackend(backend, min_samples=1, initial_delay=0.05, **options)
+
+
+def test_slow_primary_is_hedged():
+    backend, hedged = make_hedged([(1.0, "慢"), (0.0, "快")], hedge_model="qwen-turbo")
+    trace = {}
+    result = asyncio.run(hedged.acomplete("qwen-max", "系统", "用户", 100, trace=trace))
+    assert result.text == "快"
+    assert backend.models == ["qwen-max", "qwen-turbo"]
+    assert backend.cancelled == 1
+    assert trace['hedged'] and trace['hedge_won']
+    stats = hedged.hedge_snapshot()
+    assert stats['requests'] == 1 and stats['hedged'] == 1 and stats['hedge_wins'] == 1
+    assert stats['hedge_rate'] == 1.0
+    assert stats['extra_tokens'] == len("系统用户")  # 被取消的首个请求按输入估算
+
+
+def test_fast_primary_is_not_hedged():
+    backend, hedged = make_hedged([(0.0, "快")])
+    assert hedged.complete("qwen-max", "系统", "用户", 100).text == "快"
+    assert backend.models == ["qwen-max"]
+    stats = hedged.hedge_snapshot()
+    assert stats['hedged'] == 0 and stats['extra_tokens'] == 0
+
+
+def test_failed_hedge_falls_back_to_primary():
+    backend, hedged = make_hedged([(0.2, "原请求"), (0.0, LLMError("限流", 429))])
+    assert hedged.complete("qwen-max", "系统", "用户", 100).text == "原请求"
+    assert hedged.hedge_stats['hedged'] == 1 and hedged.hedge_stats['hedge_wins'] == 0
+
+
+def test_invalid_result_waits_for_other():
+    backend, hedged = make_hedged([(0.1, "无效"), (0.2, "有效")], validate=lambda text: text != "无效")
+    assert hedged.complete("qwen-max", "系统", "用户", 100).text == "有效"
+
+
+def test_all_failures_raise():
+    backend, hedged = make_hedged([(0.0, LLMError("服务端错误", 500))])
+    try:
+        hedged.complete("qwen-max", "系统", "用户", 100)
+        assert False, "应当抛出 LLMError"
+    except LLMError as e:
+        assert e.status_code == 500
+
+
+def test_fast_failures_are_not_latency_samples():
+    backend, hedged = make_hedged([(0.0, LLMError("服务端错误", 500))] * 3 + [(0.2, "成功")])
+    for _ in range(3):
+        try:
+            hedged.complete("qwen-max", "系统", "用户", 100)
+        except LLMError:
+            pass
+    assert hedged.hedge_delay('complete', "qwen-max") == 0.05  # 仍然没有样本，使用 initial_delay
+    hedged.initial_delay = None
+    assert hedged.complete("qwen-max", "系统", "用户", 100).text == "成功"
+    assert hedged.hedge_delay('complete', "qwen-max") >= 0.2  # 只有成功的请求计入样本
+
+
+def test_delay_follows_percentile():
+    backend, hedged = make_hedged([], percentile=50)
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        hedged._record_latency('complete', "qwen-max", seconds)
+    assert hedged.hedge_delay('complete', "qwen-max") == 0.3
+    assert hedged.hedge_delay('stream', "qwen-max") == 0.05  # 没有样本时使用 initial_delay
+
+
+def test_stream_uses_first_output():
+    backend, hedged = make_hedged([(1.0, "慢慢慢慢"), (0.0, "快快快快")])
+    assert "".join(hedged.stream("qwen-max", "系统", "用户", 100)) == "快快快快"
+    assert backend.cancelled == 1
+    assert hedged.hedge_stats['hedge_wins'] == 1
+
+
+def test_hedged_stream_against_fake_server():
+    server = FakeDashScopeServer(first_token_latency=0.05, slow_rate=0.3, slow_factor=20, seed=3)
+    base_url = server.start()
+    hedged = HedgedBackend(AsyncDashScopeBackend("test-key", base_url), percentile=90, min_samples=3)
+    try:
+        for _ in range(12):
+            story, options = parse_text_response("".join(hedged.stream("qwen-turbo", "系统", "用户", 512)))
+            assert story and len(options) == 4
+        stats = hedged.hedge_snapshot()
+        assert server.stats['slow'] > 0
+        assert stats['hedged'] > 0 and stats['extra_tokens'] > 0
+    finally:
+        hedged.close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
@@ -5,7 +5,8 @@
 """
 
 import json
-import re
+
+from response_parser import recover_json_object
 
 def parse_ai_response(text_response):
     """更强大的AI响应解析器"""
@@ -24,7 +25,7 @@ def parse_ai_response(text_response):
         lambda: fix_and_parse_json(cleaned_response),
         
         # 方法4：尝试解析为Python字典格式
-        lambda: parse_python_dict(cleaned_response)
+        lambda: recover_json_object(cleaned_response)
     ]
     
     for i, method in enumerate(methods):
@@ -69,21 +70,6 @@ def fix_and_parse_json(text):
         # 如果失败，尝试提取JSON部分
         return extract_json_part(text)
 
-def parse_python_dict(text):
-    """尝试解析Python字典格式"""
-    # 查找类似Python字典的格式
-    pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
-    matches = re.findall(pattern, text)
-    
-    if matches:
-        # 尝试将Python字典转换为JSON
-        dict_str = matches[0]
-        # 替换单引号为双引号
-        dict_str = dict_str.replace("'", '"')
-        return json.loads(dict_str)
-    
-    raise ValueError("未找到有效的字典格式")
-
 def validate_response_data(data):
     """验证响应数据的格式"""
     if not isinstance(data, dict):
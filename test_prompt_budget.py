@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试token预算提示词构造
+"""
+
+from prompt_budget import PromptBudget, estimate_tokens_by_chars, output_tokens_for
+
+
+def make_budget(context_window=2000, max_output=600):
+    """使用字符估算器的小窗口预算，便于构造超出预算的情况。"""
+    budget = PromptBudget('test-model', {'test-model': (context_window, max_output)})
+    budget.counter.tokenizer = None
+    return budget
+
+
+def render_user(history):
+    return f"以下是故事记忆：\n{history}\n玩家的选择是：探索森林"
+
+
+def test_fits_without_trimming():
+    budget = make_budget()
+    result = budget.fit("你是文字冒险游戏AI。", "示例格式：……", "故事背景。" * 10, render_user, 500)
+    assert result.trimmed == []
+    assert result.max_tokens == 500
+    assert "示例格式" in result.system_prompt
+    assert result.input_tokens + result.max_tokens <= budget.context_window
+
+
+def test_output_reserved_before_input():
+    budget = make_budget()
+    result = budget.fit("你是文字冒险游戏AI。", "示例" * 400, "很久以前的情节。" * 2000, render_user, 500)
+    # 输出预留不会因为输入过长而减少
+    assert result.max_tokens == 500
+    assert result.input_tokens + result.max_tokens <= budget.context_window
+
+
+def test_trim_order_few_shot_then_history():
+    budget = make_budget()
+    history = "最早的情节。" + "中间的情节。" * 1000 + "最近的情节。"
+    result = budget.fit("你是文字冒险游戏AI。", "示例" * 400, history, render_user, 500)
+    assert result.trimmed[0] == "示例"
+    assert "示例" not in result.system_prompt
+    assert result.trimmed[1].startswith("较早的故事记忆")
+    # 裁剪从最早的部分开始，最近的情节和玩家选择保留
+    assert "最早的情节" not in result.user_prompt
+    assert "最近的情节" in result.user_prompt
+    assert result.user_prompt.endswith("玩家的选择是：探索森林")
+
+
+def test_output_capped_by_model_limit():
+    budget = make_budget(max_output=600)
+    result = budget.fit("系统", "", "", render_user, 5000)
+    assert result.max_tokens == 600
+
+
+def test_estimator():
+    assert estimate_tokens_by_chars("") == 0
+    assert estimate_tokens_by_chars("中文" * 100) > estimate_tokens_by_chars("ab" * 100)
+    assert output_tokens_for(1000) > output_tokens_for(500)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
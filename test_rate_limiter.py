@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试客户端限流：限额的解析和查找、按到达顺序排队、token预约与退还、排队时取消、重新设置限额，以及后端包装
+"""
+
+import asyncio
+import threading
+import time
+
+from cancellation import CancelToken, GenerationCancelled
+from llm_backend import CallableBackend, LLMError
+from rate_limiter import RateLimitedBackend, RateLimiter, parse_limits
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_and_lookup():
+    limiter = RateLimiter("*=5rps,100000tpm; qwen-max=2rps,60000tpm; sk-batch/qwen-turbo=1rps")
+    assert limiter.limit_for("sk-batch", "qwen-turbo").rps == 1
+    assert limiter.limit_for("sk-other", "qwen-max").tpm == 60000
+    assert limiter.limit_for("sk-other", "qwen-plus").rps == 5
+    assert parse_limits(limiter.spec()).keys() == parse_limits("*=5rps,100000tpm; qwen-max=2rps,60000tpm; sk-batch/qwen-turbo=1rps").keys()
+    for spec in ("qwen-max", "qwen-max=5qps"):
+        try:
+            parse_limits(spec)
+            assert False, f"{spec} 应当抛出 ValueError"
+        except ValueError:
+            pass
+
+
+def test_requests_queue_in_arrival_order():
+    clock = FakeClock()
+    limiter = RateLimiter("*=2rps", clock=clock)
+    delays = [limiter.reserve("key", "qwen-turbo", 0).delay for _ in range(5)]
+    assert delays == [0.0, 0.0, 0.5, 1.0, 1.5]  # 突发2个，之后每0.5秒一个
+    assert limiter.queue_depth() == 3
+    assert limiter.wait_time("key", "qwen-turbo") == 2.0
+    assert limiter.reserve("key", "qwen-plus", 0).delay == 0.0  # 各模型的桶互不影响
+
+
+def test_tokens_per_minute_with_refund():
+    clock = FakeClock()
+    limiter = RateLimiter("*=6000tpm", clock=clock)  # 每秒补充100个
+    first = limiter.reserve("key", "qwen-turbo", 5000)
+    assert first.delay == 0.0
+    assert limiter.reserve("key", "qwen-turbo", 2000).delay == 10.0
+    limiter.settle(first, 1000)  # 实际只用了1000个，退还4000个
+    assert limiter.wait_time("key", "qwen-turbo", 3000) == 0.0
+
+
+def test_cancelled_wait_is_refunded():
+    limiter = RateLimiter("*=1rps,600tpm")
+
+    async def run():
+        await limiter.aacquire("key", "qwen-turbo", 600)
+        task = asyncio.ensure_future(limiter.aacquire("key", "qwen-turbo", 600))
+        await asyncio.sleep(0.05)
+        assert limiter.queue_depth() == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert limiter.queue_depth() == 0
+    assert limiter.wait_time("key", "qwen-turbo", 500) < 55  # 被取消的600个已退还
+    assert limiter.wait_time("key", "qwen-turbo") <= 1.0     # 请求数也已退还，下一个请求只等第一个之后的1秒
+
+
+def test_cancel_token_stops_sync_wait():
+    clock = FakeClock()
+    limiter = RateLimiter("*=1rps", clock=clock)
+    limiter.reserve("key", "qwen-turbo", 0)
+    token = CancelToken(generation=1)
+    errors = []
+
+    def wait():
+        try:
+            limiter.acquire("key", "qwen-turbo", 0, cancel_token=token)
+        except GenerationCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    while limiter.queue_depth() == 0:
+        time.sleep(0.01)
+    start = time.perf_counter()
+    token.cancel()
+    thread.join()
+    assert len(errors) == 1 and time.perf_counter() - start < 0.5  # 不等到预约的时刻
+    assert limiter.queue_depth() == 0
+    assert limiter.reserve("key", "qwen-turbo", 0).delay == 1.0  # 被取消的请求不再占用请求数
+
+
+def test_failed_request_is_charged_for_input():
+    clock = FakeClock()
+    limiter = RateLimiter("*=6000tpm", clock=clock)
+
+    def fail(model, system, user):
+        raise LLMError("服务暂时不可用", status_code=503)
+
+    backend = RateLimitedBackend(CallableBackend(fail), limiter, key="key")
+    try:
+        backend.complete("qwen-turbo", "系" * 1000, "用" * 1000, 2000)
+        assert False, "应当抛出 LLMError"
+    except LLMError:
+        pass
+    assert limiter.wait_time("key", "qwen-turbo", 6000) == 20.0  # 输入的2000个已经消耗，只退还 max_tokens
+
+
+def test_set_limits_keeps_unchanged_buckets():
+    clock = FakeClock()
+    limiter = RateLimiter("*=1rps; qwen-max=1rps", clock=clock)
+    limiter.reserve("key", "qwen-turbo", 0)
+    limiter.reserve("key", "qwen-max", 0)
+    limiter.set_limits("*=1rps; qwen-max=1rps")  # 重新开局时应用同样的设置
+    assert limiter.wait_time("key", "qwen-turbo") == 1.0
+    limiter.set_limits("*=1rps; qwen-max=2rps")
+    assert limiter.wait_time("key", "qwen-turbo") == 1.0  # 限额不变的桶保留余额
+    assert limiter.wait_time("key", "qwen-max") == 0.0    # 限额变了的桶重建
+    limiter.set_limit(rps=1)
+    assert limiter.wait_time("key", "qwen-turbo") == 1.0
+
+
+def test_backend_is_limited_across_threads():
+    limiter = RateLimiter("*=20rps")
+    backend = RateLimitedBackend(CallableBackend(lambda model, system, user: "故事"), limiter, key="sk-test")
+    results = []
+
+    def call():
+        results.append(backend.complete("qwen-turbo", "系统", "用户", 100).text)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=call) for _ in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["故事"] * 40
+    assert time.perf_counter() - start >= 0.9  # 突发20个，其余20个每0.05秒一个
+    stats = limiter.snapshot()["sk-test/qwen-turbo"]
+    assert stats['requests'] == 40 and stats['queued'] == 20 and stats['waiting'] == 0
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
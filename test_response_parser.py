@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试流式选项解析器：对任意分段方式，结果都与 parse_text_response 相同
+"""
+
+import random
+
+from parser_corpus import make_corpus
+from response_parser import (StreamingOptionParser, find_object_spans, parse_text_response,
+                             parse_text_response_streaming, recover_json_object)
+
+
+def outcome(func, text):
+    try:
+        return func(text)
+    except ValueError as e:
+        return str(e)
+
+
+def test_matches_regex_parser_on_corpus():
+    for _fmt, text, _story, _options in make_corpus(per_format=20, seed=3):
+        expected = outcome(parse_text_response, text)
+        for chunk_size in (None, 1, 7, 64):
+            actual = outcome(lambda t: parse_text_response_streaming(t, chunk_size), text)
+            assert actual == expected, (chunk_size, text[:80])
+
+
+def test_matches_regex_parser_on_random_text():
+    # 用容易触发各种边界情况的字符拼出随机文本
+    pieces = ["**", "*", "-", "\n", " ", "选项", "### 行动选项", "行动选项", "1. ", "2、", "选项3：", "甲", "乙丙",
+              "选择", "你可以", "：", "   \n\n"]
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+        expected = outcome(parse_text_response, text)
+        for chunk_size in (None, 1, 3):
+            assert outcome(lambda t: parse_text_response_streaming(t, chunk_size), text) == expected, repr(text)
+
+
+def test_options_reported_as_they_complete():
+    text = "故事开头。\n\n### 行动选项\n\n**点燃火把**-照亮四周\n\n**原路返回**-离开这里\n\n**检查墙壁**-寻找机关\n\n**大声呼喊**-呼叫同伴"
+    parser = StreamingOptionParser()
+    seen = []
+    for i in range(0, len(text), 5):
+        seen.extend(parser.feed(text[i:i + 5]))
+        if i == 0:
+            assert parser.boundary is None
+    assert parser.boundary == text.index("### 行动选项")
+    # 最后一个选项要等到结束才知道描述是否完整
+    assert seen == ["点燃火把-照亮四周", "原路返回-离开这里", "检查墙壁-寻找机关"]
+    story, options = parser.finish()
+    assert story == "故事开头。"
+    assert options[3] == "大声呼喊-呼叫同伴"
+
+
+def test_recover_python_dict_with_apostrophes():
+    data = {'story': "船长O'Brien说：'别怕'，墙上刻着{符号}", 'options': ["点燃火把", "原路返回", "it's", '说"走"']}
+    assert recover_json_object("好的，结果如下：\n" + repr(data) + "\n希望你喜欢") == data
+
+
+def test_recover_skips_stray_braces():
+    text = "墙上刻着{奇怪的符号" * 50 + '\n{"story": "结局", "options": ["a", "b", "c", "d"]}'
+    assert recover_json_object(text)['story'] == "结局"
+    # 超过深度上限的对象不记录，外层对象照常记录
+    assert find_object_spans("{" * 100 + "}" * 100) == [(68, 132)]
+    assert find_object_spans("{[}]{}") == [(4, 6)]
+
+
+def test_recover_rejects_garbage():
+    for text in ("", "没有对象", "{" * 1000, "{'story': '未闭合", "{[}]" * 100):
+        try:
+            recover_json_object(text)
+            assert False, text
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试自动重试与熔断：可重试的错误被重试、其他错误直接抛出、流式调用只在产出内容前重试、
+熔断器的断开/试探/恢复，以及对替身服务器的限流和服务端错误
+"""
+
+import asyncio
+import time
+
+from async_dashscope import AsyncDashScopeBackend
+from fake_dashscope_server import FakeDashScopeServer
+from llm_backend import LLMBackend, LLMError, LLMResult, LLMTimeoutError
+from response_parser import parse_text_response
+from retrying import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, RetryingBackend
+
+
+class FlakyBackend(LLMBackend):
+    """按顺序为每次调用安排结果（文本或异常）；流式调用先产出 partial 再抛出异常。"""
+
+    def __init__(self, outcomes, partial=""):
+        self.outcomes = list(outcomes)
+        self.partial = partial
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return LLMResult(outcome, 10, len(outcome))
+
+    def complete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        return self._next()
+
+    def stream(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        if self.partial:
+            yield self.partial
+        yield self._next().text
+
+    async def acomplete(self, model, system_prompt, user_prompt, max_tokens, top_p=0.9, json_output=False, trace=None):
+        return self._next()
+
+
+def make_retrying(outcomes, **options):
+    backend = FlakyBackend(outcomes, options.pop('partial', ""))
+    options.setdefault('max_delay', 0.01)
+    return backend, RetryingBackend(backend, base_delay=0.001, seed=0, **options)
+
+
+def test_retryable_errors_are_retried():
+    backend, retrying = make_retrying([LLMError("限流", 429), LLMError("服务端错误", 503), LLMTimeoutError("超时"), "成功"])
+    assert retrying.complete("qwen-turbo", "系统", "用户", 100).text == "成功"
+    assert backend.calls == 4
+    stats = retrying.retry_snapshot()
+    assert stats['calls'] == 1 and stats['retries'] == 3 and stats['gave_up'] == 0
+    assert stats['backoff_time'] > 0
+
+
+def test_client_errors_are_not_retried():
+    backend, retrying = make_retrying([LLMError("参数错误", 400), "成功"])
+    try:
+        retrying.complete("qwen-turbo", "系统", "用户", 100)
+        assert False, "应当抛出 LLMError"
+    except LLMError as e:
+        assert e.status_code == 400
+    assert backend.calls == 1 and retrying.retry_stats['retries'] == 0
+
+
+def test_gives_up_after_max_retries():
+    backend, retrying = make_retrying([LLMError("服务端错误", 500)] * 3, max_retries=2)
+    try:
+        retrying.complete("qwen-turbo", "系统", "用户", 100)
+        assert False, "应当抛出 LLMError"
+    except LLMError as e:
+        assert e.status_code == 500
+    assert backend.calls == 3
+    assert retrying.retry_stats['retries'] == 2 and retrying.retry_stats['gave_up'] == 1
+
+
+def test_retry_after_is_honored():
+    backend, retrying = make_retrying([LLMError("限流", 429, retry_after=0.05), "成功"], max_delay=1.0)
+    start = time.perf_counter()
+    assert asyncio.run(retrying.acomplete("qwen-turbo", "系统", "用户", 100)).text == "成功"
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_stream_retries_only_before_output():
+    backend, retrying = make_retrying([LLMError("服务端错误", 500), "故事"])
+    assert "".join(retrying.stream("qwen-turbo", "系统", "用户", 100)) == "故事"
+    assert backend.calls == 2
+
+    backend, retrying = make_retrying([LLMError("服务端错误", 500), "故事"], partial="已显示")
+    chunks = []
+    try:
+        for chunk in retrying.stream("qwen-turbo", "系统", "用户", 100):
+            chunks.append(chunk)
+        assert False, "应当抛出 LLMError"
+    except LLMError:
+        pass
+    assert chunks == ["已显示"] and backend.calls == 1  # 已经产出内容，不重试
+
+
+def test_breaker_opens_and_recovers():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=10, clock=lambda: now[0])
+    assert not breaker.record_failure()
+    assert breaker.record_failure() and breaker.state == OPEN
+    assert not breaker.allow()
+    now[0] = 10.0
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()  # 只放行一个试探请求
+    assert breaker.record_failure() and breaker.state == OPEN  # 试探失败，再断开一个冷却期
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.opens == 2
+
+
+def test_open_breaker_fails_fast():
+    backend, retrying = make_retrying([LLMError("服务端错误", 502)] * 3, max_retries=5, failure_threshold=3, cooldown=60)
+    try:
+        retrying.complete("qwen-turbo", "系统", "用户", 100)
+        assert False, "应当抛出 LLMError"
+    except LLMError as e:
+        assert e.status_code == 502
+    assert backend.calls == 3  # 熔断后不再重试
+    try:
+        retrying.complete("qwen-turbo", "系统", "用户", 100)
+        assert False, "应当抛出 CircuitOpenError"
+    except CircuitOpenError:
+        pass
+    assert backend.calls == 3
+    stats = retrying.retry_snapshot()
+    assert stats['breaker_opens'] == 1 and stats['rejected'] == 1
+    assert stats['breakers']['FlakyBackend']['state'] == OPEN
+
+
+def test_retries_against_fake_server():
+    server = FakeDashScopeServer(rate_429=0.2, rate_5xx=0.2, seed=5)
+    base_url = server.start()
+    retrying = RetryingBackend(AsyncDashScopeBackend("test-key", base_url), max_retries=8, base_delay=0.01, max_delay=0.02,
+                               failure_threshold=100)
+    try:
+        for _ in range(10):
+            story, options = parse_text_response("".join(retrying.stream("qwen-turbo", "系统", "用户", 512)))
+            assert story and len(options) == 4
+        stats = retrying.retry_snapshot()
+        assert stats['retries'] > 0 and stats['gave_up'] == 0
+        assert list(stats['breakers']) == [base_url.split("//")[1]]
+    finally:
+        retrying.close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试回合日志的全文索引：短语和多词查询、按局过滤、增量更新，以及随日志写入自动更新
+"""
+
+import os
+import tempfile
+
+from game_engine import GameEngine
+from llm_backend import CallableBackend
+from story_index import StoryIndex, parse_query
+from test_game_engine import RESPONSE
+from turn_journal import TurnJournal
+
+
+def write_sessions(path):
+    """写入两局，返回各局的编号（start 记录的偏移）。"""
+    journal = TurnJournal(path, fsync_interval=0)
+    sessions = []
+    for background, stories in (
+        ("## 故事背景\n地下城探险", ["你推开沉重的石门，潮湿的空气里混着铁锈的味道。", "火把照亮了墙上的古老文字。"]),
+        ("## 故事背景\n星际漂流", ["晨星号缓缓降落在X-17星球表面。", "你推开舱门，看见一片紫色的森林。"]),
+    ):
+        journal.append({'type': 'start', 'time': 0, 'background': background})
+        journal.flush()
+        sessions.append(journal.start_offset)
+        for turn, story in enumerate(stories, 1):
+            journal.append({'type': 'turn', 'seq': turn, 'turn': turn, 'kind': 'continuation',
+                            'choice': "检查墙壁" if turn > 1 else None, 'raw': story, 'ok': True, 'story': story})
+    journal.close()
+    return sessions
+
+
+def test_parse_query():
+    assert parse_query('石门  "紫色的 森林" ＡＢ') == ["石门", "紫色的 森林", "ab"]
+
+
+def test_phrase_and_session_queries():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journal.jsonl")
+        first, second = write_sessions(path)
+        index = StoryIndex(path, os.path.join(tmp, "index.sqlite3"))
+        assert index.update() == 6
+
+        hits = index.search("你推开")
+        assert [(hit.session, hit.turn) for hit in hits] == [(second, 2), (first, 1)]  # 最新的在前
+        assert "你推开舱门" in hits[0].snippet and hits[0].title == "星际漂流"
+
+        assert [hit.turn for hit in index.search("你推开", session=first)] == [1]
+        assert index.search("石门 铁锈")[0].session == first      # 多个词都要出现
+        assert index.search("石门 森林") == []
+        assert index.search("推开石门") == []                     # 两字都出现但不连续，核对时排除
+        assert [hit.session for hit in index.search("紫")] == [second]  # 单字查询
+        assert index.search("x-17")[0].session == second         # 大小写不敏感
+        assert index.search("检查墙壁")[0].turn == 2              # 玩家的选择也可以搜索
+        assert [session for session, *_ in index.sessions()] == [second, first]
+
+
+def test_incremental_update():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journal.jsonl")
+        first, _ = write_sessions(path)
+        index = StoryIndex(path, os.path.join(tmp, "index.sqlite3"))
+        index.update()
+        assert index.update() == 0
+
+        with open(path, 'ab') as f:
+            f.write(b'{"type": "turn", "turn": 3, "ok": true, "story": "\xe9\xbe\x99')  # 写了一半的行
+        assert index.update() == 0
+        with open(path, 'ab') as f:
+            f.write(f'", "start_offset": {first}}}\n'.encode('utf-8'))
+        assert index.update() == 1
+        assert index.search("龙")[0].turn == 3
+
+        os.remove(path)  # 日志被删除后重新开始，旧索引作废
+        write_sessions(path)
+        index.update()
+        assert index.stats()['docs'] == 6
+
+
+def test_index_follows_journal():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journal.jsonl")
+        journal = TurnJournal(path, fsync_interval=0.01)
+        index = StoryIndex(path, os.path.join(tmp, "index.sqlite3"))
+        journal.listeners.append(index.update)
+        engine = GameEngine(CallableBackend(lambda model, system, user: RESPONSE))
+        engine.enable_journal(journal)
+        engine.start("地下城探险")
+        engine.choose(1)
+        journal.flush()
+
+        hits = index.search("点燃火把", session=journal.start_offset)
+        assert [hit.turn for hit in hits] == [2]
+        engine.close()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试滚动摘要记忆：旧情节折叠进摘要、重置后丢弃旧任务的结果，以及多个实例共用摘要线程池
+"""
+
+import threading
+import time
+
+from story_memory import SUMMARY_WORKERS, RollingSummaryMemory
+
+
+def test_old_segments_fold_into_summary():
+    memory = RollingSummaryMemory(keep_recent=2, summarize_fn=lambda previous, new, limit: previous + new.replace('\n', ''))
+    for i in range(5):
+        memory.add_segment(f"第{i}段。")
+    assert memory.wait_idle(5)
+    assert memory.summary == "第0段。第1段。第2段。" and memory.recent == ["第3段。", "第4段。"]
+    assert memory.pending == []
+    memory.close()
+
+
+def test_reset_discards_running_fold():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_summarize(previous, new, limit):
+        started.set()
+        release.wait(5)
+        return "旧游戏的摘要"
+
+    memory = RollingSummaryMemory(keep_recent=1, summarize_fn=slow_summarize)
+    memory.add_segment("第一段。")
+    memory.add_segment("第二段。")
+    assert started.wait(5)
+    memory.reset("新的背景")
+    release.set()
+    assert memory.wait_idle(5)
+    assert memory.summary == ""
+    memory.close()
+
+
+def test_sessions_share_summary_threads():
+    release = threading.Event()
+
+    def slow_summarize(previous, new, limit):
+        release.wait(5)
+        return new
+
+    before = threading.active_count()
+    memories = [RollingSummaryMemory(keep_recent=1, summarize_fn=slow_summarize) for _ in range(50)]
+    for memory in memories:
+        memory.add_segment("第一段。")
+        memory.add_segment("第二段。")
+    time.sleep(0.1)
+    assert threading.active_count() - before <= SUMMARY_WORKERS  # 不是每个会话一个线程
+    release.set()
+    for memory in memories:
+        assert memory.wait_idle(5) and memory.summary == "第一段。"
+        memory.close()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
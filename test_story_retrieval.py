@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试检索增强的故事记忆：切分片段、向量检索、排除最近原文、尾部合并前后结果一致，以及引擎把早前情节放进提示词
+"""
+
+import numpy as np
+
+from game_engine import GameEngine
+from llm_backend import CallableBackend
+from story_memory import local_summarize
+from story_retrieval import StoryRetriever, hash_ngrams, split_chunks
+from test_game_engine import RESPONSE
+
+SEGMENTS = [
+    "铁匠老周把一把刻着狼头的青铜匕首交给你，说这是你父亲留下的。",
+    "你们穿过幽暗的森林，远处传来狼嚎。",
+    "城门口的卫兵盘问你的来历，你报上了假名。",
+    "酒馆老板娘悄悄告诉你，北边的矿坑最近闹鬼。",
+    "你在集市上买了一张泛黄的地图，上面标着一座废弃的灯塔。",
+]
+
+
+def test_split_chunks():
+    text = "第一句很短。第二句也很短！" + "长" * 250 + "。最后一句？"
+    chunks = split_chunks(text, max_chars=100)
+    assert chunks[0] == "第一句很短。第二句也很短！"
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+def test_hash_ngrams_is_deterministic():
+    features, counts = hash_ngrams("**青铜匕首**\n青铜匕首")
+    again, _ = hash_ngrams("青铜匕首青铜匕首")  # 空白和Markdown标记被忽略
+    assert np.array_equal(features, again)
+    assert np.all(np.diff(features) > 0) and counts.max() == 2
+
+
+def test_search_ranks_relevant_passage():
+    retriever = StoryRetriever()
+    for text in SEGMENTS:
+        retriever.add_segment(text)
+    results = retriever.search("拔出父亲留下的青铜匕首")
+    assert results[0][1] == SEGMENTS[0] and results[0][2] == 0
+    assert retriever.search("按地图去找灯塔", k=1)[0][2] == 4
+    assert all(segment < 4 for _, _, segment in retriever.search("按地图去找灯塔", before_segment=4))  # 最近一段仍是原文
+    assert retriever.search("完全无关的外星飞船") == []
+
+
+def test_merge_does_not_change_results():
+    rng = np.random.default_rng(0)
+    texts = ["".join(chr(0x4e00 + int(code)) for code in rng.integers(0, 300, 80)) for _ in range(200)]
+    merged = StoryRetriever(tail_size=500)   # 添加过程中多次排序、合并
+    unmerged = StoryRetriever(tail_size=10 ** 9)  # 全部留在尾部
+    for text in texts:
+        merged.add_segment(text)
+        unmerged.add_segment(text)
+    for query in texts[:20]:
+        a = merged.search(query[:30], k=5, min_score=0.0)
+        b = unmerged.search(query[:30], k=5, min_score=0.0)
+        assert [segment for _, _, segment in a] == [segment for _, _, segment in b]
+        assert np.allclose([score for score, _, _ in a], [score for score, _, _ in b], atol=1e-6)
+
+
+def test_engine_recalls_early_details():
+    prompts = []
+    responses = [SEGMENTS[0] + RESPONSE[RESPONSE.index("\n"):]] + [segment + RESPONSE[RESPONSE.index("\n"):] for segment in SEGMENTS[1:]]
+
+    def fn(model, system_prompt, user_prompt):
+        prompts.append(user_prompt)
+        return responses.pop(0) if responses else RESPONSE
+
+    engine = GameEngine(CallableBackend(fn))
+    engine.memory.keep_recent = 2
+    engine.memory.summarize_fn = local_summarize  # 摘要不经过后端，prompts 中只有正式请求
+    engine.enable_retrieval(top_k=2)
+    engine.start("地下城探险")
+    for _ in range(4):
+        engine.choose(1)
+    engine.memory.wait_idle(5)
+    engine.current_options[0] = "拔出父亲留下的青铜匕首"
+    engine.choose(1)
+
+    assert "与这个选择相关的早前情节" in prompts[-1]
+    assert "……" + SEGMENTS[0] + "……" in prompts[-1]
+    assert engine.last_retrieved[0][1] == SEGMENTS[0]
+    assert engine.snapshot()['retrieved'] >= 1
+    engine.close()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
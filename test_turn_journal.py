@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试回合日志：后台批量写入、从末尾倒序读取（跳过崩溃时写了一半的行），以及引擎从日志恢复游戏
+"""
+
+import json
+import os
+import tempfile
+
+from game_engine import GameEngine
+from llm_backend import CallableBackend
+from story_index import StoryIndex
+from test_game_engine import RESPONSE
+from turn_journal import TurnJournal, iter_records_reversed, read_tail
+
+
+def make_engine(path, responses=None):
+    responses = list(responses or [])
+
+    def fn(model, system_prompt, user_prompt):
+        return responses.pop(0) if responses else RESPONSE
+
+    engine = GameEngine(CallableBackend(fn))
+    engine.enable_journal(TurnJournal(path, fsync_interval=0.01))
+    return engine
+
+
+def test_records_are_batched_and_read_backwards():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journal.jsonl")
+        journal = TurnJournal(path, fsync_interval=0.5)
+        journal.append({'type': 'start', 'background': "背景"})
+        for i in range(1, 201):
+            journal.append({'type': 'turn', 'seq': i, 'story': "情节" * 50})
+        journal.close()
+        assert journal.stats['records'] == 201
+        assert journal.stats['batches'] < 201  # 一批记录只 fsync 一次
+
+        with open(path, 'ab') as f:
+            f.write(b'{"type": "turn", "seq": 201, "sto')  # 崩溃时写了一半的最后一行
+        with open(path, 'rb') as f:
+            records = [record for _, record in iter_records_reversed(f, block_size=1000)]
+        assert [record['seq'] for record in records[:3]] == [200, 199, 198]
+        assert records[-1]['type'] == 'start'
+
+        start, turns, read = read_tail(path, 5)
+        assert start['background'] == "背景" and start['start_offset'] == 0
+        assert [record['seq'] for record in turns] == [196, 197, 198, 199, 200]
+        assert read == 6  # 最后5轮加上按偏移直接读取的开始记录
+
+
+def test_new_game_after_torn_tail():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journal.jsonl")
+        engine = make_engine(path)
+        engine.start("上一局的背景")
+        engine.choose(1)
+        engine.close()
+        with open(path, 'ab') as f:
+            f.write(b'{"type": "turn", "seq": 3, "sto')  # 崩溃时写了一半的最后一行
+
+        engine = make_engine(path)
+        engine.start("地下城探险")
+        engine.close()
+        start, turns, _ = read_tail(path, 10)
+        assert "地下城探险" in start['background']  # 新的开始记录没有接在半行后面
+        assert [record['turn'] for record in turns] == [1]
+        with open(path, 'rb') as f:
+            f.seek(start['start_offset'])
+            assert json.loads(f.readline())['type'] == 'start'
+
+        index = StoryIndex(path, os.path.join(tmp, "index.sqlite3"))
+        index.update()
+        assert len(index.sessions()) == 2
+
+
+def test_resume_restores_latest_game():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journal.jsonl")
+        engine = make_engine(path)
+        engine.start("上一局的背景")
+        engine.start("地下城探险", "qwen-turbo", "300-500")
+        engine.choose(1)
+        engine.choose(3)
+        expected = engine.story_store.prompt_text()
+        summary = engine.memory.checkpoint()
+        engine.close()
+
+        resumed = make_engine(path)
+        assert resumed.resume()
+        assert resumed.turn == 3
+        assert resumed.story_store.prompt_text() == expected
+        assert resumed.memory.checkpoint() == summary
+        assert resumed.current_options[0] == "点燃火把-照亮前方的走廊。"
+        assert resumed.last_player_choice == "检查墙壁-墙上似乎刻着文字。"
+
+        # 恢复后继续游戏，新的回合接在同一局后面
+        resumed.choose(2)
+        resumed.close()
+        start, turns, _ = read_tail(path, 2)
+        assert "地下城探险" in start['background']
+        assert [record['turn'] for record in turns] == [3, 4]
+
+
+def test_resume_only_shows_recent_turns():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journal.jsonl")
+        engine = make_engine(path)
+        engine.start("地下城探险")
+        for _ in range(9):
+            engine.choose(1)
+        engine.close()
+
+        resumed = make_engine(path)
+        assert resumed.resume(max_turns=3)
+        assert resumed.turn == 10
+        assert "前7轮的记录已省略" in resumed.story_store.prompt_text()
+        assert len(resumed.memory.recent) == len(engine.memory.recent)
+        resumed.close()
+
+
+def test_resume_after_parse_failure_can_retry():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journal.jsonl")
+        engine = make_engine(path, [RESPONSE, "这段响应没有任何选项"])
+        engine.start("地下城探险")
+        assert not engine.choose(2).ok
+        engine.close()
+
+        with open(path, encoding='utf-8') as f:
+            last = json.loads(f.readlines()[-1])
+        assert last['raw'] == "这段响应没有任何选项" and last['choice'] == "原路返回-回到地面寻找同伴。"
+
+        resumed = make_engine(path)
+        assert resumed.resume()
+        assert resumed.current_options == []
+        result = resumed.retry()
+        assert result.ok and resumed.turn == 2
+        assert resumed.story_store.prompt_text().count("我的选择是") == 1
+        resumed.close()
+
+
+def test_resume_without_journal_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, "journal.jsonl"))
+        assert not engine.resume()
+        engine.close()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✓ {name}")
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+只追加的回合日志：每开始一局写一条 start 记录（故事背景和设置），每完成一轮写一条 turn 记录
+（请求的元数据、原始响应、解析出的情节和选项、玩家的选择，以及当时的记忆快照）。
+
+写入由后台线程完成：append() 只把记录放入队列，调用它的Tk主线程不会等待磁盘；
+后台线程把一段时间内到达的记录攒成一批写入，每批只 fsync 一次。进程崩溃最多丢失最近一批，
+写了一半的最后一行在读取时被跳过；下次打开时先补上换行，新记录不会接在这半行后面。
+
+恢复时从文件末尾向前按块读取，只读到最近一局最后 max_turns 轮（每条 turn 记录都带有记忆快照，
+不需要重放更早的回合），开始记录按 turn 记录中的 start_offset 直接定位，恢复耗时与日志长度无关。
+一个文件可以依次记录多局，恢复的总是最后一局。
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+DEFAULT_JOURNAL_PATH = "game_journal.jsonl"
+FSYNC_INTERVAL = 0.2  # 秒；攒一批记录的最长等待时间
+MAX_BATCH = 256
+READ_BLOCK = 64 * 1024
+
+START = "start"
+TURN = "turn"
+
+
+class _Marker:
+    """写入线程的控制消息：flush 或 close。"""
+
+    def __init__(self, close=False):
+        self.close = close
+        self.done = threading.Event()
+
+
+class TurnJournal:
+    """
+    回合日志的写入端。
+
+    path             日志文件（JSON Lines，UTF-8）
+    fsync_interval   攒一批记录的最长等待时间（秒）；0 表示每条记录到达就写入并 fsync
+    """
+
+    def __init__(self, path, fsync_interval=FSYNC_INTERVAL, max_batch=MAX_BATCH):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self.start_offset = None  # 当前这一局 start 记录在文件中的偏移，写入 turn 记录时附上
+        self.stats = {'records': 0, 'batches': 0, 'bytes': 0, 'fsync_time': 0.0}
+        self.listeners = []  # 每批记录写入并 fsync 后在写入线程中调用的函数（例如更新全文索引）
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def append(self, record):
+        """放入一条记录后立即返回；记录放入后不应再被修改。"""
+        with self._lock:
+            if self._closed:
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put(record)
+
+    def flush(self, timeout=None):
+        """等待此前放入的记录全部写入并 fsync（供测试、基准和退出前使用）。"""
+        return self._send(_Marker(), timeout)
+
+    def close(self, timeout=None):
+        """写完剩余的记录后停止写入线程。"""
+        with self._lock:
+            if self._closed:
+                return True
+            self._closed = True
+            started = self._thread is not None
+        return self._send(_Marker(close=True), timeout) if started else True
+
+    def _send(self, marker, timeout):
+        with self._lock:
+            if self._thread is None:
+                return True
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    # ------------------------------------------------------------------
+    # 写入线程
+    # ------------------------------------------------------------------
+    def _run(self):
+        with open(self.path, 'a+b') as f:
+            self._repair_tail(f)
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.fsync_interval
+                # 攒一批：直到等待超时、批次已满或遇到控制消息
+                while len(batch) < self.max_batch and not isinstance(batch[-1], _Marker):
+                    timeout = deadline - time.monotonic()
+                    try:
+                        batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                records = [item for item in batch if not isinstance(item, _Marker)]
+                if records:
+                    self._write_batch(f, records)
+                marker = batch[-1] if isinstance(batch[-1], _Marker) else None
+                if marker is not None:
+                    marker.done.set()
+                    if marker.close:
+                        return
+
+    @staticmethod
+    def _repair_tail(f):
+        """上次崩溃时最后一行只写了一半：补一个换行结束它（读取时跳过），不改写已有内容。"""
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.seek(0, os.SEEK_END)  # 之后用 tell() 记录 start 的偏移
+
+    def _write_batch(self, f, records):
+        try:
+            for record in records:
+                if record.get('type') == START:
+                    self.start_offset = f.tell()
+                elif self.start_offset is not None and 'start_offset' not in record:
+                    record['start_offset'] = self.start_offset
+                data = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+                f.write(data)
+                self.stats['bytes'] += len(data)
+            f.flush()
+            start = time.perf_counter()
+            os.fsync(f.fileno())
+            self.stats['fsync_time'] += time.perf_counter() - start
+        except OSError as e:
+            print(f"写入回合日志失败: {e}")  # 调试信息
+            return
+        self.stats['records'] += len(records)
+        self.stats['batches'] += 1
+        for listener in list(self.listeners):
+            try:
+                listener()
+            except Exception as e:
+                print(f"回合日志的监听函数出错: {e}")  # 调试信息
+
+    def summary(self):
+        stats = dict(self.stats)
+        return (f"回合日志: {stats['records']}条记录，{stats['batches']}次fsync"
+                f"（共{stats['fsync_time'] * 1000:.1f}ms），{stats['bytes'] / 1024:.1f}KB")
+
+
+# ----------------------------------------------------------------------
+# 读取
+# ----------------------------------------------------------------------
+def iter_records_reversed(f, block_size=READ_BLOCK):
+    """从文件末尾向前逐条产出 (偏移, 记录)；无法解析的行（崩溃时写了一半）被跳过。"""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    tail = b""
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        lines = (f.read(size) + tail).split(b"\n")
+        # 第一行可能不完整，留到读取前一块时拼接
+        tail = lines.pop(0)
+        offset = position + len(tail) + 1 + sum(len(line) + 1 for line in lines)
+        for line in reversed(lines):
+            offset -= len(line) + 1
+            record = parse_line(line)
+            if record is not None:
+                yield offset, record
+    record = parse_line(tail)
+    if record is not None:
+        yield 0, record
+
+
+def parse_line(line):
+    """解析一行（bytes）记录，空行、写了一半或损坏的行返回 None。"""
+    if not line.strip():
+        return None
+    try:
+        record = json.loads(line.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def read_record_at(f, offset):
+    """读取从 offset 开始的一条记录。"""
+    f.seek(offset)
+    return parse_line(f.readline())
+
+
+def read_tail(path, max_turns):
+    """
+    读取最后一局：返回 (start 记录, 最后不超过 max_turns 条 turn 记录（从旧到新）, 读取的记录数)。
+    文件不存在或没有任何一局时返回 (None, [], 0)。
+    """
+    if not os.path.exists(path):
+        return None, [], 0
+    start = None
+    turns = []
+    read = 0
+    with open(path, 'rb') as f:
+        for offset, record in iter_records_reversed(f):
+            read += 1
+            if record.get('type') == START:
+                start = dict(record, start_offset=offset)
+                break
+            if record.get('type') == TURN:
+                turns.append(record)
+                if len(turns) >= max_turns:
+                    break
+        if start is None and turns and turns[-1].get('start_offset') is not None:
+            offset = turns[-1]['start_offset']
+            record = read_record_at(f, offset)
+            if record is not None and record.get('type') == START:
+                start = dict(record, start_offset=offset)
+                read += 1
+    if start is None:
+        return None, [], read
+    turns.reverse()
+    return start, turns, read